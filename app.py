@@ -1,14 +1,23 @@
 import tkinter as tk
-from tkinter import messagebox, simpledialog, ttk
-from tkinter import font as tkfont
+from tkinter import filedialog, messagebox, simpledialog, ttk
 import csv
 import os
 import datetime
 from datetime import date
-from PIL import Image, ImageTk
+
+from ledger import (
+    ColumnarRows, ExpenseLedger, ExpenseQuery, FilteredRows, format_cents, open_storage, parse_cents, parse_date,
+    validate_expense
+)
+from ledger.categories import CategoryModel, CategoryStore
+from ledger.config import (
+    ANALYTICS_PERCENTILES, EXPENSE_FILE, IMPORT_REJECTS_FILE, METRICS_CAPTURE, METRICS_FILE, WATCH_POLL_MS,
+    WRITE_FLUSH_MS
+)
+from ledger.instrumentation import metrics
+from ledger.worker import BackgroundWorker
 
 # Constants
-EXPENSE_FILE = 'expenses.csv'
 CURRENCY_FILE = 'currency.txt'
 CATEGORY_FILE = 'categories.txt'
 THEME_COLOR = "#2c3e50"
@@ -28,6 +37,255 @@ ENTRY_FONT = ("Segoe UI", 11)
 TABLE_HEADER_FONT = ("Segoe UI", 10, "bold")
 TABLE_FONT = ("Segoe UI", 9)
 
+# Expense table
+VIRTUAL_TABLE = True
+TABLE_OVERSCAN = 5
+# Delay after the last keystroke in the filter bar before searching
+SEARCH_DELAY_MS = 100
+# Ledger columns the table headings sort by
+HEADING_COLUMNS = {"Date": 'date', "Description": 'description', "Category": 'category', "Amount": 'cents'}
+
+# Summary window
+SUMMARY_ROW_HEIGHT = 58
+SUMMARY_OVERSCAN = 2
+# Statistics are recomputed at most this often while the ledger changes
+STATS_REFRESH_MS = 1000
+
+# Performance overlay in the status bar, toggled with F12
+METRICS_OVERLAY = False
+METRICS_OVERLAY_MS = 1000
+
+class LedgerTable:
+    """Presents a sequence of ledger rows in a ttk.Treeview.
+
+    In virtual mode only the visible window of rows plus a small overscan
+    is materialized, and the same Treeview items are recycled with new
+    values as the view scrolls, so scrolling and resizing cost the same
+    whatever the size of the ledger. Otherwise every row gets an item.
+    """
+    def __init__(self, tree, scrollbar, format_row, virtual=VIRTUAL_TABLE, overscan=TABLE_OVERSCAN):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.format_row = format_row
+        self.virtual = virtual
+        self.overscan = overscan
+        self.rows = []
+        self.first = 0
+        self.items = []
+        
+        if virtual:
+            self.rowheight = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+            self.tree.configure(yscrollcommand="")
+            self.scrollbar.config(command=self.yview)
+            self.tree.bind("<Configure>", lambda e: self.render())
+            self.tree.bind("<MouseWheel>", self.on_mousewheel)
+            self.tree.bind("<Button-4>", lambda e: self.yview("scroll", -3, "units"))
+            self.tree.bind("<Button-5>", lambda e: self.yview("scroll", 3, "units"))
+            self.tree.bind("<Prior>", lambda e: self.yview("scroll", -1, "pages"))
+            self.tree.bind("<Next>", lambda e: self.yview("scroll", 1, "pages"))
+            self.tree.bind("<Home>", lambda e: self.yview("moveto", 0))
+            self.tree.bind("<End>", lambda e: self.yview("moveto", 1))
+        else:
+            self.tree.configure(yscrollcommand=self.scrollbar.set)
+            self.scrollbar.config(command=self.tree.yview)
+    
+    def set_rows(self, rows):
+        """Show a new sequence of rows, rebuilding the table."""
+        self.rows = rows
+        if self.virtual:
+            self.render()
+            return
+        
+        self.tree.delete(*self.tree.get_children())
+        with metrics.measure('treeview_insert', len(rows)):
+            self.items = [self.tree.insert("", "end", values=self.format_row(row)) for row in rows]
+    
+    def append(self, row):
+        """Show a row that was just appended to the row sequence."""
+        if not self.virtual:
+            with metrics.measure('treeview_insert', 1):
+                self.items.append(self.tree.insert("", "end", values=self.format_row(row)))
+        elif len(self.rows) - 1 < self.first + len(self.items):
+            self.render()
+        else:
+            self.update_scrollbar()
+    
+    def extend(self, rows):
+        """Show a batch of rows that were just appended to the row sequence."""
+        if not self.virtual:
+            with metrics.measure('treeview_insert', len(rows)):
+                self.items.extend(self.tree.insert("", "end", values=self.format_row(row)) for row in rows)
+        elif len(self.rows) - len(rows) < self.first + len(self.items) + self.overscan:
+            self.render()
+        else:
+            self.update_scrollbar()
+    
+    def see(self, index):
+        """Scroll so the row at ``index`` is visible."""
+        if not self.virtual:
+            self.tree.see(self.items[index])
+            return
+        
+        visible = self.visible_rows()
+        if index < self.first:
+            self.first = index
+        elif index >= self.first + visible:
+            self.first = index - visible + 1
+        else:
+            return
+        self.render()
+    
+    def row_index(self, item):
+        """Return the index into the row sequence shown by a tree item."""
+        offset = self.items.index(item)
+        return self.first + offset if self.virtual else offset
+    
+    def row_id(self, item):
+        """Return the ledger row ID of the expense shown by a tree item."""
+        index = self.row_index(item)
+        source_index = getattr(self.rows, 'source_index', None)
+        return source_index(index) if source_index else index
+    
+    def visible_rows(self):
+        """Number of rows that fit below the heading at the tree's current height."""
+        return max(1, self.tree.winfo_height() // self.rowheight - 1)
+    
+    def yview(self, *args):
+        """Scrollbar command for the virtual window."""
+        visible = self.visible_rows()
+        if args[0] == "moveto":
+            self.first = int(float(args[1]) * len(self.rows))
+        elif args[0] == "scroll":
+            step = visible if args[2] == "pages" else 1
+            self.first += int(args[1]) * step
+        self.render()
+    
+    def on_mousewheel(self, event):
+        self.yview("scroll", -1 if event.delta > 0 else 1, "units")
+        return "break"
+    
+    def render(self):
+        """Fill the recycled items with the rows of the current window."""
+        total = len(self.rows)
+        visible = self.visible_rows()
+        self.first = max(0, min(self.first, total - visible))
+        count = min(visible + self.overscan, total - self.first)
+        
+        with metrics.measure('treeview_insert', count):
+            while len(self.items) < count:
+                self.items.append(self.tree.insert("", "end"))
+            if len(self.items) > count:
+                self.tree.delete(*self.items[count:])
+                del self.items[count:]
+            
+            for offset, item in enumerate(self.items):
+                self.tree.item(item, values=self.format_row(self.rows[self.first + offset]))
+        
+        # Keep the tree's own scrolling pinned; the window does the scrolling.
+        self.tree.yview_moveto(0)
+        self.update_scrollbar()
+    
+    def update_scrollbar(self):
+        total = len(self.rows)
+        if not total:
+            self.scrollbar.set(0, 1)
+            return
+        last = min(total, self.first + self.visible_rows())
+        self.scrollbar.set(self.first / total, last / total)
+
+class CategoryPicker:
+    """Typeahead over a CategoryStore for a ttk.Combobox.
+
+    The dropdown only ever lists the categories matching what has been
+    typed, so it opens as quickly with thousands of categories as with
+    five. Once the text names a category the full list is offered again.
+    """
+    def __init__(self, combobox, categories):
+        self.combobox = combobox
+        self.categories = categories
+        combobox.configure(postcommand=self.refresh)
+        combobox.bind("<KeyRelease>", self.on_key, add="+")
+    
+    def on_key(self, event):
+        if event.keysym not in ("Up", "Down", "Return", "Escape", "Tab"):
+            self.refresh()
+    
+    def refresh(self):
+        text = self.combobox.get()
+        if self.categories.find(text) is not None:
+            text = ""
+        self.combobox.configure(values=self.categories.matches(text))
+
+class SummaryChart:
+    """Category breakdown drawn as text and bars on a single tk.Canvas.
+
+    Rows are laid out on the canvas's scroll region, but only the ones
+    in view plus a small overscan have canvas items. They are redrawn
+    when the view scrolls, resizes or the data changes, so opening or
+    updating the chart costs the same with five categories or five
+    hundred.
+    """
+    PADDING = 10
+    
+    def __init__(self, canvas, scrollbar, format_amount, row_height=SUMMARY_ROW_HEIGHT, overscan=SUMMARY_OVERSCAN):
+        self.canvas = canvas
+        self.scrollbar = scrollbar
+        self.format_amount = format_amount
+        self.row_height = row_height
+        self.overscan = overscan
+        self.rows = []
+        self.total = 0
+        self.drawn = None
+        
+        canvas.configure(yscrollcommand=self.on_scroll, yscrollincrement=row_height)
+        scrollbar.config(command=canvas.yview)
+        canvas.bind("<Configure>", lambda e: self.layout())
+        canvas.bind("<MouseWheel>", lambda e: canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+        canvas.bind("<Button-4>", lambda e: canvas.yview_scroll(-1, "units"))
+        canvas.bind("<Button-5>", lambda e: canvas.yview_scroll(1, "units"))
+    
+    def set_rows(self, rows, total):
+        """Show ``(category, cents)`` rows as shares of ``total``."""
+        self.rows = rows
+        self.total = total
+        self.layout()
+    
+    def layout(self):
+        self.canvas.configure(scrollregion=(0, 0, self.canvas.winfo_width(), len(self.rows) * self.row_height))
+        self.drawn = None
+        self.render()
+    
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.render()
+    
+    def render(self):
+        """Draw the rows in view, if they aren't drawn already."""
+        canvas = self.canvas
+        top = int(canvas.canvasy(0))
+        first = max(0, top // self.row_height - self.overscan)
+        last = min(len(self.rows), (top + canvas.winfo_height()) // self.row_height + 1 + self.overscan)
+        if (first, last) == self.drawn:
+            return
+        self.drawn = (first, last)
+        
+        canvas.delete("row")
+        left = self.PADDING
+        right = max(left + 1, canvas.winfo_width() - self.PADDING)
+        for index in range(first, last):
+            category, amount = self.rows[index]
+            percentage = (amount / self.total) * 100 if self.total > 0 else 0
+            y = index * self.row_height
+            canvas.create_rectangle(0, y + 3, right + left, y + self.row_height - 3,
+                                    fill=DARK_BG, outline="", tags="row")
+            canvas.create_text(left, y + 8, text=category, anchor="nw",
+                               font=("Segoe UI", 10, "bold"), fill=LIGHT_TEXT, tags="row")
+            canvas.create_text(right, y + 8, text=f"{self.format_amount(amount)} ({percentage:.1f}%)",
+                               anchor="ne", font=("Segoe UI", 9), fill=LIGHT_TEXT, tags="row")
+            canvas.create_rectangle(left, y + 34, right, y + 44, fill=THEME_COLOR, outline="", tags="row")
+            canvas.create_rectangle(left, y + 34, left + (right - left) * percentage / 100, y + 44,
+                                    fill=SUCCESS_COLOR, outline="", tags="row")
+
 class ExpenseTracker:
     def __init__(self, root):
         self.root = root
@@ -38,7 +296,30 @@ class ExpenseTracker:
         
         # Initialize variables
         self.currency = None
-        self.categories = ['Food', 'Transport', 'Entertainment', 'Utilities', 'Shopping']
+        self.categories = CategoryStore(['Food', 'Transport', 'Entertainment', 'Utilities', 'Shopping'])
+        self.category_model = CategoryModel()
+        self.model_task = None
+        self.category_picked = False
+        self.suggest_job = None
+        self.ledger = ExpenseLedger(open_storage())
+        self.worker = BackgroundWorker(self.root)
+        self.ledger_task = None
+        # Counts loads; row IDs held from before one may name other rows
+        self.ledger_generation = 0
+        self.compact_task = None
+        self.flush_job = None
+        self.query = None
+        self.search_job = None
+        self.sort_keys = ()
+        self.summary_window = None
+        self.stats_job = None
+        self.stats_task = None
+        self.stats_stale = False
+        self.export_task = None
+        self.pending_export = None
+        self.metrics_job = None
+        if METRICS_CAPTURE:
+            metrics.start_capture(profile='profile' in METRICS_CAPTURE, memory='memory' in METRICS_CAPTURE)
         
         # Create necessary files
         self.create_files()
@@ -52,22 +333,54 @@ class ExpenseTracker:
         
         # Update views
         self.update_expense_table()
+        self.load_expenses()
+        if WATCH_POLL_MS:
+            self.root.after(WATCH_POLL_MS, self.watch_expenses)
+        
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.bind("<F12>", self.toggle_metrics_overlay)
+        self.root.bind("<Control-F12>", self.export_metrics)
+        self.root.bind("<Shift-F12>", self.toggle_metrics_capture)
+        if METRICS_OVERLAY:
+            self.toggle_metrics_overlay()
+        
+        if getattr(self.ledger.storage, 'repaired', 0):
+            messagebox.showwarning(
+                "Recovered",
+                f"{EXPENSE_FILE} ended with an incomplete record, probably from a crash. "
+                f"It was moved to {EXPENSE_FILE}.torn.",
+                parent=self.root
+            )
+        if self.ledger.storage.unmigrated:
+            messagebox.showwarning(
+                "Unreadable Records",
+                f"{self.ledger.storage.unmigrated} records in {EXPENSE_FILE} couldn't be read and were "
+                f"left out of the converted ledger. {EXPENSE_FILE} is kept unchanged.",
+                parent=self.root
+            )
         
         # Check currency
         if not self.currency:
             self.select_currency_popup()
     
+    def on_close(self):
+        """Stop background work, checkpoint the ledger, export metrics and close the window."""
+        self.worker.shutdown()
+        self.ledger.close()
+        metrics.stop_capture()
+        if METRICS_FILE:
+            try:
+                metrics.export(METRICS_FILE)
+            except OSError:
+                pass
+        self.root.destroy()
+    
     def create_files(self):
         """Create necessary files if they don't exist."""
-        if not os.path.exists(EXPENSE_FILE):
-            with open(EXPENSE_FILE, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(['date', 'description', 'category', 'amount'])
-        
         if not os.path.exists(CURRENCY_FILE):
             with open(CURRENCY_FILE, mode='w') as file:
                 file.write('')
-                
+        
         if not os.path.exists(CATEGORY_FILE):
             with open(CATEGORY_FILE, mode='w') as file:
                 file.write('\n'.join(self.categories))
@@ -82,7 +395,7 @@ class ExpenseTracker:
         """Load categories from file."""
         if os.path.exists(CATEGORY_FILE):
             with open(CATEGORY_FILE, 'r') as file:
-                self.categories = [line.strip() for line in file if line.strip()]
+                self.categories = CategoryStore(line.strip() for line in file if line.strip())
     
     def save_currency(self, currency):
         """Save currency to file."""
@@ -103,22 +416,368 @@ class ExpenseTracker:
         if currency:
             self.save_currency(currency)
             self.currency_label.config(text=f"Currency: {self.currency}")
+            self.update_expense_table()
     
     def load_expenses(self):
-        """Load expenses from CSV file."""
-        expenses = []
-        if os.path.exists(EXPENSE_FILE):
-            with open(EXPENSE_FILE, mode='r') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    expenses.append(row)
-        return expenses
+        """Load expenses from storage on the background worker.
+
+        The table is rebuilt once loading finishes; adding expenses is
+        disabled until then.
+        """
+        if self.ledger_task:
+            return
+        self.add_button.state(["disabled"])
+        self.start_progress("Loading expenses...")
+        self.ledger_task = self.worker.submit(
+            self.read_ledger,
+            name="Loading expenses",
+            on_done=self.on_expenses_loaded,
+            on_error=self.on_task_error,
+            on_progress=self.on_task_progress,
+            on_cancel=self.on_task_cancelled
+        )
+    
+    def watch_expenses(self):
+        """Pick up expenses other programs appended to the ledger file."""
+        self.root.after(WATCH_POLL_MS, self.watch_expenses)
+        if self.ledger_task:
+            return
+        try:
+            expenses = self.ledger.follow()
+        except OSError:
+            return
+        if expenses is None:
+            self.load_expenses()
+        elif expenses:
+            self.category_model.learn(expenses)
+            if self.query or self.sort_keys:
+                self.show_rows()
+            else:
+                self.table.extend(expenses)
+            self.update_total_label()
+    
+    def read_ledger(self, progress=None):
+        """Load the ledger and build its search index; runs on the worker."""
+        with metrics.measure('load_expenses') as measure:
+            rows, aggregates = self.ledger.storage.load(progress)
+            if isinstance(rows, ColumnarRows):
+                rows.search_index.sync()
+            measure.rows = len(rows)
+        return rows, aggregates
+    
+    def import_statement(self):
+        """Bulk import an external CSV such as a bank statement."""
+        if self.ledger_task:
+            messagebox.showinfo("Busy", "Please wait for the current task to finish.", parent=self.root)
+            return
+        path = filedialog.askopenfilename(
+            parent=self.root,
+            title="Import Statement",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        if path:
+            self.import_mapping_popup(path)
+    
+    def import_mapping_popup(self, path):
+        """Ask how the statement's columns map onto expense fields."""
+        from ledger.importer import ImportMapping
+        
+        try:
+            with open(path, mode='r', newline='', encoding='utf-8-sig') as file:
+                sample = file.read(4096)
+            delimiter = csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+        except (OSError, UnicodeDecodeError) as error:
+            messagebox.showerror("Error", f"Could not read {path}: {error}", parent=self.root)
+            return
+        except csv.Error:
+            delimiter = ','
+        header = next(csv.reader(sample.splitlines(), delimiter=delimiter), [])
+        if not header:
+            messagebox.showerror("Error", "The file has no header row.", parent=self.root)
+            return
+        
+        def guess(*names):
+            for column in header:
+                if any(name in column.lower() for name in names):
+                    return column
+            return ""
+        
+        popup = tk.Toplevel(self.root)
+        popup.title("Import Statement")
+        popup.configure(bg=DARK_BG, padx=20, pady=20)
+        popup.transient(self.root)
+        popup.resizable(False, False)
+        
+        fields = {}
+        for row, (key, label, default) in enumerate([
+            ('date', "Date column:", guess('date')),
+            ('description', "Description column:", guess('desc', 'narration', 'memo', 'payee', 'details')),
+            ('amount', "Amount column:", guess('amount', 'debit', 'withdrawal')),
+            ('category', "Category column:", guess('category')),
+        ]):
+            tk.Label(popup, text=label, font=LABEL_FONT, bg=DARK_BG, fg=LIGHT_TEXT).grid(row=row, column=0, sticky="w", pady=3)
+            fields[key] = tk.StringVar(value=default)
+            ttk.Combobox(popup, textvariable=fields[key], values=[""] + header, state="readonly").grid(row=row, column=1, sticky="ew", pady=3)
+        
+        tk.Label(popup, text="Default category:", font=LABEL_FONT, bg=DARK_BG, fg=LIGHT_TEXT).grid(row=4, column=0, sticky="w", pady=3)
+        default_category = tk.StringVar(value=self.categories.names[0] if self.categories else "")
+        category_box = ttk.Combobox(popup, textvariable=default_category)
+        category_box.grid(row=4, column=1, sticky="ew", pady=3)
+        CategoryPicker(category_box, self.categories)
+        
+        tk.Label(popup, text="Date format:", font=LABEL_FONT, bg=DARK_BG, fg=LIGHT_TEXT).grid(row=5, column=0, sticky="w", pady=3)
+        date_format = tk.StringVar(value="%Y-%m-%d")
+        ttk.Entry(popup, textvariable=date_format).grid(row=5, column=1, sticky="ew", pady=3)
+        
+        negate = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            popup,
+            text="Debits are negative amounts",
+            variable=negate,
+            font=LABEL_FONT,
+            bg=DARK_BG,
+            fg=LIGHT_TEXT,
+            selectcolor=DARK_BG,
+            activebackground=DARK_BG
+        ).grid(row=6, column=0, columnspan=2, sticky="w", pady=3)
+        
+        def start():
+            if not all(fields[key].get() for key in ('date', 'description', 'amount')):
+                messagebox.showerror("Error", "Date, description and amount columns are required!", parent=popup)
+                return
+            mapping = ImportMapping(
+                date=fields['date'].get(),
+                description=fields['description'].get(),
+                amount=fields['amount'].get(),
+                category=fields['category'].get() or None,
+                default_category=default_category.get(),
+                date_format=date_format.get() if date_format.get() != "%Y-%m-%d" else None,
+                negate=negate.get(),
+                delimiter=delimiter
+            )
+            popup.destroy()
+            self.run_import(path, mapping)
+        
+        ttk.Button(popup, text="Import", command=start, style="Accent.TButton").grid(row=7, column=0, columnspan=2, pady=(10, 0))
+    
+    def run_import(self, path, mapping):
+        """Stream a statement into the ledger on the background worker."""
+        from ledger.importer import import_statement
+        
+        self.add_button.state(["disabled"])
+        self.start_progress("Importing...")
+        self.ledger_task = self.worker.submit(
+            import_statement,
+            path,
+            mapping,
+            name="Importing",
+            on_publish=self.on_import_batch,
+            on_done=self.on_import_done,
+            on_error=self.on_task_error,
+            on_progress=self.on_task_progress,
+            on_cancel=self.on_task_cancelled
+        )
+    
+    def on_import_batch(self, task, batch):
+        """Write one imported batch and refresh the views once for it."""
+        self.ledger.extend(batch)
+        self.schedule_flush()
+        self.category_model.learn(batch)
+        if self.query or self.sort_keys:
+            self.show_rows()
+        else:
+            self.table.extend(batch)
+        self.update_total_label()
+    
+    def on_import_done(self, task, result):
+        imported, rejected = result
+        self.finish_task(task)
+        message = f"Imported {imported} expenses."
+        if rejected:
+            message += f"\n{rejected} rows were rejected; see {IMPORT_REJECTS_FILE} for details."
+        messagebox.showinfo("Import", message, parent=self.root)
+    
+    def export_popup(self):
+        """Ask which expenses to export and in which format."""
+        from ledger.export import EXPORT_FORMATS
+        
+        if self.export_task:
+            messagebox.showinfo("Busy", "Please wait for the current export to finish.", parent=self.root)
+            return
+        popup = tk.Toplevel(self.root)
+        popup.title("Export Expenses")
+        popup.configure(bg=DARK_BG, padx=20, pady=20)
+        popup.transient(self.root)
+        popup.resizable(False, False)
+        
+        labels = {label: name for name, (label, extension, writer) in EXPORT_FORMATS.items()}
+        tk.Label(popup, text="Format:", font=LABEL_FONT, bg=DARK_BG, fg=LIGHT_TEXT).grid(row=0, column=0, sticky="w", pady=3)
+        format_var = tk.StringVar(value=next(iter(labels)))
+        ttk.Combobox(popup, textvariable=format_var, values=list(labels), state="readonly").grid(row=0, column=1, sticky="ew", pady=3)
+        
+        # Search results are the rows the table shows, in its order
+        source = tk.StringVar(value="search" if self.query else "all")
+        for row, (value, text) in enumerate([("all", "All expenses"), ("search", "Search results")], 1):
+            tk.Radiobutton(
+                popup,
+                text=text,
+                variable=source,
+                value=value,
+                state="normal" if value == "all" or self.query else "disabled",
+                font=LABEL_FONT,
+                bg=DARK_BG,
+                fg=LIGHT_TEXT,
+                selectcolor=DARK_BG,
+                activebackground=DARK_BG
+            ).grid(row=row, column=0, columnspan=2, sticky="w")
+        
+        dates = {}
+        for row, (key, label) in enumerate([('start', "From (YYYY-MM-DD):"), ('end', "To (YYYY-MM-DD):")], 3):
+            tk.Label(popup, text=label, font=LABEL_FONT, bg=DARK_BG, fg=LIGHT_TEXT).grid(row=row, column=0, sticky="w", pady=3)
+            dates[key] = ttk.Entry(popup)
+            dates[key].grid(row=row, column=1, sticky="ew", pady=3)
+        
+        tk.Label(popup, text="Categories:\n(none selected: all)", font=LABEL_FONT, bg=DARK_BG, fg=LIGHT_TEXT,
+                 justify="left").grid(row=5, column=0, sticky="nw", pady=3)
+        names = sorted(set(self.ledger.aggregates.category_totals) | set(self.categories), key=str.casefold)
+        category_list = tk.Listbox(popup, selectmode="multiple", height=8, exportselection=False, font=ENTRY_FONT)
+        category_list.insert(tk.END, *names)
+        category_list.grid(row=5, column=1, sticky="ew", pady=3)
+        
+        def start():
+            try:
+                first, last = (parse_date(text) if text else None
+                               for text in (dates['start'].get().strip(), dates['end'].get().strip()))
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be YYYY-MM-DD", parent=popup)
+                return
+            name = labels[format_var.get()]
+            label, extension, writer = EXPORT_FORMATS[name]
+            path = filedialog.asksaveasfilename(
+                parent=popup,
+                title="Export Expenses",
+                defaultextension=extension,
+                initialfile="expenses" + extension,
+                filetypes=[(label, "*" + extension), ("All files", "*.*")]
+            )
+            if not path:
+                return
+            chosen = [names[index] for index in category_list.curselection()]
+            popup.destroy()
+            self.run_export(path, name, source.get() == "search", first, last, chosen or None)
+        
+        ttk.Button(popup, text="Export", command=start, style="Accent.TButton").grid(row=6, column=0, columnspan=2, pady=(10, 0))
+    
+    def run_export(self, path, format, search, start, end, categories):
+        """Stream the chosen expenses to ``path`` on the background worker."""
+        from ledger.export import export_expenses
+        
+        if not search and self.load_older(start):
+            # Exported once the older months of a partitioned ledger are in
+            self.pending_export = (path, format, search, start, end, categories)
+            return
+        rows = self.table.rows if search else self.ledger.visible()
+        if isinstance(rows, FilteredRows):
+            # The UI edits the view's indices in place, so the worker gets them as they are now
+            rows = FilteredRows(rows.rows, rows.indices[:])
+        self.start_progress("Exporting...")
+        self.export_task = self.worker.submit(
+            export_expenses,
+            rows,
+            path,
+            format,
+            start,
+            end,
+            categories,
+            name="Exporting",
+            on_done=self.on_export_done,
+            on_error=self.on_export_failed,
+            on_progress=self.on_task_progress,
+            on_cancel=self.on_export_failed
+        )
+    
+    def on_export_done(self, task, written):
+        self.export_task = None
+        self.finish_task(task)
+        messagebox.showinfo("Export", f"Exported {written} expenses.", parent=self.root)
+    
+    def on_export_failed(self, task, error=None):
+        self.export_task = None
+        if error is None:
+            self.on_task_cancelled(task)
+        else:
+            self.on_task_error(task, error)
+    
+    def on_expenses_loaded(self, task, result):
+        self.ledger.replace(*result)
+        self.ledger_generation += 1
+        self.update_expense_table()
+        self.finish_task(task)
+        skipped = self.ledger.storage.skipped
+        if skipped:
+            messagebox.showwarning(
+                "Unreadable Records",
+                f"{skipped} records in the ledger file couldn't be read and were left out. "
+                "They are kept in the file unchanged.",
+                parent=self.root
+            )
+        self.schedule_compaction()
+        self.learn_categories()
+        if self.pending_export:
+            export, self.pending_export = self.pending_export, None
+            self.run_export(*export)
+    
+    def on_task_progress(self, task, done, total):
+        if total:
+            self.progress_bar.config(value=100 * done / total)
+            self.status_label.config(text=f"{task.name}... {100 * done // total}%")
+    
+    def on_task_error(self, task, error):
+        self.finish_task(task)
+        messagebox.showerror("Error", f"{task.name} failed: {error}", parent=self.root)
+    
+    def on_task_cancelled(self, task):
+        self.finish_task(task)
+        self.status_label.config(text=f"{task.name} cancelled")
+    
+    def start_progress(self, text):
+        """Show the status bar progress widgets for a background task."""
+        self.status_label.config(text=text)
+        self.progress_bar.config(value=0)
+        self.progress_bar.pack(side="left", padx=10)
+        self.cancel_button.pack(side="left")
+    
+    def finish_task(self, task):
+        """Hide the progress widgets once a background task has ended."""
+        if task is self.ledger_task:
+            self.ledger_task = None
+            self.add_button.state(["!disabled"])
+        if not self.worker.tasks:
+            self.progress_bar.pack_forget()
+            self.cancel_button.pack_forget()
+        self.status_label.config(text="")
+    
+    def cancel_tasks(self):
+        """Cancel all running background tasks."""
+        for task in list(self.worker.tasks):
+            task.cancel()
     
     def save_expense(self, expense):
-        """Save expense to CSV file."""
-        with open(EXPENSE_FILE, mode='a', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=['date', 'description', 'category', 'amount'])
-            writer.writerow(expense)
+        """Save expense to storage and the in-memory ledger."""
+        with metrics.measure('save_expense', 1):
+            self.ledger.append(expense)
+        self.schedule_flush()
+        return expense
+    
+    def schedule_flush(self):
+        """Flush buffered writes within WRITE_FLUSH_MS."""
+        if self.flush_job is None:
+            self.flush_job = self.root.after(WRITE_FLUSH_MS, self.flush_expenses)
+    
+    def flush_expenses(self):
+        self.flush_job = None
+        with metrics.measure('flush_expenses'):
+            self.ledger.flush()
     
     def add_expense(self):
         """Add a new expense."""
@@ -128,30 +787,161 @@ class ExpenseTracker:
         amount = self.amount_entry.get()
         
         # Validation
-        if not all([date, description, category, amount]):
-            messagebox.showerror("Error", "All fields are required!", parent=self.root)
-            return
-            
         try:
-            amount = float(amount)
-            if amount <= 0:
-                raise ValueError
-        except ValueError:
-            messagebox.showerror("Error", "Amount must be a positive number!", parent=self.root)
+            expense = validate_expense(date, description, category, amount)
+        except ValueError as error:
+            messagebox.showerror("Error", str(error), parent=self.root)
             return
         
-        expense = {
-            'date': date,
-            'description': description,
-            'category': category,
-            'amount': amount
-        }
+        # Typed categories take the stored spelling; new ones are added to the list
+        known = self.categories.find(expense.category)
+        if known is not None:
+            expense = expense._replace(category=known)
+        elif expense.category in self.ledger.aggregates.category_totals or messagebox.askyesno(
+                "New Category", f"Add '{expense.category}' as a new category?", parent=self.root):
+            self.categories.add(expense.category)
+            self.save_categories()
+        else:
+            return
         
         self.save_expense(expense)
-        self.update_expense_table()
+        self.category_model.learn((expense,))
+        if self.query or self.sort_keys:
+            self.show_rows()
+        else:
+            self.table.append(expense)
+            self.table.see(len(self.ledger) - 1)
+        self.update_total_label()
         self.clear_form()
         messagebox.showinfo("Success", "Expense added successfully!", parent=self.root)
     
+    def selected_row(self):
+        """Return the row ID of the selected expense, or None."""
+        selection = self.tree.selection()
+        if not selection:
+            return None
+        return self.table.row_id(selection[0])
+    
+    def show_row_menu(self, event):
+        """Select the row under the pointer and offer to edit or delete it."""
+        item = self.tree.identify_row(event.y)
+        if item:
+            self.tree.selection_set(item)
+            self.row_menu.tk_popup(event.x_root, event.y_root)
+    
+    def edit_expense(self, event=None):
+        """Edit the selected expense in a popup."""
+        row = self.selected_row()
+        if row is None:
+            return
+        if self.ledger_task:
+            messagebox.showinfo("Busy", "Please wait for the current task to finish.", parent=self.root)
+            return
+        expense = self.ledger.rows[row]
+        generation = self.ledger_generation
+        
+        popup = tk.Toplevel(self.root)
+        popup.title("Edit Expense")
+        popup.configure(bg=DARK_BG, padx=20, pady=20)
+        popup.transient(self.root)
+        popup.resizable(False, False)
+        
+        fields = {}
+        for position, (key, label, value) in enumerate([
+            ('date', "Date (YYYY-MM-DD):", expense.date),
+            ('description', "Description:", expense.description),
+            ('category', "Category:", expense.category),
+            ('amount', "Amount:", format_cents(expense.cents)),
+        ]):
+            tk.Label(popup, text=label, font=LABEL_FONT, bg=DARK_BG, fg=LIGHT_TEXT).grid(row=position, column=0, sticky="w", pady=3)
+            fields[key] = tk.StringVar(value=value)
+            if key == 'category':
+                category_box = ttk.Combobox(popup, textvariable=fields[key])
+                category_box.grid(row=position, column=1, sticky="ew", pady=3)
+                CategoryPicker(category_box, self.categories)
+            else:
+                ttk.Entry(popup, textvariable=fields[key]).grid(row=position, column=1, sticky="ew", pady=3)
+        
+        def save():
+            if self.ledger_task or generation != self.ledger_generation:
+                # The row ID may name another expense after a reload
+                messagebox.showinfo("Reloaded", "The ledger was reloaded while you were editing. "
+                                    "Please open the expense again.", parent=popup)
+                popup.destroy()
+                return
+            try:
+                edited = validate_expense(*(fields[key].get() for key in ('date', 'description', 'category', 'amount')))
+            except ValueError as error:
+                messagebox.showerror("Error", str(error), parent=popup)
+                return
+            popup.destroy()
+            if row in self.ledger.rows.deleted:
+                return
+            if edited != expense:
+                try:
+                    self.ledger.update(row, edited)
+                except Exception as error:  # refused, or the storage failed to write
+                    self.on_change_rejected(error)
+                    return
+                self.on_ledger_changed()
+        
+        ttk.Button(popup, text="Save", command=save, style="Accent.TButton").grid(row=4, column=0, columnspan=2, pady=(10, 0))
+    
+    def delete_expense(self, event=None):
+        """Delete the selected expense after confirmation."""
+        row = self.selected_row()
+        if row is None:
+            return
+        if self.ledger_task:
+            messagebox.showinfo("Busy", "Please wait for the current task to finish.", parent=self.root)
+            return
+        expense = self.ledger.rows[row]
+        if not messagebox.askyesno(
+                "Delete Expense",
+                f"Delete {expense.description} ({format_cents(expense.cents)}) from {expense.date}?",
+                parent=self.root):
+            return
+        try:
+            self.ledger.delete(row)
+        except Exception as error:  # refused, or the storage failed to write
+            self.on_change_rejected(error)
+            return
+        self.on_ledger_changed()
+    
+    def on_ledger_changed(self):
+        """Refresh the views after an edit or deletion."""
+        self.update_expense_table()
+        self.schedule_compaction()
+    
+    def on_change_rejected(self, error):
+        """Report an edit or deletion that wasn't saved and reload the rows."""
+        messagebox.showerror("Error", f"The change was not saved: {error}", parent=self.root)
+        self.load_expenses()
+    
+    def schedule_compaction(self):
+        """Fold the change log into the ledger file on the worker once it is long enough."""
+        if self.compact_task or self.ledger_task:
+            return
+        job = self.ledger.storage.start_compaction()
+        if job is None:
+            return
+        self.compact_task = self.worker.submit(
+            self.ledger.storage.compact,
+            job,
+            name="Compacting expenses",
+            on_done=self.on_compacted,
+            on_error=self.on_compaction_failed,
+            on_cancel=self.on_compaction_failed
+        )
+    
+    def on_compacted(self, task, job):
+        self.compact_task = None
+        self.ledger.storage.finish_compaction(job)
+    
+    def on_compaction_failed(self, task, error=None):
+        # The change log stays valid; compaction is retried after the next change.
+        self.compact_task = None
+    
     def clear_form(self):
         """Clear the expense form."""
         today = date.today().strftime('%Y-%m-%d')
@@ -159,81 +949,284 @@ class ExpenseTracker:
         self.date_entry.insert(0, today)
         self.desc_entry.delete(0, tk.END)
         self.amount_entry.delete(0, tk.END)
-        self.category_var.set(self.categories[0] if self.categories else "")
+        self.category_var.set(self.categories.names[0] if self.categories else "")
+        self.category_picked = False
     
     def create_category(self):
         """Create a new category."""
         new_category = simpledialog.askstring("New Category", 
                                             "Enter new category name:",
                                             parent=self.root)
-        if new_category:
-            if new_category in self.categories:
-                messagebox.showinfo("Info", f"Category '{new_category}' already exists!", parent=self.root)
-            else:
-                self.categories.append(new_category)
-                self.save_categories()
-                self.update_category_menu()
-                messagebox.showinfo("Success", f"Category '{new_category}' added!", parent=self.root)
-    
-    def update_category_menu(self):
-        """Update the category dropdown menu."""
-        menu = self.category_menu['menu']
-        menu.delete(0, 'end')
-        
-        for category in sorted(self.categories):
-            menu.add_command(
-                label=category, 
-                command=tk._setit(self.category_var, category),
-                font=LABEL_FONT
-            )
+        if new_category is None:
+            return
+        new_category = new_category.strip()
+        if not self.categories.add(new_category):
+            # Blank, or the same as an existing category up to case
+            message = (f"Category '{self.categories.find(new_category)}' already exists!" if new_category
+                       else "Category name is required!")
+            messagebox.showerror("Error", message, parent=self.root)
+            return
+        self.save_categories()
+        messagebox.showinfo("Success", f"Category '{new_category}' added!", parent=self.root)
+    
+    def on_category_picked(self, event=None):
+        """Stop suggesting categories once the user has chosen one themselves."""
+        self.category_picked = True
+    
+    def schedule_suggestion(self, event=None):
+        """Suggest a category once typing in the description pauses."""
+        if self.suggest_job is not None:
+            self.root.after_cancel(self.suggest_job)
+        self.suggest_job = self.root.after(SEARCH_DELAY_MS, self.suggest_category)
+    
+    def suggest_category(self):
+        """Pick the category past expenses with a similar description were filed under."""
+        self.suggest_job = None
+        if self.category_picked:
+            return
+        category = self.category_model.suggest(self.desc_entry.get())
+        if category is not None:
+            self.category_var.set(self.categories.find(category) or category)
+    
+    def learn_categories(self):
+        """Rebuild the category suggestions from the loaded ledger on the worker."""
+        self.model_task = self.worker.submit(
+            CategoryModel.from_rows,
+            self.ledger.rows,
+            name="Learning categories",
+            on_done=self.on_categories_learned,
+            on_error=self.on_categories_failed
+        )
+    
+    def on_categories_learned(self, task, result):
+        if task is not self.model_task:
+            return
+        self.model_task = None
+        model, learned = result
+        rows = self.ledger.rows
+        model.learn(rows[row] for row in range(learned, len(rows)) if row not in rows.deleted)
+        self.category_model = model
+    
+    def on_categories_failed(self, task, error):
+        # Suggestions keep coming from the previous model.
+        if task is self.model_task:
+            self.model_task = None
     
     def update_expense_table(self):
-        """Update the expense table with current data."""
-        for row in self.tree.get_children():
-            self.tree.delete(row)
-        
-        expenses = self.load_expenses()
-        total = 0
-        
-        for expense in expenses:
-            amount = float(expense['amount'])
-            total += amount
-            self.tree.insert("", "end", values=(
-                expense['date'],
-                expense['description'],
-                expense['category'],
-                f"{amount:.2f} {self.currency}" if self.currency else f"{amount:.2f}"
-            ))
-        
-        # Update summary
-        self.total_label.config(text=f"Total Expenses: {total:.2f} {self.currency}" if self.currency else f"Total Expenses: {total:.2f}")
+        """Rebuild the expense table from the in-memory ledger."""
+        with metrics.measure('update_expense_table') as measure:
+            self.show_rows()
+            
+            # Update summary
+            self.update_total_label()
+            measure.rows = len(self.table.rows)
+    
+    def show_rows(self):
+        """Fill the table with the rows the filter bar selects, in the current sort order."""
+        if self.query:
+            self.apply_filter()
+            return
+        self.table.set_rows(self.ledger.sort_by(self.sort_keys) if self.sort_keys else self.ledger.visible())
+        since = self.ledger.storage.loaded_since()
+        self.filter_status.config(
+            text=f"Showing expenses from {since.isoformat()} on; search to see older ones" if since else "",
+            fg=LIGHT_TEXT
+        )
+    
+    def sort_table(self, column, secondary=False):
+        """Sort the table by a ledger column.
+
+        Clicking the column sorting the table reverses it, and clicking
+        it once more goes back to ledger order; any other column starts
+        a new order. With ``secondary`` (Shift-click) the column is added
+        after the current keys to break their ties, or reversed if it is
+        one of them already.
+        """
+        keys = list(self.sort_keys)
+        columns = [key[0] for key in keys]
+        if secondary and keys:
+            if column in columns:
+                position = columns.index(column)
+                keys[position] = (column, not keys[position][1])
+            else:
+                keys.append((column, False))
+        elif columns[:1] == [column]:
+            keys = [(column, True)] + keys[1:] if not keys[0][1] else []
+        else:
+            keys = [(column, False)]
+        self.sort_keys = tuple(keys)
+        
+        # Mark the sorted headings with their direction, and their rank if there are several
+        marks = {}
+        for position, (name, descending) in enumerate(keys):
+            marks[name] = ("\u25bc" if descending else "\u25b2") + (str(position + 1) if len(keys) > 1 else "")
+        for heading, name in HEADING_COLUMNS.items():
+            self.tree.heading(heading, text=f"{heading} {marks[name]}" if name in marks else heading)
+        self.show_rows()
+    
+    def on_heading_shift_click(self, event):
+        """Add the clicked heading's column to the sort order as a tie-breaker."""
+        if self.tree.identify_region(event.x, event.y) != "heading":
+            return None
+        heading = self.tree.column(self.tree.identify_column(event.x), "id")
+        self.sort_table(HEADING_COLUMNS[heading], secondary=True)
+        return "break"
+    
+    def schedule_search(self, *args):
+        """Search again once typing in the filter bar pauses."""
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DELAY_MS, self.on_filter_changed)
+    
+    def on_filter_changed(self):
+        self.search_job = None
+        try:
+            query = self.read_filter()
+        except ValueError as error:
+            self.filter_status.config(text=str(error), fg=ERROR_COLOR)
+            return
+        self.query = query if query != ExpenseQuery() else None
+        if self.query and self.load_older(self.query.start):
+            return
+        self.update_expense_table()
+    
+    def read_filter(self):
+        """Build an ExpenseQuery from the filter bar fields."""
+        start = self.filter_start.get().strip()
+        end = self.filter_end.get().strip()
+        low = self.filter_min.get().strip()
+        high = self.filter_max.get().strip()
+        try:
+            start = parse_date(start) if start else None
+            end = parse_date(end) if end else None
+        except ValueError:
+            raise ValueError("Dates must be YYYY-MM-DD") from None
+        try:
+            low = parse_cents(low) if low else None
+            high = parse_cents(high) if high else None
+        except ValueError:
+            raise ValueError("Amounts must be numbers") from None
+        return ExpenseQuery(self.search_var.get(), start, end, low, high)
+    
+    def load_older(self, start):
+        """Load older months of a partitioned ledger if rows from ``start`` on (None: all) aren't in memory.
+
+        Returns whether a load was started; the views refresh when it ends.
+        """
+        if self.ledger_task or self.ledger.covers(start) or not self.ledger.storage.include(start):
+            return False
+        self.load_expenses()
+        return True
+    
+    def apply_filter(self):
+        """Show only the rows matching the current query, in the current sort order."""
+        rows = self.ledger.sort_by(self.sort_keys, self.query) if self.sort_keys else self.ledger.search(self.query)
+        self.table.set_rows(rows)
+        self.filter_status.config(text=f"{len(rows)} of {len(self.ledger)} expenses", fg=LIGHT_TEXT)
+    
+    def clear_filter(self):
+        """Reset the filter bar and show every expense."""
+        for entry in (self.filter_start, self.filter_end, self.filter_min, self.filter_max):
+            entry.delete(0, tk.END)
+        self.search_var.set("")
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+            self.search_job = None
+        self.query = None
+        self.filter_status.config(text="")
+        self.update_expense_table()
+    
+    def format_expense_row(self, expense):
+        """Format a ledger row as expense table values."""
+        amount = format_cents(expense.cents)
+        return (
+            expense.date,
+            expense.description,
+            expense.category,
+            f"{amount} {self.currency}" if self.currency else amount
+        )
+    
+    def update_total_label(self):
+        """Show the ledger's running total, and refresh the summary window if open."""
+        total = format_cents(self.ledger.total)
+        self.total_label.config(text=f"Total Expenses: {total} {self.currency}" if self.currency else f"Total Expenses: {total}")
+        self.refresh_summary()
+    
+    def toggle_metrics_overlay(self, event=None):
+        """Show or hide the refresh timings next to the total."""
+        if self.metrics_label.winfo_manager():
+            self.metrics_label.pack_forget()
+            if self.metrics_job is not None:
+                self.root.after_cancel(self.metrics_job)
+                self.metrics_job = None
+        else:
+            self.metrics_label.pack(side="left", padx=(15, 0), after=self.total_label)
+            self.update_metrics_overlay()
+    
+    def update_metrics_overlay(self):
+        """Show when the table was last refreshed, how long it took and the rows involved."""
+        parts = []
+        refresh = metrics.stats('update_expense_table')
+        if refresh:
+            at = datetime.datetime.fromtimestamp(refresh.last_time).strftime("%H:%M:%S")
+            parts.append(f"Refreshed {at} in {refresh.last_ns / 1e6:.1f} ms")
+        parts.append(f"{len(self.table.rows):,} of {len(self.ledger):,} rows")
+        inserts = metrics.stats('treeview_insert')
+        if inserts:
+            parts.append(f"{inserts.last_rows:,} items in {inserts.last_ns / 1e6:.1f} ms")
+        load = metrics.stats('load_expenses')
+        if load:
+            parts.append(f"loaded {load.last_rows:,} in {load.last_ns / 1e6:.0f} ms")
+        self.metrics_label.config(text=" | ".join(parts))
+        self.metrics_job = self.root.after(METRICS_OVERLAY_MS, self.update_metrics_overlay)
+    
+    def export_metrics(self, event=None):
+        """Write the collected timings to METRICS_FILE, or a file the user picks."""
+        path = METRICS_FILE or filedialog.asksaveasfilename(
+            parent=self.root,
+            title="Export Metrics",
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json")]
+        )
+        if not path:
+            return
+        try:
+            metrics.export(path)
+        except OSError as error:
+            messagebox.showerror("Error", f"Could not write {path}: {error}", parent=self.root)
+            return
+        self.status_label.config(text=f"Metrics written to {path}")
+    
+    def toggle_metrics_capture(self, event=None):
+        """Start profiling, or stop and export the profile."""
+        if metrics.capturing:
+            metrics.stop_capture()
+            self.export_metrics()
+        else:
+            metrics.start_capture()
+            self.status_label.config(text="Profiling; press Shift+F12 to stop")
     
     def show_summary(self):
         """Show expense summary by category."""
-        expenses = self.load_expenses()
-        if not expenses:
+        if not self.ledger.aggregates.count:
             messagebox.showinfo("Summary", "No expenses recorded yet.", parent=self.root)
             return
         
-        category_totals = {}
-        total = 0
-        
-        for expense in expenses:
-            category = expense['category']
-            amount = float(expense['amount'])
-            total += amount
-            
-            if category in category_totals:
-                category_totals[category] += amount
-            else:
-                category_totals[category] = amount
-        
-        # Create summary window
+        with metrics.measure('show_summary'):
+            if self.summary_window is None:
+                self.create_summary_window()
+            self.summary_window.deiconify()
+            self.summary_window.lift()
+            self.refresh_summary()
+    
+    def create_summary_window(self):
+        """Build the summary window once; closing it only hides it."""
         summary_window = tk.Toplevel(self.root)
         summary_window.title("Expense Summary")
-        summary_window.geometry("400x500")
+        summary_window.geometry("640x560")
         summary_window.resizable(False, False)
         summary_window.configure(bg=THEME_COLOR)
+        summary_window.protocol("WM_DELETE_WINDOW", summary_window.withdraw)
         
         # Header
         header_frame = tk.Frame(summary_window, bg=THEME_COLOR)
@@ -251,70 +1244,212 @@ class ExpenseTracker:
         total_frame = tk.Frame(summary_window, bg=DARK_BG, padx=10, pady=10)
         total_frame.pack(fill="x", padx=20, pady=5)
         
-        tk.Label(
+        self.summary_total_label = tk.Label(
             total_frame, 
-            text=f"Total: {total:.2f} {self.currency}" if self.currency else f"Total: {total:.2f}",
+            text="",
             font=("Segoe UI", 12, "bold"),
             bg=DARK_BG,
             fg=SUCCESS_COLOR
-        ).pack()
-        
-        # Categories
-        canvas = tk.Canvas(summary_window, bg=THEME_COLOR, highlightthickness=0)
-        scrollbar = ttk.Scrollbar(summary_window, orient="vertical", command=canvas.yview)
-        scrollable_frame = tk.Frame(canvas, bg=THEME_COLOR)
-        
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(
-                scrollregion=canvas.bbox("all")
-            )
         )
+        self.summary_total_label.pack()
         
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
+        notebook = ttk.Notebook(summary_window)
+        notebook.pack(fill="both", expand=True, padx=20, pady=(5, 20))
+        categories_tab = tk.Frame(notebook, bg=THEME_COLOR)
+        notebook.add(categories_tab, text="Categories")
         
-        canvas.pack(side="left", fill="both", expand=True, padx=(20, 5), pady=10)
+        # Categories, drawn on one canvas
+        canvas = tk.Canvas(categories_tab, bg=THEME_COLOR, highlightthickness=0)
+        scrollbar = ttk.Scrollbar(categories_tab, orient="vertical")
+        canvas.pack(side="left", fill="both", expand=True, padx=(10, 5), pady=10)
         scrollbar.pack(side="right", fill="y", pady=10)
+        self.summary_chart = SummaryChart(canvas, scrollbar, self.format_amount)
         
-        # Sort categories by amount (descending)
-        sorted_categories = sorted(category_totals.items(), key=lambda item: item[1], reverse=True)
+        # Statistics, filled in by the analytics engine
+        percentile_columns = [f"P{percent}" for percent in ANALYTICS_PERCENTILES]
+        self.stats_tree = self.create_stats_tab(
+            notebook, "Statistics", ["Category", "Count", "Mean", "Median"] + percentile_columns)
+        self.monthly_tree = self.create_stats_tab(
+            notebook, "Monthly", ["Month", "Count", "Total", "Mean", "Median", "Change", "Change %"])
         
-        for category, amount in sorted_categories:
-            category_frame = tk.Frame(scrollable_frame, bg=DARK_BG, padx=10, pady=10)
-            category_frame.pack(fill="x", pady=5)
-            
-            # Category name
-            tk.Label(
-                category_frame,
-                text=category,
-                font=("Segoe UI", 10, "bold"),
-                bg=DARK_BG,
-                fg=LIGHT_TEXT,
-                anchor="w"
-            ).pack(fill="x")
+        self.summary_window = summary_window
+    
+    def refresh_summary(self):
+        """Update the summary window in place from the current aggregates."""
+        if self.summary_window is None or self.summary_window.state() == "withdrawn":
+            return
+        aggregates = self.ledger.aggregates
+        with metrics.measure('refresh_summary', len(aggregates.category_totals)):
+            self.summary_total_label.config(text=f"Total: {self.format_amount(aggregates.total)}")
             
-            # Amount and percentage
-            percentage = (amount / total) * 100 if total > 0 else 0
-            tk.Label(
-                category_frame,
-                text=f"{amount:.2f} {self.currency} ({percentage:.1f}%)" if self.currency else f"{amount:.2f} ({percentage:.1f}%)",
-                font=("Segoe UI", 9),
-                bg=DARK_BG,
-                fg=LIGHT_TEXT,
-                anchor="w"
-            ).pack(fill="x")
+            # Sort categories by amount (descending)
+            sorted_categories = sorted(aggregates.category_totals.items(), key=lambda item: item[1], reverse=True)
+            self.summary_chart.set_rows(sorted_categories, aggregates.total)
+        self.schedule_statistics()
+    
+    def format_amount(self, cents):
+        """Format cents with the currency, if one is set."""
+        return f"{format_cents(cents)} {self.currency}" if self.currency else format_cents(cents)
+    
+    def create_stats_tab(self, notebook, title, columns):
+        """Add a notebook tab holding a statistics table and return the table."""
+        frame = tk.Frame(notebook, bg=THEME_COLOR)
+        notebook.add(frame, text=title)
+        scrollbar = ttk.Scrollbar(frame)
+        scrollbar.pack(side="right", fill="y")
+        tree = ttk.Treeview(frame, columns=columns, show="headings", yscrollcommand=scrollbar.set)
+        scrollbar.config(command=tree.yview)
+        for column in columns:
+            tree.heading(column, text=column, anchor="w")
+            tree.column(column, width=70, minwidth=50, anchor="e")
+        tree.column(columns[0], width=110, anchor="w")
+        tree.pack(fill="both", expand=True)
+        tree.insert("", "end", values=("Calculating...",))
+        return tree
+    
+    def schedule_statistics(self):
+        """Recompute the summary statistics once changes settle."""
+        if self.stats_job is None:
+            self.stats_job = self.root.after(STATS_REFRESH_MS, self.refresh_statistics)
+    
+    def refresh_statistics(self):
+        """Run the analytics engine on the worker; one run at a time."""
+        self.stats_job = None
+        if self.stats_task:
+            self.stats_stale = True
+            return
+        if self.load_older(None):
+            return
+        from ledger.analytics import analyze
+        
+        self.stats_task = self.worker.submit(
+            analyze,
+            self.ledger.rows,
+            name="Calculating statistics",
+            on_done=self.on_statistics_ready,
+            on_error=self.on_statistics_error
+        )
+    
+    def on_statistics_ready(self, task, analytics):
+        self.stats_task = None
+        if self.stats_stale:
+            self.stats_stale = False
+            self.schedule_statistics()
+        self.show_statistics(analytics)
+    
+    def on_statistics_error(self, task, error):
+        self.stats_task = None
+        self.on_task_error(task, error)
+    
+    def show_statistics(self, analytics):
+        """Fill the summary window's statistics tabs from LedgerAnalytics."""
+        def amount(cents):
+            return format_cents(round(cents))
+        
+        self.stats_tree.delete(*self.stats_tree.get_children())
+        for category, stats in sorted(analytics.categories.items(), key=lambda item: item[1].total, reverse=True):
+            self.stats_tree.insert("", "end", values=(
+                category, stats.count, amount(stats.mean), amount(stats.median),
+                *(amount(value) for value in stats.percentiles)
+            ))
+        
+        self.monthly_tree.delete(*self.monthly_tree.get_children())
+        for delta in reversed(analytics.month_deltas()):
+            stats = analytics.months[delta.month]
+            ratio = f"{delta.ratio * 100:+.1f}%" if delta.ratio is not None else ""
+            self.monthly_tree.insert("", "end", values=(
+                "%04d-%02d" % delta.month, stats.count, amount(stats.total), amount(stats.mean),
+                amount(stats.median), amount(delta.change), ratio
+            ))
+    
+    def show_report(self):
+        """Show category totals for a date range."""
+        report_window = tk.Toplevel(self.root)
+        report_window.title("Expense Report")
+        report_window.geometry("460x520")
+        report_window.configure(bg=THEME_COLOR)
+        report_window.transient(self.root)
+        
+        range_frame = tk.Frame(report_window, bg=DARK_BG, padx=10, pady=10)
+        range_frame.pack(fill="x", padx=20, pady=(20, 5))
+        
+        today = date.today()
+        tk.Label(range_frame, text="From:", font=LABEL_FONT, bg=DARK_BG, fg=LIGHT_TEXT).grid(row=0, column=0, sticky="w")
+        start_entry = ttk.Entry(range_frame, font=ENTRY_FONT, width=12)
+        start_entry.insert(0, today.replace(day=1).isoformat())
+        start_entry.grid(row=0, column=1, padx=5)
+        
+        tk.Label(range_frame, text="To:", font=LABEL_FONT, bg=DARK_BG, fg=LIGHT_TEXT).grid(row=0, column=2, sticky="w")
+        end_entry = ttk.Entry(range_frame, font=ENTRY_FONT, width=12)
+        end_entry.insert(0, today.isoformat())
+        end_entry.grid(row=0, column=3, padx=5)
+        
+        preset_frame = tk.Frame(report_window, bg=THEME_COLOR)
+        preset_frame.pack(fill="x", padx=20, pady=5)
+        
+        total_label = tk.Label(
+            report_window,
+            text="",
+            font=("Segoe UI", 12, "bold"),
+            bg=DARK_BG,
+            fg=SUCCESS_COLOR,
+            padx=10,
+            pady=10
+        )
+        total_label.pack(fill="x", padx=20, pady=5)
+        
+        tree = ttk.Treeview(report_window, columns=("Category", "Count", "Amount"), show="headings")
+        tree.heading("Category", text="Category", anchor="w")
+        tree.heading("Count", text="Count", anchor="w")
+        tree.heading("Amount", text="Amount", anchor="w")
+        tree.column("Category", width=200)
+        tree.column("Count", width=70, anchor="e")
+        tree.column("Amount", width=120, anchor="e")
+        tree.pack(fill="both", expand=True, padx=20, pady=(5, 20))
+        
+        def refresh():
+            try:
+                start = parse_date(start_entry.get().strip())
+                end = parse_date(end_entry.get().strip())
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format!", parent=report_window)
+                return
+            if start > end:
+                messagebox.showerror("Error", "The start date must not be after the end date!", parent=report_window)
+                return
             
-            # Progress bar
-            progress = ttk.Progressbar(
-                category_frame,
-                orient="horizontal",
-                length=300,
-                mode="determinate",
-                value=percentage,
-                style="Custom.Horizontal.TProgressbar"
-            )
-            progress.pack(fill="x", pady=(5, 0))
+            totals = self.ledger.totals_between(start, end)
+            tree.delete(*tree.get_children())
+            for category, (cents, count) in sorted(totals.items(), key=lambda item: item[1][0], reverse=True):
+                tree.insert("", "end", values=(category, count, format_cents(cents)))
+            total = format_cents(sum(cents for cents, _ in totals.values()))
+            count = sum(count for _, count in totals.values())
+            text = f"Total: {total} {self.currency}" if self.currency else f"Total: {total}"
+            total_label.config(text=f"{text} ({count} expenses)")
+        
+        def select(start, end):
+            start_entry.delete(0, tk.END)
+            start_entry.insert(0, start.isoformat())
+            end_entry.delete(0, tk.END)
+            end_entry.insert(0, end.isoformat())
+            refresh()
+        
+        last_month_end = today.replace(day=1) - datetime.timedelta(days=1)
+        presets = [
+            ("This Month", today.replace(day=1), today),
+            ("Last Month", last_month_end.replace(day=1), last_month_end),
+            ("This Year", today.replace(month=1, day=1), today),
+        ]
+        for text, start, end in presets:
+            ttk.Button(
+                preset_frame,
+                text=text,
+                command=lambda start=start, end=end: select(start, end),
+                style="Secondary.TButton"
+            ).pack(side="left", padx=(0, 5))
+        
+        ttk.Button(range_frame, text="Show", command=refresh, style="Accent.TButton").grid(row=0, column=4, padx=(5, 0))
+        refresh()
     
     def setup_ui(self):
         """Set up the user interface."""
@@ -398,14 +1533,13 @@ class ExpenseTracker:
         ).pack(anchor="w", pady=(5, 0))
         
         self.category_var = tk.StringVar()
-        self.category_var.set(self.categories[0] if self.categories else "")
-        self.category_menu = ttk.OptionMenu(
-            form_frame,
-            self.category_var,
-            self.categories[0] if self.categories else "",
-            *self.categories
-        )
-        self.category_menu.pack(fill="x", pady=5)
+        self.category_var.set(self.categories.names[0] if self.categories else "")
+        self.category_box = ttk.Combobox(form_frame, textvariable=self.category_var, font=ENTRY_FONT)
+        self.category_box.pack(fill="x", pady=5)
+        CategoryPicker(self.category_box, self.categories)
+        self.category_box.bind("<<ComboboxSelected>>", self.on_category_picked)
+        self.category_box.bind("<KeyRelease>", self.on_category_picked, add="+")
+        self.desc_entry.bind("<KeyRelease>", self.schedule_suggestion)
         
         # Amount
         tk.Label(
@@ -423,12 +1557,13 @@ class ExpenseTracker:
         button_frame = tk.Frame(form_frame, bg=DARK_BG)
         button_frame.pack(fill="x", pady=(10, 0))
         
-        ttk.Button(
+        self.add_button = ttk.Button(
             button_frame,
             text="Add Expense",
             command=self.add_expense,
             style="Accent.TButton"
-        ).pack(side="left", padx=(0, 10))
+        )
+        self.add_button.pack(side="left", padx=(0, 10))
         
         ttk.Button(
             button_frame,
@@ -456,6 +1591,32 @@ class ExpenseTracker:
             style="Accent.TButton"
         ).pack(fill="x")
         
+        # Bulk import and export
+        import_frame = tk.Frame(left_panel, bg=DARK_BG, padx=20, pady=20)
+        import_frame.pack(fill="x", pady=(20, 0))
+        
+        tk.Label(
+            import_frame,
+            text="Import & Export",
+            font=("Segoe UI", 12, "bold"),
+            bg=DARK_BG,
+            fg=LIGHT_TEXT
+        ).pack(anchor="w", pady=(0, 10))
+        
+        ttk.Button(
+            import_frame,
+            text="Import Statement",
+            command=self.import_statement,
+            style="Accent.TButton"
+        ).pack(fill="x")
+        
+        ttk.Button(
+            import_frame,
+            text="Export Expenses",
+            command=self.export_popup,
+            style="Accent.TButton"
+        ).pack(fill="x", pady=(10, 0))
+        
         # Right panel (expenses)
         right_panel = tk.Frame(main_container, bg=THEME_COLOR)
         right_panel.pack(side="right", fill="both", expand=True)
@@ -473,6 +1634,40 @@ class ExpenseTracker:
         )
         self.total_label.pack(side="left")
         
+        # Performance overlay, packed next to the total while shown
+        self.metrics_label = tk.Label(
+            summary_frame,
+            text="",
+            font=("Segoe UI", 9),
+            bg=DARK_BG,
+            fg=WARNING_COLOR
+        )
+        
+        # Background task status
+        self.status_label = tk.Label(
+            summary_frame,
+            text="",
+            font=("Segoe UI", 9),
+            bg=DARK_BG,
+            fg=LIGHT_TEXT
+        )
+        self.status_label.pack(side="left", padx=(15, 0))
+        
+        self.progress_bar = ttk.Progressbar(
+            summary_frame,
+            orient="horizontal",
+            length=120,
+            mode="determinate",
+            style="Custom.Horizontal.TProgressbar"
+        )
+        
+        self.cancel_button = ttk.Button(
+            summary_frame,
+            text="Cancel",
+            command=self.cancel_tasks,
+            style="Secondary.TButton"
+        )
+        
         ttk.Button(
             summary_frame,
             text="View Summary",
@@ -480,6 +1675,54 @@ class ExpenseTracker:
             style="Secondary.TButton"
         ).pack(side="right")
         
+        ttk.Button(
+            summary_frame,
+            text="Reports",
+            command=self.show_report,
+            style="Secondary.TButton"
+        ).pack(side="right", padx=(0, 10))
+        
+        ttk.Button(
+            summary_frame,
+            text="Reload",
+            command=self.load_expenses,
+            style="Secondary.TButton"
+        ).pack(side="right", padx=(0, 10))
+        
+        # Filter bar
+        filter_frame = tk.Frame(right_panel, bg=DARK_BG, padx=15, pady=8)
+        filter_frame.pack(fill="x", pady=(0, 10))
+        
+        tk.Label(filter_frame, text="Search:", font=("Segoe UI", 9), bg=DARK_BG, fg=LIGHT_TEXT).pack(side="left")
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", self.schedule_search)
+        ttk.Entry(filter_frame, textvariable=self.search_var, width=18).pack(side="left", padx=(5, 10))
+        
+        fields = []
+        for label, width in (("From:", 11), ("To:", 11), ("Min:", 8), ("Max:", 8)):
+            tk.Label(filter_frame, text=label, font=("Segoe UI", 9), bg=DARK_BG, fg=LIGHT_TEXT).pack(side="left")
+            entry = ttk.Entry(filter_frame, width=width)
+            entry.pack(side="left", padx=(5, 10))
+            entry.bind("<KeyRelease>", self.schedule_search)
+            fields.append(entry)
+        self.filter_start, self.filter_end, self.filter_min, self.filter_max = fields
+        
+        ttk.Button(
+            filter_frame,
+            text="Clear",
+            command=self.clear_filter,
+            style="Secondary.TButton"
+        ).pack(side="right")
+        
+        self.filter_status = tk.Label(
+            filter_frame,
+            text="",
+            font=("Segoe UI", 9),
+            bg=DARK_BG,
+            fg=LIGHT_TEXT
+        )
+        self.filter_status.pack(side="right", padx=(0, 10))
+        
         # Expense table
         table_frame = tk.Frame(right_panel, bg=THEME_COLOR)
         table_frame.pack(fill="both", expand=True)
@@ -505,15 +1748,26 @@ class ExpenseTracker:
         self.tree.pack(fill="both", expand=True)
         
         # Configure tree columns
-        self.tree.heading("Date", text="Date", anchor="w")
-        self.tree.heading("Description", text="Description", anchor="w")
-        self.tree.heading("Category", text="Category", anchor="w")
-        self.tree.heading("Amount", text="Amount", anchor="w")
+        # Click a heading to sort by it, Shift-click to add it as a tie-breaker
+        for heading, column in HEADING_COLUMNS.items():
+            self.tree.heading(heading, text=heading, anchor="w", command=lambda column=column: self.sort_table(column))
+        self.tree.bind("<Shift-Button-1>", self.on_heading_shift_click)
         
         self.tree.column("Date", width=100, minwidth=80)
         self.tree.column("Description", width=200, minwidth=150)
         self.tree.column("Category", width=120, minwidth=100)
         self.tree.column("Amount", width=100, minwidth=80, anchor="e")
+        
+        self.table = LedgerTable(self.tree, tree_scroll_y, self.format_expense_row)
+        
+        # Edit and delete actions on the table rows
+        self.row_menu = tk.Menu(self.root, tearoff=0)
+        self.row_menu.add_command(label="Edit...", command=self.edit_expense)
+        self.row_menu.add_command(label="Delete", command=self.delete_expense)
+        self.tree.bind("<Double-1>", lambda e: self.edit_expense() if self.tree.identify_row(e.y) else None)
+        self.tree.bind("<Return>", self.edit_expense)
+        self.tree.bind("<Delete>", self.delete_expense)
+        self.tree.bind("<Button-3>", self.show_row_menu)
     
     def configure_styles(self):
         """Configure custom styles for widgets."""
@@ -0,0 +1,379 @@
+"""Benchmarks for the ledger hot paths.
+
+Generates synthetic ledgers shaped like a real expenses.csv and times
+loading (whole and split into monthly partitions), saving, editing and
+deleting, table population, summary aggregation, search, sorting and
+exporting at each size.
+Results are printed (or written with --output) as JSON so runs can be
+compared between releases.
+
+The import time of the display-free ``ledger`` core is measured in a
+fresh interpreter and checked against IMPORT_BUDGET_MS; pass
+--check-import-budget to fail the run when it is over budget.
+
+Treeview population needs a display but the Tk window is never mapped;
+on a headless machine run under Xvfb:
+
+    xvfb-run python benchmarks/bench_ledger.py --sizes 10000 100000
+
+Without a display the table benchmarks are reported as skipped.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, ROOT)
+
+from ledger import (
+    CSVStorage, Expense, ExpenseAggregates, ExpenseLedger, ExpenseQuery, PartitionedStorage, analyze, format_cents,
+    split_ledger
+)
+from ledger.config import CHANGES_SUFFIX, COMPACT_CHANGES, EXPENSE_FIELDS, SNAPSHOT_SUFFIX
+from ledger.export import EXPORT_FORMATS, export_expenses
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+CATEGORIES = ['Food', 'Transport', 'Entertainment', 'Utilities', 'Shopping', 'Meeting', 'Education']
+# Rough share of entries per category, most ledgers are dominated by a few
+CATEGORY_WEIGHTS = [30, 20, 8, 10, 18, 6, 8]
+VENDORS = 5000
+SAVE_ROWS = 10_000
+# Filter bar input, as typed: a rare vendor, a common one, a category and a date-bounded query
+SEARCH_QUERIES = {
+    'rare_vendor': ExpenseQuery("Vendor 4321"),
+    'common_vendor': ExpenseQuery("Vendor 1"),
+    'category': ExpenseQuery("food"),
+    'last_month': ExpenseQuery("vendor", start=date.today() - timedelta(days=30)),
+}
+# Sort orders as picked by clicking table headings
+SORT_ORDERS = {
+    'amount': [('cents', True)],
+    'description': [('description', False)],
+    'category_then_date': [('category', False), ('date', True)],
+}
+# XLSX writing is slow enough that larger ledgers are skipped
+XLSX_EXPORT_LIMIT = 100_000
+PLAIN_TABLE_LIMIT = 100_000
+IMPORT_BUDGET_MS = 50
+
+def generate_ledger(path, rows, seed=1):
+    """Write a synthetic ledger of ``rows`` expenses to ``path``.
+
+    Dates run forward from a few years back with several entries per
+    day, descriptions come from a long-tailed vendor list and amounts
+    are log-normally distributed like real spending.
+    """
+    rng = random.Random(seed)
+    day = date.today() - timedelta(days=max(1, rows // 40))
+    vendors = [f"Vendor {number}" for number in range(VENDORS)]
+    with open(path, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(EXPENSE_FIELDS)
+        for _ in range(rows):
+            if rng.random() < 0.025:
+                day += timedelta(days=1)
+            category = rng.choices(CATEGORIES, CATEGORY_WEIGHTS)[0]
+            vendor = vendors[min(VENDORS - 1, int(rng.paretovariate(1.2)) - 1)]
+            cents = max(1, int(rng.lognormvariate(7, 1.2)))
+            writer.writerow((day.isoformat(), vendor, category, format_cents(cents)))
+
+def timed(fn, repeat=3):
+    """Run ``fn`` ``repeat`` times and return timing stats in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'runs': repeat}
+
+def bench_import_time(runs=5, budget_ms=IMPORT_BUDGET_MS):
+    """Time importing what the app needs from the core in a fresh interpreter."""
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "from ledger import ExpenseLedger, open_storage\n"
+        "print(time.perf_counter() - start, 'tkinter' in sys.modules)\n"
+    )
+    times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.split()
+        times.append(float(output[0]) * 1000)
+    best = min(times)
+    return {
+        'ms': best,
+        'budget_ms': budget_ms,
+        'within_budget': best <= budget_ms,
+        'imports_tkinter': output[1] == 'True',
+    }
+
+def bench_load(path):
+    """Time load_expenses cold (no snapshot) and warm (snapshot present)."""
+    snapshot = path + SNAPSHOT_SUFFIX
+    
+    def cold():
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+        storage = CSVStorage(path)
+        storage.load()
+        storage.close()
+    
+    def warm():
+        storage = CSVStorage(path)
+        storage.load()
+        storage.close()
+    
+    results = {'cold': timed(cold, repeat=1)}
+    results['warm'] = timed(warm)
+    return results
+
+def bench_save(path, rows=SAVE_ROWS):
+    """Time save_expense for ``rows`` single appends on a copy of the ledger."""
+    copy = path + '.save'
+    
+    def run():
+        with open(path, 'rb') as source, open(copy, 'wb') as target:
+            target.write(source.read())
+        storage = CSVStorage(copy)
+        ledger = ExpenseLedger(storage)
+        expense = Expense(date.today().isoformat(), "Benchmark", "Food", 1234)
+        start = time.perf_counter()
+        for _ in range(rows):
+            ledger.append(expense)
+        ledger.flush()
+        elapsed = time.perf_counter() - start
+        storage.close()
+        return elapsed
+    
+    try:
+        elapsed = run()
+    finally:
+        for leftover in (copy, copy + SNAPSHOT_SUFFIX):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return {'rows': rows, 'seconds': elapsed, 'per_row_us': elapsed / rows * 1e6}
+
+def bench_changes(path, changes=COMPACT_CHANGES):
+    """Time logged edits and deletions, then compacting them into a copy of the ledger."""
+    copy = path + '.changes'
+    try:
+        with open(path, 'rb') as source, open(copy, 'wb') as target:
+            target.write(source.read())
+        storage = CSVStorage(copy)
+        ledger = ExpenseLedger(storage)
+        ledger.load()
+        rows = random.Random(2).sample(range(len(ledger.rows)), changes)
+        edited = Expense(date.today().isoformat(), "Benchmark", "Food", 1234)
+        
+        start = time.perf_counter()
+        for number, row in enumerate(rows):
+            if number % 2:
+                ledger.delete(row)
+            else:
+                ledger.update(row, edited)
+        logged = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        job = storage.start_compaction()
+        storage.compact(job)
+        storage.finish_compaction(job)
+        compacted = time.perf_counter() - start
+        storage.close()
+    finally:
+        for leftover in (copy, copy + SNAPSHOT_SUFFIX, copy + CHANGES_SUFFIX):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return {'changes': changes, 'per_change_us': logged / changes * 1e6, 'compaction_seconds': compacted}
+
+def bench_partitioned(path):
+    """Time splitting the ledger into monthly partitions, then loading the recent months and all of them."""
+    directory = path + '.partitions'
+    shutil.rmtree(directory, ignore_errors=True)
+    
+    def recent():
+        storage = PartitionedStorage(directory)
+        storage.load()
+        storage.close()
+    
+    def everything():
+        storage = PartitionedStorage(directory)
+        storage.include(None)
+        storage.load()
+        storage.close()
+    
+    try:
+        start = time.perf_counter()
+        split_ledger(path, directory)
+        split = time.perf_counter() - start
+        return {
+            'split_seconds': split,
+            'months': len(PartitionedStorage(directory).scan()),
+            'recent': timed(recent),
+            'all': timed(everything, repeat=1),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def bench_summary(ledger):
+    """Time View Summary's aggregation: precomputed, from a full scan and the statistics."""
+    def precomputed():
+        aggregates = ledger.aggregates
+        sorted(aggregates.category_totals.items(), key=lambda item: item[1], reverse=True)
+    
+    def full_scan():
+        aggregates = ExpenseAggregates()
+        for expense in ledger.rows:
+            aggregates.add(expense.category, expense.cents)
+    
+    results = {'precomputed': timed(precomputed), 'full_scan': timed(full_scan, repeat=1)}
+    for engine in ('numpy', 'python'):
+        try:
+            results[f'statistics_{engine}'] = timed(lambda: analyze(ledger.rows, engine=engine), repeat=1)
+        except ImportError as error:
+            results[f'statistics_{engine}'] = {'skipped': str(error)}
+    return results
+
+def bench_search(ledger):
+    """Time the filter bar's search: building the index once, then each query."""
+    results = {'index': timed(ledger.rows.search_index.sync, repeat=1)}
+    for name, query in SEARCH_QUERIES.items():
+        results[name] = timed(lambda: ledger.search(query))
+        results[name]['matches'] = len(ledger.search(query))
+    return results
+
+def bench_sort(ledger):
+    """Time sorting the table: building each order once, then flipping it and appending to it."""
+    results = {}
+    expense = Expense(date.today().isoformat(), "Vendor 1", CATEGORIES[0], 1234)
+    for name, keys in SORT_ORDERS.items():
+        flipped = [(column, not descending) for column, descending in keys]
+        results[name] = {
+            'build': timed(lambda: ledger.sort_by(keys), repeat=1),
+            'flip': timed(lambda: ledger.sort_by(flipped)),
+            'append': timed(lambda: (ledger.rows.append(expense), ledger.sort_by(keys))),
+        }
+    return results
+
+def bench_export(ledger, data_dir):
+    """Time exporting the whole ledger in each format, and the last quarter's food spending as CSV."""
+    results = {}
+    for name, (label, extension, writer) in EXPORT_FORMATS.items():
+        if name == 'xlsx' and len(ledger) > XLSX_EXPORT_LIMIT:
+            results[name] = {'skipped': f"over {XLSX_EXPORT_LIMIT} rows"}
+            continue
+        path = os.path.join(data_dir, f"export{extension}")
+        try:
+            results[name] = timed(lambda: export_expenses(ledger.visible(), path), repeat=1)
+        except ImportError as error:
+            results[name] = {'skipped': str(error)}
+            continue
+        results[name]['bytes'] = os.path.getsize(path)
+        os.remove(path)
+    path = os.path.join(data_dir, "export.csv")
+    start = date.today() - timedelta(days=91)
+    results['filtered_csv'] = timed(lambda: export_expenses(ledger.visible(), path, start=start, categories=['Food']))
+    os.remove(path)
+    return results
+
+def bench_table(ledger, plain_limit=PLAIN_TABLE_LIMIT):
+    """Time update_expense_table on a Tk root that is never mapped."""
+    import tkinter as tk
+    from tkinter import ttk
+    
+    from app import LedgerTable
+    
+    try:
+        root = tk.Tk()
+    except tk.TclError as error:
+        return {'skipped': f"no display: {error}"}
+    root.withdraw()
+    ttk.Style().configure('Treeview', rowheight=25)
+    results = {}
+    try:
+        modes = [('virtual', True)]
+        if len(ledger) <= plain_limit:
+            modes.append(('plain', False))
+        for name, virtual in modes:
+            tree = ttk.Treeview(root, columns=("Date", "Description", "Category", "Amount"), show="headings")
+            scrollbar = ttk.Scrollbar(root)
+            table = LedgerTable(tree, scrollbar, lambda expense: expense, virtual=virtual)
+            results[name] = {'populate': timed(lambda: table.set_rows(ledger.rows), repeat=1)}
+            if virtual:
+                positions = [random.random() for _ in range(200)]
+                start = time.perf_counter()
+                for position in positions:
+                    table.yview("moveto", position)
+                results[name]['scroll_ms'] = (time.perf_counter() - start) / len(positions) * 1000
+            tree.destroy()
+            scrollbar.destroy()
+    finally:
+        root.destroy()
+    return results
+
+def run(sizes, data_dir):
+    os.makedirs(data_dir, exist_ok=True)
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'import_time': bench_import_time(),
+        'sizes': {},
+    }
+    for size in sizes:
+        path = os.path.join(data_dir, f"ledger-{size}.csv")
+        if not os.path.exists(path):
+            print(f"generating {size} rows...", file=sys.stderr)
+            generate_ledger(path, size)
+        
+        print(f"benchmarking {size} rows...", file=sys.stderr)
+        storage = CSVStorage(path)
+        ledger = ExpenseLedger(storage)
+        ledger.load()
+        storage.close()
+        
+        results['sizes'][str(size)] = {
+            'file_bytes': os.path.getsize(path),
+            'load_expenses': bench_load(path),
+            'load_partitioned': bench_partitioned(path),
+            'save_expense': bench_save(path),
+            'edit_delete': bench_changes(path),
+            'show_summary': bench_summary(ledger),
+            'search': bench_search(ledger),
+            'sort': bench_sort(ledger),
+            'export': bench_export(ledger, data_dir),
+            'update_expense_table': bench_table(ledger),
+        }
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='*', default=SIZES, help="ledger sizes in rows")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'expense-tracker-bench'),
+                        help="where generated ledgers are kept between runs")
+    parser.add_argument('--output', help="write JSON results to this file instead of stdout")
+    parser.add_argument('--check-import-budget', action='store_true',
+                        help="exit with status 1 if importing the core is over budget")
+    args = parser.parse_args(argv)
+    
+    results = run(args.sizes, args.data_dir)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    if args.check_import_budget and not results['import_time']['within_budget']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
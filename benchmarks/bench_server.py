@@ -0,0 +1,160 @@
+"""Load test for the ledger server.
+
+Starts ``python -m ledger.server`` on a synthetic ledger and drives it
+with many concurrent clients: writers add expenses one request at a
+time while readers ask for summaries and search pages. Reports write
+throughput and request latency percentiles as JSON, then reloads the
+ledger file to check that every write landed as a whole record.
+
+    python benchmarks/bench_server.py --clients 50 --writes 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, ROOT)
+
+from bench_ledger import CATEGORIES, generate_ledger
+from ledger import CSVStorage, ExpenseLedger
+from ledger.config import CHANGES_SUFFIX, SNAPSHOT_SUFFIX
+
+INITIAL_ROWS = 100_000
+CLIENTS = 50
+WRITES = 200
+READERS = 4
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def percentiles(latencies):
+    """Summarize latencies in seconds as milliseconds."""
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    pick = lambda percent: ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))] * 1000
+    return {'p50_ms': pick(50), 'p95_ms': pick(95), 'p99_ms': pick(99), 'max_ms': ordered[-1] * 1000,
+            'mean_ms': statistics.fmean(ordered) * 1000, 'requests': len(ordered)}
+
+async def request(reader, writer, **fields):
+    writer.write(json.dumps(fields).encode('utf-8') + b'\n')
+    await writer.drain()
+    reply = json.loads(await reader.readline())
+    if not reply['ok']:
+        raise ValueError(reply['error'])
+    return reply
+
+async def connect(port):
+    # Big limit so summary and search replies fit in one readline
+    return await asyncio.open_connection('127.0.0.1', port, limit=1 << 26)
+
+async def writer_client(port, number, writes, latencies):
+    reader, writer = await connect(port)
+    rng = random.Random(number)
+    try:
+        for index in range(writes):
+            expense = ['2024-06-01', f"Client {number} write {index}", rng.choice(CATEGORIES),
+                       f"{rng.randint(1, 50000) / 100:.2f}"]
+            start = time.perf_counter()
+            await request(reader, writer, op='add', expenses=[expense])
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+async def reader_client(port, number, done, latencies):
+    reader, writer = await connect(port)
+    try:
+        while not done.is_set():
+            start = time.perf_counter()
+            if number % 2:
+                await request(reader, writer, op='summary')
+            else:
+                await request(reader, writer, op='query', text=f"Vendor {number}", limit=100)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+async def drive(port, clients, writes, readers):
+    write_latencies, read_latencies = [], []
+    done = asyncio.Event()
+    reading = [asyncio.create_task(reader_client(port, number, done, read_latencies)) for number in range(readers)]
+    start = time.perf_counter()
+    await asyncio.gather(*(writer_client(port, number, writes, write_latencies) for number in range(clients)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await asyncio.gather(*reading)
+    return elapsed, write_latencies, read_latencies
+
+def run(initial_rows, clients, writes, readers, data_dir):
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"server-{initial_rows}.csv")
+    generate_ledger(path, initial_rows)
+    for suffix in (SNAPSHOT_SUFFIX, CHANGES_SUFFIX):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'ledger.server', '--backend', 'csv', '--path', path, '--port', str(port)],
+        cwd=ROOT, stderr=subprocess.PIPE, text=True
+    )
+    try:
+        print(server.stderr.readline().strip(), file=sys.stderr)
+        elapsed, write_latencies, read_latencies = asyncio.run(drive(port, clients, writes, readers))
+    finally:
+        server.terminate()
+        server.wait()
+    
+    ledger = ExpenseLedger(CSVStorage(path))
+    ledger.load()
+    expected = initial_rows + clients * writes
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'initial_rows': initial_rows,
+        'clients': clients,
+        'writes_per_client': writes,
+        'readers': readers,
+        'seconds': elapsed,
+        'writes_per_second': clients * writes / elapsed,
+        'write_latency': percentiles(write_latencies),
+        'read_latency': percentiles(read_latencies),
+        'rows_after': len(ledger),
+        'rows_expected': expected,
+        'intact': len(ledger) == expected,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=INITIAL_ROWS, help="rows in the ledger before the test")
+    parser.add_argument('--clients', type=int, default=CLIENTS, help="concurrent writing clients")
+    parser.add_argument('--writes', type=int, default=WRITES, help="expenses each writer adds")
+    parser.add_argument('--readers', type=int, default=READERS, help="clients reading while the writers run")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'expense-tracker-bench'),
+                        help="where the test ledger is written")
+    parser.add_argument('--output', help="write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+    
+    results = run(args.rows, args.clients, args.writes, args.readers, args.data_dir)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    if not results['intact']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
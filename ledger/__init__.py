@@ -0,0 +1,71 @@
+"""Display-free core of the expense tracker.
+
+Everything needed to load, query and append to the ledger without Tk:
+the columnar ledger model, aggregates and analytics, search and sort
+orders, category lookup and suggestions, storage backends including
+monthly partitions, the ledger server and its client, validation, bulk
+import, streaming export and instrumentation.
+Submodules are imported on first use of one of their names, so
+``import ledger`` stays cheap and batch jobs only pay for what they
+touch. The background worker lives in ``ledger.worker``.
+"""
+import importlib
+
+_EXPORTS = {
+    'GroupStats': 'analytics',
+    'LedgerAnalytics': 'analytics',
+    'MonthDelta': 'analytics',
+    'analyze': 'analytics',
+    'ExpenseAggregates': 'aggregates',
+    'CategoryModel': 'categories',
+    'CategoryStore': 'categories',
+    'export_expenses': 'export',
+    'select_expenses': 'export',
+    'ImportMapping': 'importer',
+    'import_statement': 'importer',
+    'read_statement': 'importer',
+    'LatencyHistogram': 'instrumentation',
+    'Metrics': 'instrumentation',
+    'OperationStats': 'instrumentation',
+    'ColumnarRows': 'model',
+    'Expense': 'model',
+    'ExpenseLedger': 'model',
+    'StringPool': 'model',
+    'format_cents': 'model',
+    'parse_cents': 'model',
+    'PartitionManifest': 'partitions',
+    'PartitionedStorage': 'partitions',
+    'split_ledger': 'partitions',
+    'ExpenseQuery': 'search',
+    'FilteredRows': 'search',
+    'SearchIndex': 'search',
+    'SortIndex': 'sorting',
+    'sort_keys': 'sorting',
+    'LedgerClient': 'server',
+    'LedgerServer': 'server',
+    'ServerStorage': 'server',
+    'CSVStorage': 'storage',
+    'ChangeLog': 'storage',
+    'ExpenseStorage': 'storage',
+    'LedgerSnapshot': 'storage',
+    'LedgerWriter': 'storage',
+    'SQLiteStorage': 'storage',
+    'migrate_csv_to_sqlite': 'storage',
+    'open_storage': 'storage',
+    'repair_torn_tail': 'storage',
+    'parse_date': 'validation',
+    'validate_expense': 'validation',
+}
+
+__all__ = sorted(_EXPORTS)
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,162 @@
+"""Running aggregates over the ledger."""
+from datetime import date, timedelta
+
+def month_end(day):
+    """Return the last day of ``day``'s month."""
+    if day.month == 12:
+        return date(day.year, 12, 31)
+    return date(day.year, day.month + 1, 1) - timedelta(days=1)
+
+class DateRollups:
+    """Per-category totals and counts bucketed by day, month and year.
+
+    Each bucket maps a category to ``[cents, count]``. Days are keyed by
+    date ordinal, months by ``(year, month)`` and years by ``year``. A
+    date range is answered by combining whole years, then whole months,
+    then single days at its edges, so the cost depends on the span of
+    the range rather than on the number of expenses in it.
+    """
+    def __init__(self):
+        self.days = {}
+        self.months = {}
+        self.years = {}
+        self._month_of = {}
+    
+    def month(self, day):
+        """Return ``(year, month)`` for the date ordinal ``day``."""
+        month = self._month_of.get(day)
+        if month is None:
+            when = date.fromordinal(day)
+            month = self._month_of[day] = (when.year, when.month)
+        return month
+    
+    def add(self, category, cents, day, count=1):
+        """Account for ``count`` expenses on the date with ordinal ``day``."""
+        month = self.month(day)
+        for buckets, key in ((self.days, day), (self.months, month), (self.years, month[0])):
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = {}
+            totals = bucket.get(category)
+            if totals is None:
+                bucket[category] = [cents, count]
+            else:
+                totals[0] += cents
+                totals[1] += count
+    
+    def remove(self, category, cents, day, count=1):
+        """Take back expenses that were added with the same values.
+
+        Categories whose count drops to zero leave their buckets, so
+        ranges don't report them.
+        """
+        month = self.month(day)
+        for buckets, key in ((self.days, day), (self.months, month), (self.years, month[0])):
+            bucket = buckets[key]
+            totals = bucket[category]
+            totals[0] -= cents
+            totals[1] -= count
+            if not totals[1]:
+                del bucket[category]
+                if not bucket:
+                    del buckets[key]
+    
+    def totals_between(self, start, end):
+        """Return ``{category: [cents, count]}`` for dates ``start`` to ``end`` inclusive."""
+        result = {}
+        day = start
+        while day <= end:
+            year_end = date(day.year, 12, 31)
+            if day.month == 1 and day.day == 1 and year_end <= end:
+                bucket, last = self.years.get(day.year), year_end
+            elif day.day == 1 and month_end(day) <= end:
+                bucket, last = self.months.get((day.year, day.month)), month_end(day)
+            else:
+                bucket, last = self.days.get(day.toordinal()), day
+            
+            for category, (cents, count) in (bucket or {}).items():
+                totals = result.get(category)
+                if totals is None:
+                    result[category] = [cents, count]
+                else:
+                    totals[0] += cents
+                    totals[1] += count
+            if last >= end:
+                break
+            day = last + timedelta(days=1)
+        return result
+
+class ExpenseAggregates:
+    """Running totals maintained as expenses are written.
+
+    Holds the grand total plus per-category totals and counts, all in
+    integer cents, so views read exact precomputed values instead of
+    scanning the ledger. Edits and deletions are applied as deltas with
+    ``remove`` and ``add``. Expenses with a known date are also rolled up
+    by day, month and year in ``rollups``.
+    """
+    def __init__(self):
+        self.clear()
+    
+    @classmethod
+    def from_summary(cls, summary):
+        """Rebuild aggregates from a ``summary`` dict, e.g. one read back from JSON."""
+        aggregates = cls()
+        aggregates.merge_summary(summary)
+        return aggregates
+    
+    def summary(self):
+        """Return the totals, counts and daily rollups as a JSON-ready dict."""
+        return {
+            'total': self.total,
+            'count': self.count,
+            'category_totals': self.category_totals,
+            'category_counts': self.category_counts,
+            'days': self.rollups.days,
+        }
+    
+    def merge(self, other):
+        """Add the expenses counted by another ExpenseAggregates to these."""
+        self.merge_summary(other.summary())
+    
+    def merge_summary(self, summary):
+        """Add the expenses counted in a ``summary`` dict to these."""
+        self.total += summary['total']
+        self.count += summary['count']
+        for category, cents in summary['category_totals'].items():
+            self.category_totals[category] = self.category_totals.get(category, 0) + cents
+        for category, count in summary['category_counts'].items():
+            self.category_counts[category] = self.category_counts.get(category, 0) + count
+        for day, bucket in summary['days'].items():
+            for category, (cents, count) in bucket.items():
+                self.rollups.add(category, cents, int(day), count)
+    
+    def clear(self):
+        self.total = 0
+        self.count = 0
+        self.category_totals = {}
+        self.category_counts = {}
+        self.rollups = DateRollups()
+    
+    def add(self, category, cents, day=0):
+        """Account for one expense dated with ordinal ``day`` (0 if unknown)."""
+        self.total += cents
+        self.count += 1
+        self.category_totals[category] = self.category_totals.get(category, 0) + cents
+        self.category_counts[category] = self.category_counts.get(category, 0) + 1
+        if day:
+            self.rollups.add(category, cents, day)
+    
+    def remove(self, category, cents, day=0):
+        """Take back one expense that was added with the same values."""
+        self.total -= cents
+        self.count -= 1
+        count = self.category_counts[category] - 1
+        if count:
+            self.category_totals[category] -= cents
+            self.category_counts[category] = count
+        else:
+            del self.category_totals[category]
+            del self.category_counts[category]
+        if day:
+            self.rollups.remove(category, cents, day)
@@ -0,0 +1,225 @@
+"""Summary statistics over the ledger.
+
+Group-by sums, counts, means, medians and percentiles per category and
+per month. NumPy is optional: when it is installed every statistic is
+computed in a few vectorized passes over the ledger's columns, and
+otherwise an equivalent pure-Python engine is used. Both interpolate
+percentiles linearly between the closest ranks, like
+``numpy.percentile``, so they agree on every value.
+"""
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import date
+
+from .config import ANALYTICS_ENGINE, ANALYTICS_PERCENTILES
+from .model import ColumnarRows, date_ordinal
+
+try:
+    import numpy
+except ImportError:  # optional; the pure-Python engine is used instead
+    numpy = None
+
+GroupStats = namedtuple('GroupStats', ['count', 'total', 'mean', 'median', 'percentiles'])
+GroupStats.__doc__ = """Statistics for one category or month.
+
+``total`` is exact integer cents; ``mean``, ``median`` and the
+``percentiles`` (in the order they were requested) are cents as floats.
+"""
+
+MonthDelta = namedtuple('MonthDelta', ['month', 'total', 'change', 'ratio'])
+MonthDelta.__doc__ = """A month's total and its change from the month before.
+
+``ratio`` is the change relative to the previous month's total, or
+None when nothing was spent that month.
+"""
+
+# Amounts below 2**VALUE_BITS cents are sorted packed under their group number
+VALUE_BITS = 40
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+class LedgerAnalytics:
+    """Per-category and per-month statistics for a set of ledger rows.
+
+    ``categories`` maps category names and ``months`` ``(year, month)``
+    tuples to GroupStats. Rows without a valid date only count towards
+    the categories.
+    """
+    def __init__(self, categories, months, percentiles, engine):
+        self.categories = categories
+        self.months = months
+        self.percentiles = percentiles
+        self.engine = engine
+    
+    def month_deltas(self):
+        """Return a MonthDelta for every month with expenses, oldest first."""
+        deltas = []
+        for year, month in sorted(self.months):
+            total = self.months[year, month].total
+            previous = self.months.get((year, month - 1) if month > 1 else (year - 1, 12))
+            before = previous.total if previous else 0
+            deltas.append(MonthDelta((year, month), total, total - before, (total - before) / before if before else None))
+        return deltas
+
+def analyze(rows, percentiles=ANALYTICS_PERCENTILES, engine=ANALYTICS_ENGINE, progress=None):
+    """Compute LedgerAnalytics for a sequence of ledger rows.
+
+    ``engine`` is 'numpy', 'python' or 'auto'. The columns are copied
+    before anything else, so this can run on a worker while the UI keeps
+    appending to ``rows``. ``progress`` is called with ``(done, total)``
+    between passes and may raise TaskCancelled.
+    """
+    if engine == 'auto':
+        engine = 'numpy' if numpy is not None else 'python'
+    if engine == 'numpy' and numpy is None:
+        raise ImportError("the numpy analytics engine needs NumPy installed")
+    report = progress or (lambda done, total: None)
+    
+    cents, dates, codes, names = columns(rows)
+    report(1, 3)
+    if engine == 'numpy':
+        by_code = numpy_categories(cents, codes, names, percentiles)
+        report(2, 3)
+        months = numpy_months(cents, dates, percentiles)
+    else:
+        by_code = python_stats(codes, cents, percentiles)
+        report(2, 3)
+        months = python_months(cents, dates, percentiles)
+    report(3, 3)
+    categories = {names[code]: stats for code, stats in by_code.items()}
+    return LedgerAnalytics(categories, months, tuple(percentiles), engine)
+
+def columns(rows):
+    """Copy amounts, date ordinals and category codes out of ``rows``.
+
+    Returns ``(cents, dates, codes, names)`` where ``names[code]`` is a
+    category. ColumnarRows are copied array by array, leaving out
+    deleted rows; other sequences, such as SQLite rows, are read expense
+    by expense.
+    """
+    if isinstance(rows, ColumnarRows):
+        length = len(rows)
+        cents, dates, codes = rows.cents[:length], rows.dates[:length], rows.category_codes[:length]
+        if rows.live is not None:
+            live = rows.live[:bisect_left(rows.live, length)]
+            cents = array('q', map(cents.__getitem__, live))
+            dates = array('i', map(dates.__getitem__, live))
+            codes = array('I', map(codes.__getitem__, live))
+        return cents, dates, codes, list(rows.categories.strings)
+    
+    cents, dates, codes, names, lookup = array('q'), array('i'), array('I'), [], {}
+    for expense in rows:
+        code = lookup.get(expense.category)
+        if code is None:
+            code = lookup[expense.category] = len(names)
+            names.append(expense.category)
+        cents.append(expense.cents)
+        dates.append(date_ordinal(expense.date))
+        codes.append(code)
+    return cents, dates, codes, names
+
+def month_key(number):
+    """Turn a count of months since 1970-01 into ``(year, month)``."""
+    return 1970 + number // 12, number % 12 + 1
+
+def numpy_categories(cents, codes, names, percentiles):
+    groups = numpy.frombuffer(codes, dtype=numpy.uint32).astype(numpy.int64)
+    return numpy_stats(groups, numpy.frombuffer(cents, dtype=numpy.int64), len(names), percentiles)
+
+def numpy_months(cents, dates, percentiles):
+    values = numpy.frombuffer(cents, dtype=numpy.int64)
+    ordinals = numpy.frombuffer(dates, dtype=numpy.int32)
+    dated = ordinals > 0
+    if not dated.all():
+        values, ordinals = values[dated], ordinals[dated]
+    if not len(ordinals):
+        return {}
+    
+    # Map each ordinal to its month through a table over the dates spanned,
+    # which is far shorter than the ledger.
+    first = int(ordinals.min())
+    span = numpy.arange(first, int(ordinals.max()) + 1) - EPOCH_ORDINAL
+    table = span.astype('datetime64[D]').astype('datetime64[M]').astype(numpy.int64)
+    base = int(table[0])
+    table -= base
+    stats = numpy_stats(table[ordinals - first], values, int(table[-1]) + 1, percentiles)
+    return {month_key(base + number): group for number, group in stats.items()}
+
+def numpy_stats(groups, values, size, percentiles):
+    """Return ``{group: GroupStats}`` for int64 arrays of group numbers and values.
+
+    Group numbers run from 0 to ``size - 1``. One sort by group and
+    value turns each group into a contiguous sorted run whose bounds are
+    found by binary search; sums come from ``add.reduceat`` and each
+    quantile of every group from one gather.
+    """
+    if not len(values):
+        return {}
+    if values.min() >= 0 and values.max() >> VALUE_BITS == 0:
+        packed = groups << VALUE_BITS
+        packed |= values
+        packed.sort()
+        bounds = numpy.searchsorted(packed, numpy.arange(size + 1, dtype=numpy.int64) << VALUE_BITS)
+        packed &= (1 << VALUE_BITS) - 1
+        values = packed
+    else:
+        order = numpy.lexsort((values, groups))
+        bounds = numpy.searchsorted(groups[order], numpy.arange(size + 1))
+        values = values[order]
+    
+    present = numpy.flatnonzero(bounds[1:] > bounds[:-1])
+    starts = bounds[present]
+    counts = bounds[present + 1] - starts
+    totals = numpy.add.reduceat(values, starts)
+    quantiles = []
+    for percent in (50,) + tuple(percentiles):
+        offset = (counts - 1) * (percent / 100)
+        whole = numpy.floor(offset).astype(numpy.int64)
+        low = starts + whole
+        high = numpy.minimum(low + 1, starts + counts - 1)
+        quantiles.append((values[low] + (values[high] - values[low]) * (offset - whole)).tolist())
+    
+    stats = {}
+    for index, (group, count, total) in enumerate(zip(present.tolist(), counts.tolist(), totals.tolist())):
+        stats[group] = GroupStats(count, total, total / count, quantiles[0][index],
+                                  tuple(column[index] for column in quantiles[1:]))
+    return stats
+
+def python_months(cents, dates, percentiles):
+    month_of = {}
+    months, values = [], []
+    for ordinal, amount in zip(dates, cents):
+        if not ordinal:
+            continue
+        month = month_of.get(ordinal)
+        if month is None:
+            day = date.fromordinal(ordinal)
+            month = month_of[ordinal] = (day.year, day.month)
+        months.append(month)
+        values.append(amount)
+    return python_stats(months, values, percentiles)
+
+def python_stats(groups, values, percentiles):
+    """Return ``{group: GroupStats}`` for parallel sequences of groups and values."""
+    buckets = {}
+    for group, value in zip(groups, values):
+        bucket = buckets.get(group)
+        if bucket is None:
+            bucket = buckets[group] = []
+        bucket.append(value)
+    
+    stats = {}
+    for group, bucket in buckets.items():
+        bucket.sort()
+        total = sum(bucket)
+        stats[group] = GroupStats(len(bucket), total, total / len(bucket), quantile(bucket, 50),
+                                  tuple(quantile(bucket, percent) for percent in percentiles))
+    return stats
+
+def quantile(ordered, percent):
+    """Linearly interpolated ``percent`` quantile of a sorted, non-empty list."""
+    offset = (len(ordered) - 1) * (percent / 100)
+    whole = int(offset)
+    low = ordered[whole]
+    high = ordered[min(whole + 1, len(ordered) - 1)]
+    return low + (high - low) * (offset - whole)
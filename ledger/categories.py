@@ -0,0 +1,183 @@
+"""Category list with prefix lookup, and category suggestions from descriptions."""
+import re
+from array import array
+from bisect import bisect_left
+
+from .config import CATEGORY_MATCHES, CATEGORY_SUGGEST_SHARE
+from .model import ColumnarRows
+
+WORD = re.compile(r'\w+')
+
+def tokens(text):
+    """Split text into lowercase words of two or more characters."""
+    return [word for word in WORD.findall(text.casefold()) if len(word) > 1]
+
+class TrieNode:
+    __slots__ = ('children', 'names')
+    
+    def __init__(self):
+        self.children = {}
+        self.names = set()
+
+class CategoryStore:
+    """The categories offered by the picker, in the order they were added.
+
+    Names are unique ignoring case: ``folded`` maps each casefolded name
+    to the name as it was added, so membership and duplicate checks are
+    a dict lookup. Every word of every name is also kept in a trie, so
+    typeahead finds the names with a word starting with each typed word
+    by walking down the trie rather than scanning thousands of names.
+    """
+    def __init__(self, names=()):
+        self.names = []
+        self.folded = {}
+        self.root = TrieNode()
+        for name in names:
+            self.add(name)
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __iter__(self):
+        return iter(self.names)
+    
+    def __contains__(self, name):
+        return name.casefold() in self.folded
+    
+    def find(self, name):
+        """Return the stored spelling of ``name``, or None if it isn't a category."""
+        return self.folded.get(name.strip().casefold())
+    
+    def add(self, name):
+        """Add a category; return False if it is blank or already there."""
+        name = name.strip()
+        folded = name.casefold()
+        if not name or folded in self.folded:
+            return False
+        self.folded[folded] = name
+        self.names.append(name)
+        for word in set(WORD.findall(folded)):
+            node = self.root
+            for char in word:
+                node = node.children.setdefault(char, TrieNode())
+            node.names.add(name)
+        return True
+    
+    def prefixed(self, prefix):
+        """Return the set of names with a word starting with ``prefix``."""
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        found, stack = set(), [node]
+        while stack:
+            node = stack.pop()
+            found |= node.names
+            stack.extend(node.children.values())
+        return found
+    
+    def matches(self, text, limit=CATEGORY_MATCHES):
+        """Return up to ``limit`` names matching typed ``text``, best first.
+
+        Every typed word has to start a word of the name. Names that
+        start with the whole text come first, then the rest, each in
+        alphabetical order. Blank text matches every name.
+        """
+        text = text.strip().casefold()
+        words = WORD.findall(text)
+        if not words:
+            return sorted(self.names, key=str.casefold)[:limit]
+        found = None
+        for word in sorted(words, key=len, reverse=True):
+            names = self.prefixed(word)
+            found = names if found is None else found & names
+            if not found:
+                return []
+        return sorted(found, key=lambda name: (not name.casefold().startswith(text), name.casefold()))[:limit]
+
+class CategoryModel:
+    """Suggests a category for a description from the categories of past expenses.
+
+    ``counts`` maps each word of a description to how often expenses
+    with that word were filed under each category. Each word of a new
+    description votes for categories in proportion to those counts, and
+    the winner is suggested when it has at least CATEGORY_SUGGEST_SHARE
+    of the votes. Suggestions are cached by description until the model
+    learns something new.
+    """
+    def __init__(self, min_share=CATEGORY_SUGGEST_SHARE):
+        self.min_share = min_share
+        self.counts = {}
+        self.cache = {}
+    
+    @classmethod
+    def from_rows(cls, rows, progress=None):
+        """Learn from every live row of a ledger; can run on a worker.
+
+        ColumnarRows are counted by (description, category) code pair
+        first, so each distinct description is only split into words
+        once. Returns the model and the number of rows it covers, so
+        rows appended meanwhile can be learned with ``learn`` after.
+        ``progress`` is called with ``(done, total)`` between the passes
+        and may raise TaskCancelled.
+        """
+        report = progress or (lambda done, total: None)
+        model = cls()
+        length = len(rows)
+        if isinstance(rows, ColumnarRows):
+            pairs = zip(rows.description_codes[:length], rows.category_codes[:length])
+            if rows.live is not None:
+                live = rows.live[:bisect_left(rows.live, length)]
+                pairs = zip(array('I', map(rows.description_codes.__getitem__, live)),
+                            array('I', map(rows.category_codes.__getitem__, live)))
+            pair_counts = {}
+            for pair in pairs:
+                pair_counts[pair] = pair_counts.get(pair, 0) + 1
+            report(1, 2)
+            descriptions, categories = rows.descriptions, rows.categories
+            for (description, category), count in pair_counts.items():
+                model.add(descriptions[description], categories[category], count)
+        else:
+            # SQLiteRows; their page cache belongs to the UI thread
+            for expense in rows.head(length):
+                model.add(expense.description, expense.category)
+        report(2, 2)
+        return model, length
+    
+    def add(self, description, category, count=1):
+        counts = self.counts
+        for word in set(tokens(description)):
+            votes = counts.get(word)
+            if votes is None:
+                votes = counts[word] = {}
+            votes[category] = votes.get(category, 0) + count
+    
+    def learn(self, expenses):
+        """Count newly added Expenses."""
+        for expense in expenses:
+            self.add(expense.description, expense.category)
+        self.cache.clear()
+    
+    def suggest(self, description):
+        """Return the likeliest category for ``description``, or None if no category stands out."""
+        key = description.strip().casefold()
+        if key in self.cache:
+            return self.cache[key]
+        scores = {}
+        words = 0
+        for word in set(tokens(key)):
+            votes = self.counts.get(word)
+            if not votes:
+                continue
+            words += 1
+            total = sum(votes.values())
+            for category, count in votes.items():
+                scores[category] = scores.get(category, 0) + count / total
+        best = None
+        if scores:
+            category = max(scores, key=scores.get)
+            if scores[category] >= self.min_share * words:
+                best = category
+        self.cache[key] = best
+        return best
@@ -0,0 +1,103 @@
+"""Ledger file locations and tuning knobs."""
+
+# Files
+EXPENSE_FILE = 'expenses.csv'
+DATABASE_FILE = 'expenses.db'
+STORAGE_BACKEND = 'csv'  # 'csv', 'partitioned', 'sqlite' or 'server'
+EXPENSE_FIELDS = ['date', 'description', 'category', 'amount']
+
+# Out-of-order rows are merged into the date index in groups of at least this many
+DATE_INDEX_MERGE_ROWS = 4096
+
+# Sorted views bisect appended rows into place one at a time; a batch
+# of more than this many rebuilds the sort order instead
+SORT_INSERT_ROWS = 2048
+
+# Parsed CSV ledgers are cached next to the CSV file with this suffix
+SNAPSHOT_SUFFIX = '.snapshot'
+SNAPSHOT_TAIL_BYTES = 4096
+
+# Write path: rows are written in groups of WRITE_FLUSH_ROWS, or
+# within WRITE_FLUSH_MS of an add, and WRITE_FSYNC sets durability
+# ('never', 'flush' or 'always'; see LedgerWriter)
+WRITE_FLUSH_ROWS = 256
+WRITE_FLUSH_MS = 500
+WRITE_FSYNC = 'flush'
+
+# A CSV that ends in a partial record and hasn't changed for
+# TORN_TAIL_SECONDS is taken to have been torn by a crash when opened
+TORN_TAIL_SECONDS = 5
+
+# Edits and deletions are appended to a change log kept next to the CSV
+# with this suffix. Once it holds COMPACT_CHANGES entries the CSV is
+# rewritten with them applied, on the worker.
+CHANGES_SUFFIX = '.changes'
+COMPACT_CHANGES = 500
+
+# Watch mode: the app polls the CSV every WATCH_POLL_MS (0 turns it off)
+# for records other programs appended. Appends larger than
+# WATCH_MAX_BYTES are picked up by a full load on the worker instead.
+WATCH_POLL_MS = 1000
+WATCH_MAX_BYTES = 1 << 20
+
+# Partitioned ledgers keep one CSV per month in PARTITION_DIR, indexed by
+# PARTITION_MANIFEST with each month's totals. Sessions load the last
+# PARTITION_RECENT_MONTHS months and read older ones when a search or the
+# statistics reach back to them. Totals of months changed outside the app
+# are recomputed on up to PARTITION_WORKERS processes (None: one per CPU).
+PARTITION_DIR = 'expenses'
+PARTITION_MANIFEST = 'manifest.json'
+PARTITION_RECENT_MONTHS = 2
+PARTITION_WORKERS = None
+
+# Server mode: ``python -m ledger.server`` owns the ledger and serves it
+# on SERVER_HOST:SERVER_PORT; with STORAGE_BACKEND = 'server' the app
+# runs as one of its clients. Replies carry at most SERVER_PAGE_ROWS
+# rows and requests may be up to SERVER_MAX_REQUEST bytes long.
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SERVER_TIMEOUT = 30
+SERVER_PAGE_ROWS = 50000
+SERVER_MAX_REQUEST = 64 << 20
+# Statements the server's import request reads must be in this directory
+# on the server's disk (None: import requests are refused)
+SERVER_IMPORT_DIR = None
+
+# SQLite rows are fetched in pages of this many for the expense table
+SQLITE_PAGE_SIZE = 256
+
+# Background work
+WORKER_THREADS = 2
+WORKER_POLL_MS = 50
+WORKER_MAX_PENDING = 2
+PROGRESS_EVERY_ROWS = 20000
+
+# Bulk import
+IMPORT_BATCH_SIZE = 10000
+IMPORT_REJECTS_FILE = 'import_rejects.csv'
+
+# Export: selected expenses are streamed to the output file in chunks
+# of EXPORT_CHUNK_ROWS, so memory use doesn't grow with the ledger
+EXPORT_CHUNK_ROWS = 5000
+
+# Category picker: typing lists at most CATEGORY_MATCHES categories. A
+# category is suggested for a description when the words in it give one
+# at least CATEGORY_SUGGEST_SHARE of their votes.
+CATEGORY_MATCHES = 200
+CATEGORY_SUGGEST_SHARE = 0.5
+
+# Instrumentation: the app records call counts, latency histograms and
+# bytes read and written for its main operations, and writes them as
+# JSON to METRICS_FILE on exit (None: don't). METRICS_CAPTURE also runs
+# cProfile ('profile'), tracemalloc ('memory') or both ('profile,memory')
+# for the whole session, keeping the METRICS_CAPTURE_TOP heaviest
+# functions and allocation sites.
+METRICS_ENABLED = True
+METRICS_FILE = 'metrics.json'
+METRICS_CAPTURE = ''
+METRICS_CAPTURE_TOP = 30
+
+# Summary statistics: 'auto' uses NumPy when it is installed, 'numpy' or
+# 'python' force one engine. Percentiles are reported besides the median.
+ANALYTICS_ENGINE = 'auto'
+ANALYTICS_PERCENTILES = (25, 75, 90)
@@ -0,0 +1,268 @@
+"""Streaming export of ledger rows to CSV, JSON Lines, Parquet and XLSX.
+
+Expenses flow through a generator pipeline: ``select_expenses`` picks
+the rows in a date range and set of categories, ``chunked`` groups them
+into lists of EXPORT_CHUNK_ROWS, and a writer for the chosen format
+writes one chunk at a time, so memory use stays flat however large the
+ledger is. Amounts are written exactly from their integer cents: as
+decimal text in CSV and JSON Lines, and as decimals in Parquet and
+XLSX. pyarrow and openpyxl are only imported when their format is used.
+"""
+import csv
+import json
+import os
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+
+from .config import EXPENSE_FIELDS, EXPORT_CHUNK_ROWS, PROGRESS_EVERY_ROWS
+from .instrumentation import metrics
+from .model import ColumnarRows, date_ordinal, format_cents
+from .search import FilteredRows
+
+# Rows per worksheet in an XLSX file, header included
+XLSX_MAX_ROWS = 1048576
+
+def select_expenses(rows, start=None, end=None, categories=None, progress=None):
+    """Yield the Expenses of ``rows`` dated ``start`` to ``end`` in ``categories``.
+
+    ``rows`` is a ledger's rows or a view of them such as search results;
+    deleted rows are skipped either way. ``start`` and ``end`` are dates
+    and ``categories`` a collection of names, each None to select
+    everything. On ColumnarRows the filters are checked on the columns,
+    so only selected rows become Expenses. ``progress`` is called with
+    ``(scanned, total)`` every PROGRESS_EVERY_ROWS rows and may raise
+    TaskCancelled.
+    """
+    low = start.toordinal() if start is not None else None
+    high = end.toordinal() if end is not None else None
+    source, numbers = rows, None
+    if isinstance(rows, FilteredRows):
+        source, numbers = rows.rows, rows.indices
+    
+    if isinstance(source, ColumnarRows):
+        if numbers is None:
+            numbers = range(len(source))
+        total = len(numbers)
+        dates, codes, deleted = source.dates, source.category_codes, source.deleted
+        wanted = None
+        if categories is not None:
+            known = source.categories.codes
+            wanted = {known[name] for name in categories if name in known}
+        for scanned, row in enumerate(numbers, 1):
+            if progress and not scanned % PROGRESS_EVERY_ROWS:
+                progress(scanned, total)
+            if row in deleted:
+                continue
+            if low is not None and dates[row] < low or high is not None and not 0 < dates[row] <= high:
+                continue
+            if wanted is not None and codes[row] not in wanted:
+                continue
+            yield source[row]
+    else:
+        # Other rows, such as SQLite ones, are read expense by expense
+        # through cursors of their own, not the UI thread's page cache
+        total = len(rows)
+        if categories is not None:
+            categories = set(categories)
+        expenses = iter(source) if numbers is None else source.fetch(numbers)
+        for scanned, expense in enumerate(expenses, 1):
+            if progress and not scanned % PROGRESS_EVERY_ROWS:
+                progress(scanned, total)
+            if low is not None or high is not None:
+                ordinal = date_ordinal(expense.date)
+                if low is not None and ordinal < low or high is not None and not 0 < ordinal <= high:
+                    continue
+            if categories is not None and expense.category not in categories:
+                continue
+            yield expense
+    if progress:
+        progress(total, total)
+
+def chunked(expenses, size=EXPORT_CHUNK_ROWS):
+    """Group an iterable of Expenses into lists of up to ``size``."""
+    expenses = iter(expenses)
+    while True:
+        chunk = list(islice(expenses, size))
+        if not chunk:
+            return
+        yield chunk
+
+def exact_amount(cents):
+    """Return integer cents as a Decimal with two places."""
+    return Decimal(cents).scaleb(-2)
+
+def iso_date(text):
+    """Return an ISO date string as a date, or None if it isn't one."""
+    ordinal = date_ordinal(text)
+    return date.fromordinal(ordinal) if ordinal else None
+
+class CSVExport:
+    """Writes chunks as CSV with the columns of the ledger file."""
+    def __init__(self, path):
+        self.file = open(path, mode='w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(EXPENSE_FIELDS)
+    
+    def write(self, chunk):
+        self.writer.writerows(
+            (expense.date, expense.description, expense.category, format_cents(expense.cents))
+            for expense in chunk
+        )
+    
+    def close(self):
+        self.file.close()
+
+class JSONLinesExport:
+    """Writes chunks as one JSON object per line.
+
+    Amounts are written as JSON numbers with exactly two decimals, so
+    readers that parse numbers as decimals (``json.loads(line,
+    parse_float=Decimal)``) get them back exactly.
+    """
+    def __init__(self, path):
+        self.file = open(path, mode='w', encoding='utf-8')
+    
+    def write(self, chunk):
+        dumps = json.dumps
+        self.file.write(''.join(
+            f'{{"date": {dumps(expense.date)}, "description": {dumps(expense.description)}, '
+            f'"category": {dumps(expense.category)}, "amount": {format_cents(expense.cents)}}}\n'
+            for expense in chunk
+        ))
+    
+    def close(self):
+        self.file.close()
+
+class ParquetExport:
+    """Writes each chunk as a row group of a Parquet file, using pyarrow.
+
+    Dates are ``date32``, null where a row's date isn't ISO formatted,
+    and amounts ``decimal128(18, 2)``.
+    """
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow installed") from None
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            ('date', pyarrow.date32()),
+            ('description', pyarrow.string()),
+            ('category', pyarrow.string()),
+            ('amount', pyarrow.decimal128(18, 2)),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+    
+    def write(self, chunk):
+        table = self.pyarrow.table([
+            [iso_date(expense.date) for expense in chunk],
+            [expense.description for expense in chunk],
+            [expense.category for expense in chunk],
+            [exact_amount(expense.cents) for expense in chunk],
+        ], schema=self.schema)
+        self.writer.write_table(table)
+    
+    def close(self):
+        self.writer.close()
+
+class XLSXExport:
+    """Writes chunks to an Excel workbook with openpyxl's write-only mode.
+
+    Write-only worksheets stream their rows to disk instead of keeping
+    cells in memory. Dates become date cells where they are ISO
+    formatted and amounts decimal cells shown with two places. A sheet
+    that fills up is continued on a new one.
+    """
+    def __init__(self, path):
+        try:
+            from openpyxl import Workbook
+            from openpyxl.cell import WriteOnlyCell
+        except ImportError:
+            raise ImportError("XLSX export needs openpyxl installed") from None
+        self.path = path
+        self.cell = WriteOnlyCell
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+        self.sheet_rows = XLSX_MAX_ROWS
+    
+    def add_sheet(self):
+        sheets = len(self.workbook.worksheets)
+        self.sheet = self.workbook.create_sheet(f"Expenses {sheets + 1}" if sheets else "Expenses")
+        self.sheet.append(EXPENSE_FIELDS)
+        self.sheet_rows = 1
+    
+    def write(self, chunk):
+        cell = self.cell
+        for expense in chunk:
+            if self.sheet_rows == XLSX_MAX_ROWS:
+                self.add_sheet()
+            sheet = self.sheet
+            when = iso_date(expense.date)
+            if when is not None:
+                when = cell(sheet, when)
+                when.number_format = 'yyyy-mm-dd'
+            else:
+                when = expense.date
+            amount = cell(sheet, exact_amount(expense.cents))
+            amount.number_format = '0.00'
+            sheet.append([when, expense.description, expense.category, amount])
+            self.sheet_rows += 1
+    
+    def close(self):
+        if self.sheet is None:
+            self.add_sheet()
+        self.workbook.save(self.path)
+
+# Format name: (label, file extension, writer)
+EXPORT_FORMATS = {
+    'csv': ("CSV", '.csv', CSVExport),
+    'jsonl': ("JSON Lines", '.jsonl', JSONLinesExport),
+    'parquet': ("Parquet", '.parquet', ParquetExport),
+    'xlsx': ("Excel workbook", '.xlsx', XLSXExport),
+}
+
+def export_format(path):
+    """Return the export format for a file name from its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.ndjson':
+        return 'jsonl'
+    for name, (label, suffix, writer) in EXPORT_FORMATS.items():
+        if extension == suffix:
+            return name
+    raise ValueError(f"can't tell the export format of {path!r}; use one of "
+                     + ", ".join(suffix for label, suffix, writer in EXPORT_FORMATS.values()))
+
+def export_expenses(rows, path, format=None, start=None, end=None, categories=None,
+                    chunk_rows=EXPORT_CHUNK_ROWS, progress=None):
+    """Stream the selected expenses of ``rows`` to ``path``; return how many were written.
+
+    ``format`` is a key of EXPORT_FORMATS, by default taken from the
+    file extension, and ``start``, ``end`` and ``categories`` select rows
+    like ``select_expenses``. The file is written under a temporary name
+    and only replaces ``path`` once complete, so a failed or cancelled
+    export leaves nothing behind. Can run on a worker.
+    """
+    writer_class = EXPORT_FORMATS[format or export_format(path)][2]
+    temp_path = path + '.tmp'
+    with metrics.measure('export_expenses') as measurement:
+        writer = writer_class(temp_path)
+        written = 0
+        try:
+            try:
+                for chunk in chunked(select_expenses(rows, start, end, categories, progress), chunk_rows):
+                    writer.write(chunk)
+                    written += len(chunk)
+            finally:
+                writer.close()
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        metrics.count_written(os.path.getsize(temp_path))
+        os.replace(temp_path, path)
+        measurement.rows = written
+    return written
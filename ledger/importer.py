@@ -0,0 +1,84 @@
+"""Streaming bulk import of external CSV files."""
+import csv
+import datetime
+import os
+from collections import namedtuple
+
+from .config import IMPORT_BATCH_SIZE, IMPORT_REJECTS_FILE, PROGRESS_EVERY_ROWS
+from .validation import validate_expense
+
+ImportMapping = namedtuple(
+    'ImportMapping',
+    ['date', 'description', 'amount', 'category', 'default_category', 'date_format', 'negate', 'delimiter'],
+    defaults=(None, '', None, False, ',')
+)
+ImportMapping.__doc__ = """Column mapping for an external CSV such as a bank statement.
+
+``date``, ``description``, ``amount`` and ``category`` name columns of
+the file; without a category column, or where it is blank,
+``default_category`` is used. ``date_format`` is a strptime format for
+dates that aren't ISO, and ``negate`` flips the sign of amounts for
+statements that list debits as negative numbers. Thousands separators
+in amounts are ignored.
+"""
+
+def read_statement(file, mapping):
+    """Yield ``(line_number, expense, error)`` for each record of an external CSV.
+
+    Exactly one of ``expense`` and ``error`` is set. Rows are validated
+    with the same rules as the expense form.
+    """
+    reader = csv.DictReader(file, delimiter=mapping.delimiter)
+    for record in reader:
+        try:
+            when = (record.get(mapping.date) or '').strip()
+            if when and mapping.date_format:
+                when = datetime.datetime.strptime(when, mapping.date_format).date().isoformat()
+            amount = (record.get(mapping.amount) or '').strip().replace(',', '')
+            if amount and mapping.negate:
+                amount = amount[1:] if amount.startswith('-') else '-' + amount
+            category = (record.get(mapping.category) or '').strip() if mapping.category else ''
+            expense = validate_expense(
+                when,
+                (record.get(mapping.description) or '').strip(),
+                category or mapping.default_category,
+                amount
+            )
+        except ValueError as error:
+            yield reader.line_num, None, str(error)
+        else:
+            yield reader.line_num, expense, None
+
+def import_statement(path, mapping, batch_size=IMPORT_BATCH_SIZE, rejects_path=IMPORT_REJECTS_FILE,
+                     progress=None, publish=None):
+    """Stream an external CSV into validated batches of expenses.
+
+    Each full batch is handed to ``publish``, which is expected to write
+    it to the ledger, so memory use is bounded by the batch size however
+    large the file is. Rejected rows are written to ``rejects_path`` with
+    their line number and reason instead of aborting the run. Returns
+    ``(imported, rejected)`` counts.
+    """
+    imported = rejected = 0
+    batch = []
+    with open(path, mode='r', newline='', encoding='utf-8-sig') as file, \
+            open(rejects_path, mode='w', newline='') as rejects_file:
+        size = os.fstat(file.fileno()).st_size
+        rejects = csv.writer(rejects_file)
+        rejects.writerow(['line', 'reason'])
+        for line, expense, error in read_statement(file, mapping):
+            if error:
+                rejected += 1
+                rejects.writerow([line, error])
+            else:
+                batch.append(expense)
+                if len(batch) >= batch_size:
+                    imported += len(batch)
+                    publish(batch)
+                    batch = []
+            if progress and not (imported + rejected + len(batch)) % PROGRESS_EVERY_ROWS:
+                progress(file.buffer.tell(), size)
+    if batch:
+        imported += len(batch)
+        publish(batch)
+    return imported, rejected
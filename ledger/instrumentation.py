@@ -0,0 +1,286 @@
+"""Lightweight instrumentation of ledger operations.
+
+A Metrics registry keeps, per named operation, a call count, a latency
+histogram, the rows it handled and the bytes it read and wrote. Timing
+is two ``perf_counter_ns`` calls and a dict lookup, so it stays on by
+default. Bytes are counted where the storage backends touch their files
+and attributed to whichever operation is running on the same thread, so
+work on the background worker and the UI thread don't mix. On request
+a cProfile and tracemalloc capture runs alongside, and everything can
+be exported as JSON.
+"""
+import datetime
+import json
+import os
+import platform
+import threading
+import time
+
+from .config import METRICS_CAPTURE_TOP, METRICS_ENABLED
+
+class LatencyHistogram:
+    """Log-linear histogram of latencies in microseconds.
+
+    Every power of two is split into four buckets, so a percentile read
+    back from the histogram is within 25% of the true value, whatever
+    its magnitude, and a recording is a few integer operations.
+    """
+    def __init__(self):
+        self.counts = {}
+    
+    @staticmethod
+    def bucket(micros):
+        if micros < 4:
+            return micros
+        shift = micros.bit_length() - 3
+        return (shift + 1) * 4 + (micros >> shift) - 4
+    
+    @staticmethod
+    def bounds(bucket):
+        """Return the ``[low, high)`` microseconds covered by ``bucket``."""
+        if bucket < 4:
+            return bucket, bucket + 1
+        shift = bucket // 4 - 1
+        low = (bucket % 4 + 4) << shift
+        return low, low + (1 << shift)
+    
+    def add(self, micros):
+        bucket = self.bucket(micros)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+    
+    def percentile(self, percent):
+        """Upper bound in microseconds of the bucket holding the ``percent`` percentile."""
+        total = sum(self.counts.values())
+        if not total:
+            return 0
+        rank = total * percent / 100
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                break
+        return self.bounds(bucket)[1]
+    
+    def as_list(self):
+        """Return ``[low_us, high_us, count]`` for every bucket with samples."""
+        return [[*self.bounds(bucket), self.counts[bucket]] for bucket in sorted(self.counts)]
+
+class OperationStats:
+    """Totals and latency histogram for one instrumented operation."""
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.histogram = LatencyHistogram()
+        self.last_ns = 0
+        self.last_rows = 0
+        self.last_time = None
+    
+    def add(self, elapsed_ns, rows, read, written):
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        self.max_ns = max(self.max_ns, elapsed_ns)
+        self.rows += rows
+        self.bytes_read += read
+        self.bytes_written += written
+        self.histogram.add(elapsed_ns // 1000)
+        self.last_ns = elapsed_ns
+        self.last_rows = rows
+        self.last_time = time.time()
+    
+    def as_dict(self):
+        histogram = self.histogram
+        return {
+            'calls': self.calls,
+            'total_ms': self.total_ns / 1e6,
+            'mean_ms': self.total_ns / self.calls / 1e6 if self.calls else 0,
+            'p50_ms': histogram.percentile(50) / 1000,
+            'p95_ms': histogram.percentile(95) / 1000,
+            'p99_ms': histogram.percentile(99) / 1000,
+            'max_ms': self.max_ns / 1e6,
+            'rows': self.rows,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'last_ms': self.last_ns / 1e6,
+            'last_rows': self.last_rows,
+            'last_time': self.last_time,
+            'histogram_us': histogram.as_list(),
+        }
+
+class IOCounters(threading.local):
+    """Bytes read and written so far by the current thread."""
+    read = 0
+    written = 0
+
+class Measurement:
+    """Context manager timing one call of an operation.
+
+    ``rows`` may be set inside the block once the number of rows the
+    call handled is known.
+    """
+    __slots__ = ('metrics', 'name', 'rows', 'start', 'read', 'written')
+    
+    def __init__(self, metrics, name, rows):
+        self.metrics = metrics
+        self.name = name
+        self.rows = rows
+    
+    def __enter__(self):
+        io = self.metrics.io
+        self.read = io.read
+        self.written = io.written
+        self.start = time.perf_counter_ns()
+        return self
+    
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter_ns() - self.start
+        io = self.metrics.io
+        self.metrics.record(self.name, elapsed, self.rows, io.read - self.read, io.written - self.written)
+
+class NullMeasurement:
+    """Stand-in for Measurement while instrumentation is off."""
+    rows = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        pass
+    
+    def __setattr__(self, name, value):
+        pass
+
+NULL_MEASUREMENT = NullMeasurement()
+
+class Metrics:
+    """Registry of OperationStats by operation name.
+
+    Operations are timed with ``measure`` and storage code reports file
+    traffic with ``count_read`` and ``count_written``. Recording is
+    thread-safe; with ``enabled`` off ``measure`` does nothing.
+    """
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.operations = {}
+        self.io = IOCounters()
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.profiler = None
+        self.capture = None
+        self.captured = None
+    
+    def measure(self, name, rows=0):
+        """Return a context manager recording one call of operation ``name``."""
+        if not self.enabled:
+            return NULL_MEASUREMENT
+        return Measurement(self, name, rows)
+    
+    def record(self, name, elapsed_ns, rows=0, read=0, written=0):
+        with self.lock:
+            stats = self.operations.get(name)
+            if stats is None:
+                stats = self.operations[name] = OperationStats()
+            stats.add(elapsed_ns, rows, read, written)
+    
+    def count_read(self, size):
+        self.io.read += size
+    
+    def count_written(self, size):
+        self.io.written += size
+    
+    def stats(self, name):
+        """Return the OperationStats of ``name``, or None if it hasn't run yet."""
+        return self.operations.get(name)
+    
+    @property
+    def capturing(self):
+        return self.capture is not None
+    
+    def start_capture(self, profile=True, memory=True):
+        """Start profiling with cProfile and/or tracing allocations with tracemalloc.
+
+        cProfile only sees the thread that starts the capture, normally
+        the UI thread; tracemalloc sees every thread.
+        """
+        if self.capturing:
+            return
+        self.capture = {'started': time.time()}
+        if profile:
+            import cProfile
+            
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if memory:
+            import tracemalloc
+            
+            tracemalloc.start()
+            self.capture['memory'] = True
+    
+    def stop_capture(self, top=METRICS_CAPTURE_TOP):
+        """Stop the capture and return its results, keeping them for ``snapshot``.
+
+        The results hold the ``top`` functions by cumulative time and the
+        ``top`` source lines by allocated memory.
+        """
+        if not self.capturing:
+            return None
+        result = {'seconds': time.time() - self.capture['started']}
+        if self.profiler is not None:
+            import pstats
+            
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler).stats
+            self.profiler = None
+            heaviest = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            result['profile'] = [
+                {'function': f"{path}:{line}({function})", 'calls': calls, 'primitive_calls': primitive,
+                 'own_seconds': own, 'cumulative_seconds': cumulative}
+                for (path, line, function), (primitive, calls, own, cumulative, callers) in heaviest
+            ]
+        if self.capture.get('memory'):
+            import tracemalloc
+            
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result['memory'] = {
+                'current_bytes': current,
+                'peak_bytes': peak,
+                'top': [{'line': str(stat.traceback[0]), 'bytes': stat.size, 'blocks': stat.count}
+                        for stat in snapshot.statistics('lineno')[:top]],
+            }
+        self.capture = None
+        with self.lock:
+            self.captured = result
+        return result
+    
+    def snapshot(self):
+        """Return all statistics as a JSON-serializable dict."""
+        with self.lock:
+            operations = {name: stats.as_dict() for name, stats in sorted(self.operations.items())}
+            captured = self.captured
+        now = time.time()
+        result = {
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'exported': datetime.datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+            'uptime_seconds': now - self.started,
+            'python': platform.python_version(),
+            'operations': operations,
+        }
+        if captured:
+            result['capture'] = captured
+        return result
+    
+    def export(self, path):
+        """Write ``snapshot`` to ``path`` as JSON, replacing it atomically."""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.snapshot(), file, indent=2)
+            file.write('\n')
+        os.replace(temp_path, path)
+
+# Shared by the storage backends and the app
+metrics = Metrics()
@@ -0,0 +1,452 @@
+"""Ledger rows and the in-memory ledger model."""
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from .aggregates import ExpenseAggregates
+from .config import DATE_INDEX_MERGE_ROWS
+from .search import FilteredRows, SearchIndex
+from .sorting import SortIndex, sort_keys
+
+# Amounts are int64 cents in memory and decimal(18, 2) in exports
+MAX_CENTS = 10 ** 18 - 1
+
+def parse_cents(text):
+    """Parse a decimal amount into exact integer cents.
+
+    Raises ValueError for anything that isn't a finite number, or is
+    more than MAX_CENTS cents either way.
+    """
+    text = str(text).strip()
+    whole, _, fraction = text.partition('.')
+    if whole.isascii() and whole.isdigit() and len(fraction) <= 2 and (not fraction or fraction.isdigit()):
+        # Fast path for plain amounts such as "12", "12.5" or "12.50"
+        cents = int(whole) * 100 + int(fraction.ljust(2, '0'))
+    else:
+        try:
+            cents = int((Decimal(text) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+        except InvalidOperation:
+            raise ValueError(f"invalid amount: {text!r}") from None
+    if not -MAX_CENTS <= cents <= MAX_CENTS:
+        raise ValueError(f"amount out of range: {text!r}")
+    return cents
+
+def check_cents(expense):
+    """Raise ValueError if an Expense's amount is more than MAX_CENTS either way."""
+    if not -MAX_CENTS <= expense.cents <= MAX_CENTS:
+        raise ValueError(f"amount out of range: {expense.cents} cents")
+
+def format_cents(cents):
+    """Format integer cents as a decimal amount string."""
+    whole, fraction = divmod(abs(cents), 100)
+    return f"{'-' if cents < 0 else ''}{whole}.{fraction:02d}"
+
+Expense = namedtuple('Expense', ['date', 'description', 'category', 'cents'])
+
+def expense_from_record(record):
+    """Build an Expense from a CSV record, parsing the amount once."""
+    return Expense(record[0], record[1], record[2], parse_cents(record[3]))
+
+_ordinals = {}
+
+def date_ordinal(text):
+    """Return the ordinal for a ``YYYY-MM-DD`` date string, or 0 if it isn't one.
+
+    Only that exact form counts. Python 3.11 also parses forms such as
+    ``20240101`` or ``2024-W01-1``, which would sort and filter
+    differently as strings.
+    """
+    ordinal = _ordinals.get(text)
+    if ordinal is None:
+        try:
+            parsed = date.fromisoformat(text)
+        except (TypeError, ValueError):
+            parsed = None
+        ordinal = parsed.toordinal() if parsed is not None and parsed.isoformat() == text else 0
+        _ordinals[text] = ordinal
+    return ordinal
+
+class StringPool:
+    """Interned strings addressed by small integer codes."""
+    def __init__(self):
+        self.strings = []
+        self.codes = {}
+    
+    def __len__(self):
+        return len(self.strings)
+    
+    def __getitem__(self, code):
+        return self.strings[code]
+    
+    def intern(self, text):
+        """Return the code for ``text``, adding it to the pool if new."""
+        code = self.codes.get(text)
+        if code is None:
+            code = self.codes[text] = len(self.strings)
+            self.strings.append(text)
+        return code
+    
+    def extend(self, strings):
+        for text in strings:
+            self.intern(text)
+
+class DateIndex:
+    """Row numbers sorted by date, for date range lookups.
+
+    ``keys`` holds the date ordinals of the rows in ``order`` so ranges
+    are found by bisection. Rows appended in date order, the common
+    case, extend the sorted run directly. Out-of-order rows wait in a
+    small unsorted ``pending`` list that is merged in once it outgrows
+    DATE_INDEX_MERGE_ROWS or an eighth of the index. Rows without a
+    known date are not indexed.
+    """
+    def __init__(self, dates):
+        self.dates = dates
+        self.keys = array('i')
+        self.order = array('I')
+        self.pending = []
+    
+    def __len__(self):
+        return len(self.order) + len(self.pending)
+    
+    def add(self, row):
+        ordinal = self.dates[row]
+        if not ordinal:
+            return
+        if not self.keys or ordinal >= self.keys[-1]:
+            self.keys.append(ordinal)
+            self.order.append(row)
+            return
+        self.pending.append(row)
+        if len(self.pending) > max(DATE_INDEX_MERGE_ROWS, len(self.order) // 8):
+            self.merge()
+    
+    def merge(self):
+        """Fold the pending rows into the sorted run."""
+        if not self.pending:
+            return
+        dates = self.dates
+        pending = sorted((dates[row], row) for row in self.pending)
+        keys, order = array('i'), array('I')
+        for ordinal, row in heapq.merge(zip(self.keys, self.order), pending):
+            keys.append(ordinal)
+            order.append(row)
+        self.keys, self.order, self.pending = keys, order, []
+    
+    def remove(self, row):
+        """Take a row out of the index, e.g. before its date changes."""
+        ordinal = self.dates[row]
+        if not ordinal:
+            return
+        if row in self.pending:
+            self.pending.remove(row)
+            return
+        position = self.order.index(row, bisect_left(self.keys, ordinal), bisect_right(self.keys, ordinal))
+        del self.keys[position]
+        del self.order[position]
+    
+    def count_between(self, start, end):
+        """Return how many rows are dated from ordinal ``start`` to ``end``."""
+        count = bisect_right(self.keys, end) - bisect_left(self.keys, start)
+        if self.pending:
+            dates = self.dates
+            count += sum(1 for row in self.pending if start <= dates[row] <= end)
+        return count
+    
+    def rows_between(self, start, end):
+        """Return row numbers dated from ordinal ``start`` to ``end``, in date order."""
+        rows = self.order[bisect_left(self.keys, start):bisect_right(self.keys, end)]
+        if self.pending:
+            dates = self.dates
+            extra = sorted((dates[row], row) for row in self.pending if start <= dates[row] <= end)
+            if extra:
+                return [row for _, row in heapq.merge(((dates[row], row) for row in rows), extra)]
+        return rows
+
+class ColumnarRows:
+    """Compact, array-backed ledger rows.
+
+    Each field lives in its own typed array: dates as ordinals, amounts
+    as int64 cents, categories as codes into an interned table and
+    descriptions as codes into a shared string pool. Rows are only
+    materialized as Expense tuples when accessed. Dates that aren't ISO
+    formatted are stored as ordinal 0 with the original text kept aside.
+    ``date_index`` keeps the rows sorted by date and ``search_index``
+    answers text, date and amount filters. ``sort_indexes`` holds a
+    SortIndex for every sort order asked for so far.
+
+    Row numbers double as stable row IDs: rows are edited in place, and
+    a deleted row stays behind as a tombstone in ``deleted`` rather than
+    shifting the rows after it. Once anything is deleted, ``live`` holds
+    the numbers of the rows that are left.
+    """
+    def __init__(self):
+        self.dates = array('i')
+        self.cents = array('q')
+        self.category_codes = array('I')
+        self.description_codes = array('I')
+        self.categories = StringPool()
+        self.descriptions = StringPool()
+        self.raw_dates = {}
+        self.deleted = set()
+        self.live = None
+        self.date_index = DateIndex(self.dates)
+        self.search_index = SearchIndex(self)
+        self.sort_indexes = {}
+    
+    def __len__(self):
+        return len(self.cents)
+    
+    def __iter__(self):
+        for index in range(len(self.cents)):
+            yield self[index]
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.cents)
+        ordinal = self.dates[index]
+        return Expense(
+            date.fromordinal(ordinal).isoformat() if ordinal else self.raw_dates[index],
+            self.descriptions[self.description_codes[index]],
+            self.categories[self.category_codes[index]],
+            self.cents[index]
+        )
+    
+    def append(self, expense):
+        """Add an Expense and return its date ordinal."""
+        row = len(self.cents)
+        ordinal = date_ordinal(expense.date)
+        # Amounts first: one that doesn't fit fails before any column grows
+        self.cents.append(expense.cents)
+        if not ordinal:
+            self.raw_dates[row] = expense.date
+        self.dates.append(ordinal)
+        self.category_codes.append(self.categories.intern(expense.category))
+        self.description_codes.append(self.descriptions.intern(expense.description))
+        self.date_index.add(row)
+        if self.live is not None:
+            self.live.append(row)
+        return ordinal
+    
+    def extend_rows(self, other):
+        """Append every row of another ColumnarRows, deleted ones included.
+
+        The columns are copied array by array with the other's string
+        codes mapped into these pools. When the other rows are all dated
+        on or after these, as consecutive months are, their date index
+        is appended as it is instead of being rebuilt.
+        """
+        start = len(self.cents)
+        self.dates.extend(other.dates)
+        self.cents.extend(other.cents)
+        for codes, pool, other_codes, other_pool in (
+                (self.category_codes, self.categories, other.category_codes, other.categories),
+                (self.description_codes, self.descriptions, other.description_codes, other.descriptions)):
+            mapping = [pool.intern(text) for text in other_pool.strings]
+            codes.extend(array('I', map(mapping.__getitem__, other_codes)))
+        for row, text in other.raw_dates.items():
+            self.raw_dates[start + row] = text
+        if self.live is not None or other.live is not None:
+            if self.live is None:
+                self.live = array('I', range(start))
+            self.live.extend(array('I', map(start.__add__, other.live)) if other.live is not None
+                             else range(start, len(self.cents)))
+            self.deleted.update(map(start.__add__, other.deleted))
+        
+        index, other_index = self.date_index, other.date_index
+        other_index.merge()
+        if not index.pending and (not index.keys or not other_index.keys or other_index.keys[0] >= index.keys[-1]):
+            index.keys.extend(other_index.keys)
+            index.order.extend(array('I', map(start.__add__, other_index.order)))
+        else:
+            for row in range(start, len(self.cents)):
+                if row not in self.deleted:
+                    index.add(row)
+    
+    def replace(self, row, expense):
+        """Overwrite row ``row`` with an Expense and return its new date ordinal."""
+        description, category = self.description_codes[row], self.category_codes[row]
+        self.date_index.remove(row)
+        for index in self.sort_indexes.values():
+            index.remove(row)
+        ordinal = date_ordinal(expense.date)
+        if ordinal:
+            self.raw_dates.pop(row, None)
+        else:
+            self.raw_dates[row] = expense.date
+        self.dates[row] = ordinal
+        self.cents[row] = expense.cents
+        self.category_codes[row] = self.categories.intern(expense.category)
+        self.description_codes[row] = self.descriptions.intern(expense.description)
+        self.date_index.add(row)
+        self.search_index.update(row, description, category)
+        for index in self.sort_indexes.values():
+            index.add(row)
+        return ordinal
+    
+    def delete(self, row):
+        """Mark row ``row`` deleted; its number is never reused."""
+        if self.live is None:
+            self.live = array('I', range(len(self.cents)))
+        del self.live[bisect_left(self.live, row)]
+        self.date_index.remove(row)
+        for index in self.sort_indexes.values():
+            index.remove(row)
+        self.deleted.add(row)
+    
+    def visible(self):
+        """Return the rows that aren't deleted, as a sequence of Expenses."""
+        return self if self.live is None else FilteredRows(self, self.live)
+    
+    def rows_between(self, start, end):
+        """Return row numbers dated from ``start`` to ``end`` (dates), in date order."""
+        return self.date_index.rows_between(start.toordinal(), end.toordinal())
+    
+    def search(self, query):
+        """Return a FilteredRows view of the rows matching an ExpenseQuery."""
+        return FilteredRows(self, self.search_index.search(query))
+    
+    def sort_by(self, keys, query=None):
+        """Return a FilteredRows view of the live rows, or those matching ``query``, sorted by ``keys``.
+
+        ``keys`` is a sequence of ``(column, descending)`` pairs, see
+        ``sort_keys``. An order and its exact opposite share one
+        SortIndex, so flipping the direction costs no more than a copy.
+        """
+        keys = sort_keys(keys)
+        reverse = keys[0][1]
+        if reverse:
+            keys = tuple((column, not descending) for column, descending in keys)
+        index = self.sort_indexes.get(keys)
+        if index is None:
+            index = self.sort_indexes[keys] = SortIndex(self, keys)
+        indices = self.search_index.search(query) if query is not None else None
+        return FilteredRows(self, index.sorted(indices, reverse))
+
+class ExpenseLedger:
+    """In-memory model of the expense ledger.
+
+    The ledger owns the rows loaded from storage and their aggregates so
+    the UI can append a single expense without re-reading the file.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self.rows = ColumnarRows()
+        self.aggregates = ExpenseAggregates()
+    
+    def __len__(self):
+        return len(self.rows) - len(self.rows.deleted)
+    
+    def __iter__(self):
+        return iter(self.rows.visible())
+    
+    @property
+    def total(self):
+        return self.aggregates.total
+    
+    def load(self, progress=None):
+        """Read the whole ledger from storage, replacing the in-memory rows."""
+        self.replace(*self.storage.load(progress))
+        return self.rows
+    
+    def replace(self, rows, aggregates):
+        """Swap in rows and aggregates loaded elsewhere, e.g. on a worker."""
+        self.rows = rows
+        self.aggregates = aggregates
+    
+    def append(self, expense):
+        """Persist an Expense and add it to the in-memory rows.
+
+        Amounts the rows can't hold are refused before anything is
+        written, so storage never gets a record the next load can't read
+        back, and row IDs stay in step with the stored records.
+        """
+        check_cents(expense)
+        self.storage.append(expense)
+        self.rows.append(expense)
+        self.aggregates.add(expense.category, expense.cents, date_ordinal(expense.date))
+        return expense
+    
+    def extend(self, expenses):
+        """Persist a batch of Expenses and add them to the in-memory rows."""
+        for expense in expenses:
+            check_cents(expense)
+        self.storage.append_many(expenses)
+        for expense in expenses:
+            self.rows.append(expense)
+            self.aggregates.add(expense.category, expense.cents, date_ordinal(expense.date))
+    
+    def update(self, row, expense):
+        """Replace the expense with row ID ``row`` and return the old one.
+
+        The change is logged by the storage and the aggregates move by
+        the difference.
+        """
+        if row in self.rows.deleted:
+            raise KeyError(f"expense {row} was deleted")
+        check_cents(expense)
+        old = self.rows[row]
+        self.storage.update(row, expense)
+        self.aggregates.remove(old.category, old.cents, date_ordinal(old.date))
+        self.aggregates.add(expense.category, expense.cents, self.rows.replace(row, expense))
+        return old
+    
+    def delete(self, row):
+        """Delete the expense with row ID ``row`` and return it."""
+        if row in self.rows.deleted:
+            raise KeyError(f"expense {row} was deleted")
+        old = self.rows[row]
+        self.storage.delete(row)
+        self.rows.delete(row)
+        self.aggregates.remove(old.category, old.cents, date_ordinal(old.date))
+        return old
+    
+    def visible(self):
+        """Return the expenses that weren't deleted, for display."""
+        return self.rows.visible()
+    
+    def covers(self, start):
+        """Return whether the loaded rows hold every expense dated ``start`` or later.
+
+        ``start`` is a date, or None to ask about the whole ledger. Only
+        storages that load part of the ledger, such as partitioned ones,
+        can return False.
+        """
+        since = self.storage.loaded_since()
+        return since is None or (start is not None and start >= since)
+    
+    def follow(self):
+        """Add the records other processes appended to the storage.
+
+        Returns the new Expenses, or None when the storage changed in a
+        way that needs a full ``load``.
+        """
+        expenses = self.storage.follow()
+        for expense in expenses or ():
+            self.rows.append(expense)
+            self.aggregates.add(expense.category, expense.cents, date_ordinal(expense.date))
+        return expenses
+    
+    def totals_between(self, start, end):
+        """Return ``{category: [cents, count]}`` for dates ``start`` to ``end`` inclusive."""
+        return self.aggregates.rollups.totals_between(start, end)
+    
+    def search(self, query):
+        """Return the rows matching an ExpenseQuery as a sequence of Expenses."""
+        return self.rows.search(query)
+    
+    def sort_by(self, keys, query=None):
+        """Return the expenses, or those matching an ExpenseQuery, sorted by ``(column, descending)`` keys."""
+        return self.rows.sort_by(keys, query)
+    
+    def flush(self):
+        """Write out buffered expenses."""
+        self.storage.flush()
+    
+    def close(self):
+        """Checkpoint and close the storage."""
+        self.storage.checkpoint(self.rows, self.aggregates)
+        self.storage.close()
@@ -0,0 +1,413 @@
+"""Ledgers split into one CSV file per month.
+
+A partitioned ledger is a directory of CSVStorage files named
+``YYYY-MM.csv`` after the month of their expenses (``undated.csv`` holds
+rows without an ISO date) and a PartitionManifest with the totals of
+every month. Sessions only read the recent months, so startup doesn't
+grow with the ledger's history; older months count towards the total,
+the category summary and reports through their totals in the manifest,
+and their rows are read when a search or the statistics need them.
+"""
+import csv
+import json
+import multiprocessing
+import os
+import re
+import shutil
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+
+from .aggregates import ExpenseAggregates
+from .config import (
+    CHANGES_SUFFIX, EXPENSE_FIELDS, EXPENSE_FILE, PARTITION_DIR, PARTITION_MANIFEST, PARTITION_RECENT_MONTHS,
+    PARTITION_WORKERS, WATCH_MAX_BYTES
+)
+from .model import ColumnarRows, ExpenseLedger, date_ordinal, format_cents
+from .storage import CSVStorage, ExpenseStorage
+
+PARTITION_NAME = re.compile(r'(\d{4}-\d{2}|undated)\.csv')
+# Month key of expenses without an ISO date; sorts before every month
+UNDATED = ''
+# Partition files kept open at once while splitting a ledger
+SPLIT_OPEN_FILES = 64
+
+def month_key(text):
+    """Return the partition key of an expense date, ``'YYYY-MM'`` or UNDATED."""
+    ordinal = date_ordinal(text)
+    if not ordinal:
+        return UNDATED
+    day = date.fromordinal(ordinal)
+    return f"{day.year:04d}-{day.month:02d}"
+
+def partition_file(month):
+    return f"{month or 'undated'}.csv"
+
+def partition_stamp(path):
+    """Return the sizes and mtime of a partition's files, to tell when they change."""
+    stat = os.stat(path)
+    try:
+        changes = os.stat(path + CHANGES_SUFFIX).st_size
+    except FileNotFoundError:
+        changes = 0
+    return [stat.st_size, stat.st_mtime_ns, changes]
+
+def summarize_partition(path):
+    """Load one partition and return ``(summary, stamp)`` for the manifest.
+
+    Loading also brings the partition's snapshot up to date. Runs in a
+    worker process of ``summarize_partitions``.
+    """
+    storage = CSVStorage(path)
+    try:
+        _, aggregates = storage.load()
+    finally:
+        storage.close()
+    return aggregates.summary(), partition_stamp(path)
+
+def summarize_partitions(paths, workers=PARTITION_WORKERS):
+    """Return ``summarize_partition`` of each path, computed in parallel.
+
+    Months are independent, so each is loaded by one of up to
+    ``workers`` processes. A single month, or a platform where worker
+    processes can't be started, is done in this process instead.
+    """
+    if len(paths) < 2:
+        return [summarize_partition(path) for path in paths]
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    try:
+        # Spawned rather than forked: the app calls this from a worker thread.
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            return list(pool.map(summarize_partition, paths))
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        return [summarize_partition(path) for path in paths]
+
+class PartitionManifest:
+    """Index of a partitioned ledger's months.
+
+    A JSON file mapping each month key to its file, the totals of its
+    expenses as an ExpenseAggregates summary and the partition_stamp
+    they were computed at. Totals whose stamp no longer matches the
+    files were made stale by a change elsewhere and are recomputed.
+    """
+    VERSION = 1
+    
+    def __init__(self, path):
+        self.path = path
+        self.months = {}
+        self.changed = False
+    
+    def read(self):
+        """Read the manifest, or start an empty one if it is missing or unreadable."""
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+            self.months = data['months'] if data['version'] == self.VERSION else {}
+        except (OSError, ValueError, LookupError, TypeError):
+            self.months = {}
+        self.changed = False
+        return self.months
+    
+    def summary(self, month, stamp):
+        """Return the totals of ``month`` if they were computed at ``stamp``, else None."""
+        entry = self.months.get(month)
+        if entry is None or entry['stamp'] != stamp:
+            return None
+        return entry['summary']
+    
+    def record(self, month, summary, stamp):
+        entry = self.months.get(month)
+        if entry is None or entry['stamp'] != stamp:
+            self.months[month] = {'file': partition_file(month), 'stamp': stamp, 'summary': summary}
+            self.changed = True
+    
+    def forget(self, months):
+        """Drop the months whose files are gone."""
+        for month in set(self.months).difference(months):
+            del self.months[month]
+            self.changed = True
+    
+    def write(self):
+        """Save the manifest if anything was recorded since it was read."""
+        if not self.changed:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({'version': self.VERSION, 'months': self.months}))
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+class PartitionedStorage(ExpenseStorage):
+    """Ledger kept as monthly CSV partitions in one directory.
+
+    ``load`` reads the months from ``since`` on, each through its own
+    CSVStorage and snapshot, and adds the manifest totals of the months
+    before; ``include`` moves ``since`` back for the next load. Row IDs
+    are positions in the loaded rows, and ``parts`` and ``locals`` map
+    each to its month's number in ``months`` and its row ID in that
+    month's storage. Expenses are written to the month of their date, so
+    an edit that changes the month moves the expense to another file.
+
+    The months loaded by default, and any month written to, stay open as
+    ExpenseLedgers in ``opened`` whose own rows keep their snapshots and
+    manifest totals current. Older months are closed once read.
+    """
+    def __init__(self, directory=PARTITION_DIR, recent_months=PARTITION_RECENT_MONTHS, workers=PARTITION_WORKERS):
+        self.directory = directory
+        self.workers = workers
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = PartitionManifest(os.path.join(directory, PARTITION_MANIFEST))
+        today = date.today()
+        first = today.year * 12 + today.month - recent_months
+        self.recent = date(first // 12, first % 12 + 1, 1)
+        self.since = self.recent
+        self.complete = False
+        self.known = set()
+        self.months = []
+        self.numbers = {}
+        self.parts = array('H')
+        self.locals = array('I')
+        self.opened = {}
+    
+    def path(self, month):
+        return os.path.join(self.directory, partition_file(month))
+    
+    def scan(self):
+        """Return the sorted month keys of the partition files in the directory."""
+        months = []
+        for name in os.listdir(self.directory):
+            match = PARTITION_NAME.fullmatch(name)
+            if match:
+                months.append(UNDATED if match[1] == 'undated' else match[1])
+        return sorted(months)
+    
+    def number(self, month):
+        """Return the number of ``month`` in ``months``, adding it if it is new."""
+        number = self.numbers.get(month)
+        if number is None:
+            number = self.numbers[month] = len(self.months)
+            self.months.append(month)
+        return number
+    
+    def partition(self, month):
+        """Return the open ExpenseLedger of ``month``, opening it (or a new month) if needed."""
+        ledger = self.opened.get(month)
+        if ledger is None:
+            ledger = ExpenseLedger(CSVStorage(self.path(month)))
+            ledger.load()
+            self.opened[month] = ledger
+            self.known.add(month)
+        return ledger
+    
+    def loaded_since(self):
+        return None if self.complete else self.since
+    
+    def include(self, start):
+        if self.complete or self.since is None:
+            return False
+        if start is None:
+            self.since = None
+        elif start < self.since:
+            self.since = date(start.year, start.month, 1)
+        else:
+            return False
+        return True
+    
+    def load(self, progress=None):
+        months = self.scan()
+        first = month_key(self.since.isoformat()) if self.since else UNDATED
+        recent = month_key(self.recent.isoformat())
+        loading = [month for month in months if month >= first]
+        manifest = self.manifest
+        manifest.read()
+        
+        rows, aggregates = ColumnarRows(), ExpenseAggregates()
+        self.months, self.numbers = [], {}
+        self.skipped = 0
+        parts, local_rows = array('H'), array('I')
+        for done, month in enumerate(loading, 1):
+            ledger = self.opened.get(month)
+            if ledger is not None:
+                ledger.load()
+            else:
+                ledger = ExpenseLedger(CSVStorage(self.path(month)))
+                ledger.load()
+                if month >= recent:
+                    self.opened[month] = ledger
+                else:
+                    ledger.storage.close()
+            self.skipped += ledger.storage.skipped
+            parts.extend(array('H', [self.number(month)]) * len(ledger.rows))
+            local_rows.extend(range(len(ledger.rows)))
+            rows.extend_rows(ledger.rows)
+            aggregates.merge(ledger.aggregates)
+            manifest.record(month, ledger.aggregates.summary(), partition_stamp(self.path(month)))
+            if progress:
+                progress(done, len(loading))
+        
+        stale = []
+        for month in months[:len(months) - len(loading)]:
+            ledger = self.opened.get(month)
+            if ledger is not None:
+                # An older month opened for a write is current in memory
+                ledger.flush()
+                aggregates.merge(ledger.aggregates)
+                manifest.record(month, ledger.aggregates.summary(), partition_stamp(self.path(month)))
+                continue
+            summary = manifest.summary(month, partition_stamp(self.path(month)))
+            if summary is None:
+                stale.append(month)
+            else:
+                aggregates.merge_summary(summary)
+        for month, (summary, stamp) in zip(stale, summarize_partitions([self.path(month) for month in stale], self.workers)):
+            manifest.record(month, summary, stamp)
+            aggregates.merge_summary(summary)
+        manifest.forget(months)
+        try:
+            manifest.write()
+        except OSError:
+            pass
+        
+        self.parts, self.locals = parts, local_rows
+        self.known = set(months)
+        self.complete = len(loading) == len(months)
+        return rows, aggregates
+    
+    def append(self, expense):
+        self.append_many((expense,))
+    
+    def append_many(self, expenses):
+        keys = [month_key(expense.date) for expense in expenses]
+        batches = {}
+        for month, expense in zip(keys, expenses):
+            batch = batches.get(month)
+            if batch is None:
+                batch = batches[month] = []
+            batch.append(expense)
+        
+        slots = {}
+        for month, batch in batches.items():
+            ledger = self.partition(month)
+            slots[month] = [self.number(month), len(ledger.rows)]
+            ledger.extend(batch)
+        for month in keys:
+            slot = slots[month]
+            self.parts.append(slot[0])
+            self.locals.append(slot[1])
+            slot[1] += 1
+    
+    def update(self, row, expense):
+        month, target = self.months[self.parts[row]], month_key(expense.date)
+        if target == month:
+            self.partition(month).update(self.locals[row], expense)
+            return
+        self.partition(month).delete(self.locals[row])
+        ledger = self.partition(target)
+        self.parts[row], self.locals[row] = self.number(target), len(ledger.rows)
+        ledger.append(expense)
+    
+    def delete(self, row):
+        self.partition(self.months[self.parts[row]]).delete(self.locals[row])
+    
+    def follow(self, max_bytes=WATCH_MAX_BYTES):
+        first = month_key(self.since.isoformat()) if self.since else UNDATED
+        if any(month >= first and month not in self.known for month in self.scan()):
+            # Another program started a month this session shows
+            return None
+        found = []
+        for month, ledger in list(self.opened.items()):
+            expenses = ledger.storage.follow(max_bytes)
+            if expenses is None:
+                return None
+            if not expenses:
+                continue
+            number, start = self.number(month), len(ledger.rows)
+            for expense in expenses:
+                ledger.aggregates.add(expense.category, expense.cents, ledger.rows.append(expense))
+            self.parts.extend(array('H', [number]) * len(expenses))
+            self.locals.extend(range(start, start + len(expenses)))
+            found.extend(expenses)
+        return found
+    
+    def start_compaction(self):
+        for ledger in list(self.opened.values()):
+            job = ledger.storage.start_compaction()
+            if job is not None:
+                return ledger.storage, job
+        return None
+    
+    def compact(self, job, progress=None):
+        storage, job = job
+        storage.compact(job, progress)
+    
+    def finish_compaction(self, job):
+        storage, job = job
+        return storage.finish_compaction(job)
+    
+    def checkpoint(self, rows, aggregates):
+        manifest = self.manifest
+        manifest.read()
+        for month, ledger in list(self.opened.items()):
+            ledger.storage.checkpoint(ledger.rows, ledger.aggregates)
+            manifest.record(month, ledger.aggregates.summary(), partition_stamp(self.path(month)))
+        try:
+            manifest.write()
+        except OSError:
+            pass
+    
+    def flush(self):
+        for ledger in list(self.opened.values()):
+            ledger.flush()
+    
+    def close(self):
+        for ledger in list(self.opened.values()):
+            ledger.storage.close()
+
+def split_ledger(csv_path=EXPENSE_FILE, directory=PARTITION_DIR, workers=PARTITION_WORKERS):
+    """Split a single-file CSV ledger into monthly partitions under ``directory``.
+
+    Runs once: nothing is done if ``directory`` already exists or there
+    is no CSV, and None returned. Otherwise returns the number of records
+    left out because they don't parse, like ``migrate_csv_to_sqlite``.
+    Records are streamed into their month's file, then every month is
+    summarized for the manifest in parallel, all in a temporary directory
+    that is renamed into place once complete. The CSV file is left in
+    place.
+    """
+    if os.path.exists(directory) or not os.path.exists(csv_path):
+        return None
+    temp_dir = directory + '.tmp'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    
+    source = CSVStorage(csv_path)
+    months, files = set(), {}
+    try:
+        for expense in source.iter_rows():
+            month = month_key(expense.date)
+            # Reinserted on every use so the least recently used file comes first
+            entry = files.pop(month, None)
+            if entry is None:
+                if len(files) >= SPLIT_OPEN_FILES:
+                    files.pop(next(iter(files)))[0].close()
+                file = open(os.path.join(temp_dir, partition_file(month)), mode='a', newline='')
+                entry = (file, csv.writer(file))
+                if month not in months:
+                    months.add(month)
+                    entry[1].writerow(EXPENSE_FIELDS)
+            files[month] = entry
+            entry[1].writerow((expense.date, expense.description, expense.category, format_cents(expense.cents)))
+    finally:
+        source.close()
+        for file, _ in files.values():
+            file.close()
+    
+    months = sorted(months)
+    manifest = PartitionManifest(os.path.join(temp_dir, PARTITION_MANIFEST))
+    paths = [os.path.join(temp_dir, partition_file(month)) for month in months]
+    for month, (summary, stamp) in zip(months, summarize_partitions(paths, workers)):
+        manifest.record(month, summary, stamp)
+    manifest.write()
+    os.replace(temp_dir, directory)
+    return source.skipped
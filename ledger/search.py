@@ -0,0 +1,200 @@
+"""Text search and filtering over the ledger rows."""
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import date
+
+ExpenseQuery = namedtuple(
+    'ExpenseQuery', ['text', 'start', 'end', 'min_cents', 'max_cents'],
+    defaults=('', None, None, None, None)
+)
+ExpenseQuery.__doc__ = """Filter for ledger rows.
+
+``text`` is matched case-insensitively as a substring of the
+description or category. ``start`` and ``end`` are dates and
+``min_cents`` and ``max_cents`` integer cents, all inclusive; any of
+them may be None to leave that side open.
+"""
+
+def trigrams(text):
+    return {text[index:index + 3] for index in range(len(text) - 2)}
+
+class TrigramIndex:
+    """Trigram index over the strings of a StringPool.
+
+    Maps each trigram of a lowercased string to the set of pool codes
+    containing it, so a substring query only checks the strings that
+    share all of its trigrams. Strings are indexed once, when ``sync``
+    first sees them after they were interned.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.lowered = []
+        self.grams = {}
+    
+    def sync(self):
+        """Index strings added to the pool since the last call."""
+        strings = self.pool.strings
+        grams = self.grams
+        for code in range(len(self.lowered), len(strings)):
+            text = strings[code].lower()
+            self.lowered.append(text)
+            for gram in trigrams(text):
+                codes = grams.get(gram)
+                if codes is None:
+                    grams[gram] = {code}
+                else:
+                    codes.add(code)
+    
+    def matches(self, text):
+        """Return the codes whose string contains ``text``."""
+        self.sync()
+        lowered = self.lowered
+        if len(text) < 3:
+            candidates = range(len(lowered))
+        else:
+            sets = sorted((self.grams.get(gram, ()) for gram in trigrams(text)), key=len)
+            candidates = sorted(set(sets[0]).intersection(*sets[1:]))
+        return [code for code in candidates if text in lowered[code]]
+
+class SearchIndex:
+    """Answers ExpenseQuery filters over a ColumnarRows.
+
+    Text is looked up in trigram indexes over the description and
+    category pools, and the matching strings' posting lists give the
+    rows that use them. A date range comes from the rows' date index.
+    When a query has both, the smaller side is gathered and checked
+    against the other; amounts are checked last. Postings are extended
+    with the rows appended since the previous query, so the index keeps
+    up with appends without rebuilding; edited rows are moved between
+    postings and deleted rows are dropped from the results.
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.descriptions = TrigramIndex(rows.descriptions)
+        self.categories = TrigramIndex(rows.categories)
+        self.description_rows = {}
+        self.category_rows = {}
+        self.indexed = 0
+    
+    def sync(self):
+        """Index the strings and rows added since the last query."""
+        self.descriptions.sync()
+        self.categories.sync()
+        rows = self.rows
+        start = self.indexed
+        for postings, codes in ((self.description_rows, rows.description_codes),
+                                (self.category_rows, rows.category_codes)):
+            for row, code in enumerate(codes[start:], start):
+                found = postings.get(code)
+                if found is None:
+                    found = postings[code] = array('I')
+                found.append(row)
+        self.indexed = len(rows)
+    
+    def update(self, row, description, category):
+        """Move an edited row off the postings of its old description and category codes."""
+        if row >= self.indexed:
+            return
+        rows = self.rows
+        for postings, old, new in ((self.description_rows, description, rows.description_codes[row]),
+                                   (self.category_rows, category, rows.category_codes[row])):
+            if old == new:
+                continue
+            found = postings[old]
+            del found[bisect_left(found, row)]
+            found = postings.get(new)
+            if found is None:
+                found = postings[new] = array('I')
+            found.insert(bisect_left(found, row), row)
+    
+    def search(self, query):
+        """Return the row numbers matching ``query``, in ledger order."""
+        self.sync()
+        rows = self.rows
+        text = query.text.strip().lower()
+        if text:
+            descriptions = self.descriptions.matches(text)
+            categories = self.categories.matches(text)
+            if len(descriptions) == len(rows.descriptions) or len(categories) == len(rows.categories):
+                text = ''
+        
+        dated = query.start is not None or query.end is not None
+        if dated:
+            start = (query.start or date.min).toordinal()
+            end = (query.end or date.max).toordinal()
+            in_range = rows.date_index.count_between(start, end)
+            dated = in_range < len(rows)
+        
+        if dated:
+            if not text:
+                hits = sorted(rows.date_index.rows_between(start, end))
+            elif self.count(descriptions, categories) <= in_range:
+                dates = rows.dates
+                hits = [row for row in self.text_rows(descriptions, categories) if start <= dates[row] <= end]
+            else:
+                description_flags = flags(descriptions, len(rows.descriptions))
+                category_flags = flags(categories, len(rows.categories))
+                description_codes, category_codes = rows.description_codes, rows.category_codes
+                hits = [row for row in sorted(rows.date_index.rows_between(start, end))
+                        if description_flags[description_codes[row]] or category_flags[category_codes[row]]]
+        elif text:
+            hits = self.text_rows(descriptions, categories)
+        else:
+            hits = range(len(rows))
+        
+        if query.min_cents is not None or query.max_cents is not None:
+            low = query.min_cents if query.min_cents is not None else float('-inf')
+            high = query.max_cents if query.max_cents is not None else float('inf')
+            cents = rows.cents
+            hits = [row for row in hits if low <= cents[row] <= high]
+        if rows.deleted:
+            deleted = rows.deleted
+            hits = [row for row in hits if row not in deleted]
+        return hits
+    
+    def count(self, descriptions, categories):
+        """Upper bound on the rows using any of the given string codes."""
+        return (sum(len(self.description_rows.get(code, ())) for code in descriptions)
+                + sum(len(self.category_rows.get(code, ())) for code in categories))
+    
+    def text_rows(self, descriptions, categories):
+        """Return the sorted rows using any of the given description or category codes."""
+        found = array('I')
+        for code in descriptions:
+            found.extend(self.description_rows.get(code, ()))
+        if categories:
+            by_category = array('I')
+            for code in categories:
+                by_category.extend(self.category_rows.get(code, ()))
+            if descriptions:
+                return sorted(set(found).union(by_category))
+            found = by_category
+        return sorted(found)
+
+def flags(codes, size):
+    """Return a bytearray of ``size`` with the given codes set."""
+    result = bytearray(size)
+    for code in codes:
+        result[code] = 1
+    return result
+
+class FilteredRows:
+    """Sequence view of the rows selected by a query."""
+    def __init__(self, rows, indices):
+        self.rows = rows
+        self.indices = indices
+    
+    def __len__(self):
+        return len(self.indices)
+    
+    def __iter__(self):
+        rows = self.rows
+        return (rows[index] for index in self.indices)
+    
+    def __getitem__(self, index):
+        return self.rows[self.indices[index]]
+    
+    def source_index(self, index):
+        """Return the ledger row number shown at ``index``."""
+        return self.indices[index]
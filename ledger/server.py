@@ -0,0 +1,439 @@
+"""Multi-client ledger server.
+
+``python -m ledger.server`` lets one process own the ledger and serve it
+to any number of clients over a local TCP socket, so several people can
+record expenses into the same file without their appends interleaving.
+The app becomes a client with ``STORAGE_BACKEND = 'server'``.
+
+Requests and replies are JSON objects, one per line. Expenses travel as
+``[date, description, category, amount]`` with the amount as an exact
+decimal string, and are addressed by their row ID:
+
+- ``{"op": "add", "expenses": [...]}`` returns the new ``ids``,
+- ``{"op": "update", "id": ..., "expense": [...]}`` and
+  ``{"op": "delete", "id": ...}`` return the server's ``changes`` count,
+- ``{"op": "query", "text": ..., "start": ..., "end": ..., "min_cents":
+  ..., "max_cents": ..., "offset": ..., "limit": ...}`` returns a page of
+  matching ``rows`` and their ``total``,
+- ``{"op": "rows", "start": ...}`` returns a page of rows by ID, the
+  ``deleted`` IDs among them, the ledger ``length`` and ``changes``,
+- ``{"op": "summary", "start": ..., "end": ...}`` returns totals per
+  category, for a date range if one is given,
+- ``{"op": "import", "path": ..., "mapping": {...}}`` imports a statement
+  from the server's import directory, ``path`` being relative to it.
+
+Every reply has ``"ok"``; a failed request gets ``"error"`` instead of
+its result.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import socket
+import sys
+import threading
+from array import array
+from datetime import date
+
+from .aggregates import ExpenseAggregates
+from .config import (
+    SERVER_HOST, SERVER_IMPORT_DIR, SERVER_MAX_REQUEST, SERVER_PAGE_ROWS, SERVER_PORT, SERVER_TIMEOUT,
+    STORAGE_BACKEND, WATCH_MAX_BYTES
+)
+from .instrumentation import metrics
+from .model import ColumnarRows, ExpenseLedger, expense_from_record, format_cents
+from .search import ExpenseQuery
+from .storage import CSVStorage, ExpenseStorage, SQLiteStorage, open_storage
+from .validation import parse_date, validate_expense
+
+def wire(expense):
+    """Encode an Expense for the wire."""
+    return [expense.date, expense.description, expense.category, format_cents(expense.cents)]
+
+class LedgerServer:
+    """Serves one ExpenseLedger to many clients.
+
+    Writes from every connection go through one queue drained by a
+    single writer task. It applies whatever has piled up to the ledger,
+    flushes it with one write off the event loop and only then
+    acknowledges the batch, so records never interleave and concurrent
+    clients share group commits. Reads are answered from the in-memory
+    rows and aggregates on the event loop between batches.
+    """
+    def __init__(self, ledger, import_dir=SERVER_IMPORT_DIR):
+        self.ledger = ledger
+        self.import_dir = import_dir
+        self.queue = None
+        self.changes = 0
+        self.compacting = None
+        self.handlers = {
+            'add': self.add,
+            'update': self.update,
+            'delete': self.delete,
+            'query': self.query,
+            'rows': self.rows,
+            'summary': self.summary,
+            'import': self.import_statement,
+        }
+    
+    async def start(self, host=SERVER_HOST, port=SERVER_PORT):
+        """Start the writer task and listen; return the asyncio Server."""
+        self.queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self.write_loop())
+        return await asyncio.start_server(self.handle, host, port, limit=SERVER_MAX_REQUEST)
+    
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT):
+        """Serve until cancelled."""
+        server = await self.start(host, port)
+        address = server.sockets[0].getsockname()
+        print(f"Serving {len(self.ledger)} expenses on {address[0]}:{address[1]}", file=sys.stderr, flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.writer_task.cancel()
+    
+    async def handle(self, reader, writer):
+        """Answer one connection's requests in order."""
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    break  # request over SERVER_MAX_REQUEST
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    handler = self.handlers.get(request.get('op'))
+                    if handler is None:
+                        raise ValueError(f"unknown request {request.get('op')!r}")
+                    reply = await handler(request)
+                    reply['ok'] = True
+                except Exception as error:  # any failed request gets an error reply
+                    reply = {'ok': False, 'error': str(error.args[0]) if error.args else type(error).__name__}
+                writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    async def submit(self, apply):
+        """Queue ``apply`` for the writer task and return its result once flushed."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((apply, future))
+        return await future
+    
+    async def write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            
+            results = []
+            for apply, future in batch:
+                try:
+                    results.append((future, apply(), None))
+                except Exception as error:
+                    # Only this request fails; the writer keeps serving the others
+                    results.append((future, None, error))
+            try:
+                await loop.run_in_executor(None, self.ledger.flush)
+            except Exception as error:
+                results = [(future, None, error) for future, _, _ in results]
+            
+            for future, result, error in results:
+                if future.cancelled():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+    
+    @staticmethod
+    def position(request, key, default):
+        """Return a request's non-negative integer field ``key``, or ``default`` if it's missing."""
+        value = request.get(key, default)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{key} must be a non-negative integer, not {value!r}")
+        return value
+    
+    def row(self, request):
+        row = request['id']
+        if not isinstance(row, int) or not 0 <= row < len(self.ledger.rows):
+            raise ValueError(f"no expense with id {row!r}")
+        return row
+    
+    async def add(self, request):
+        expenses = [validate_expense(*fields) for fields in request['expenses']]
+        
+        def apply():
+            first = len(self.ledger.rows)
+            self.ledger.extend(expenses)
+            return list(range(first, first + len(expenses)))
+        return {'ids': await self.submit(apply) if expenses else []}
+    
+    async def update(self, request):
+        row, expense = self.row(request), validate_expense(*request['expense'])
+        
+        def apply():
+            self.ledger.update(row, expense)
+            self.changes += 1
+            return self.changes
+        changes = await self.submit(apply)
+        self.schedule_compaction()
+        return {'changes': changes}
+    
+    async def delete(self, request):
+        row = self.row(request)
+        
+        def apply():
+            self.ledger.delete(row)
+            self.changes += 1
+            return self.changes
+        changes = await self.submit(apply)
+        self.schedule_compaction()
+        return {'changes': changes}
+    
+    def schedule_compaction(self):
+        if self.compacting:
+            return
+        job = self.ledger.storage.start_compaction()
+        if job is not None:
+            self.compacting = asyncio.create_task(self.compact(job))
+    
+    async def compact(self, job):
+        """Rewrite the ledger file off the event loop and install it between write batches."""
+        storage = self.ledger.storage
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, storage.compact, job)
+            await self.submit(lambda: storage.finish_compaction(job))
+        except (OSError, ValueError) as error:
+            # The change log stays valid; compaction is retried after the next change.
+            print(f"Compaction failed: {error}", file=sys.stderr)
+        finally:
+            self.compacting = None
+    
+    async def query(self, request):
+        start, end = request.get('start'), request.get('end')
+        query = ExpenseQuery(
+            request.get('text', ''),
+            parse_date(start) if start else None,
+            parse_date(end) if end else None,
+            request.get('min_cents'),
+            request.get('max_cents')
+        )
+        rows = self.ledger.search(query)
+        offset = self.position(request, 'offset', 0)
+        limit = min(self.position(request, 'limit', SERVER_PAGE_ROWS), SERVER_PAGE_ROWS)
+        page = range(offset, min(len(rows), offset + limit))
+        return {'total': len(rows), 'rows': [wire(rows[index]) for index in page]}
+    
+    async def rows(self, request):
+        rows = self.ledger.rows
+        start = self.position(request, 'start', 0)
+        end = min(len(rows), start + SERVER_PAGE_ROWS)
+        return {
+            'rows': [wire(rows[row]) for row in range(start, end)],
+            'deleted': sorted(row for row in rows.deleted if start <= row < end),
+            'length': len(rows),
+            'changes': self.changes,
+        }
+    
+    async def summary(self, request):
+        start, end = request.get('start'), request.get('end')
+        aggregates = self.ledger.aggregates
+        if start or end:
+            totals = self.ledger.totals_between(
+                parse_date(start) if start else date.min,
+                parse_date(end) if end else date.max
+            )
+        else:
+            totals = {category: (cents, aggregates.category_counts[category])
+                      for category, cents in aggregates.category_totals.items()}
+        return {
+            'total': format_cents(sum(cents for cents, _ in totals.values())),
+            'count': sum(count for _, count in totals.values()),
+            'categories': {category: {'total': format_cents(cents), 'count': count}
+                           for category, (cents, count) in totals.items()},
+        }
+    
+    def import_path(self, name):
+        """Return the path of statement ``name`` in ``import_dir``; raise ValueError if it is elsewhere."""
+        if self.import_dir is None:
+            raise ValueError("this server doesn't import statements")
+        root = os.path.realpath(self.import_dir)
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"can only import statements from {self.import_dir}")
+        return path
+    
+    async def import_statement(self, request):
+        from .importer import ImportMapping, import_statement
+        
+        path = self.import_path(request['path'])
+        mapping = ImportMapping(**request['mapping'])
+        loop = asyncio.get_running_loop()
+        
+        def publish(batch):
+            # Runs on an executor thread; each batch waits for its group commit.
+            asyncio.run_coroutine_threadsafe(self.submit(lambda: self.ledger.extend(batch)), loop).result()
+        
+        imported, rejected = await loop.run_in_executor(
+            None, functools.partial(import_statement, path, mapping, publish=publish))
+        return {'imported': imported, 'rejected': rejected}
+
+class LedgerClient:
+    """Blocking connection to a LedgerServer.
+
+    ``request`` sends one request and returns the reply without its
+    ``ok`` flag; a failed request raises ValueError with the server's
+    message. Requests from several threads are serialized.
+    """
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, timeout=SERVER_TIMEOUT):
+        self.socket = socket.create_connection((host, port), timeout)
+        self.file = self.socket.makefile('rwb')
+        self.lock = threading.Lock()
+    
+    def request(self, op, **fields):
+        fields['op'] = op
+        data = json.dumps(fields).encode('utf-8') + b'\n'
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+            line = self.file.readline()
+        metrics.count_written(len(data))
+        metrics.count_read(len(line))
+        if not line:
+            raise ConnectionError("the ledger server closed the connection")
+        reply = json.loads(line)
+        if not reply.pop('ok'):
+            raise ValueError(reply['error'])
+        return reply
+    
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+class ServerStorage(ExpenseStorage):
+    """Ledger kept by a LedgerServer, for running the app as one of its clients.
+
+    ``load`` copies the server's rows into a local ColumnarRows page by
+    page, so the table, search and statistics work just as they do on a
+    local file, and ``follow`` adds the rows other clients write. Those
+    arrive after our own, so local row numbers map to server IDs through
+    ``ids``. Edits and deletions made elsewhere can't be patched in and
+    make ``follow`` ask for a reload.
+    """
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT):
+        self.client = LedgerClient(host, port)
+        self.ids = array('I')
+        self.seen = 0
+        self.own = set()
+        self.changes = 0
+        self.stale = False
+    
+    def load(self, progress=None):
+        rows, aggregates = ColumnarRows(), ExpenseAggregates()
+        changes = None
+        while True:
+            reply = self.client.request('rows', start=len(rows))
+            if changes is None:
+                changes = reply['changes']
+            deleted = set(reply['deleted'])
+            for fields in reply['rows']:
+                row = len(rows)
+                expense = expense_from_record(fields)
+                ordinal = rows.append(expense)
+                if row in deleted:
+                    rows.delete(row)
+                else:
+                    aggregates.add(expense.category, expense.cents, ordinal)
+            if progress:
+                progress(len(rows), reply['length'])
+            if not reply['rows'] or len(rows) >= reply['length']:
+                break
+        
+        self.ids = array('I', range(len(rows)))
+        self.seen = len(rows)
+        self.own = set()
+        # Changes from the first page on, so edits made while paging force a reload
+        self.changes = changes
+        self.stale = False
+        return rows, aggregates
+    
+    def append(self, expense):
+        self.append_many((expense,))
+    
+    def append_many(self, expenses):
+        ids = self.client.request('add', expenses=[wire(expense) for expense in expenses])['ids']
+        self.ids.extend(ids)
+        self.own.update(ids)
+    
+    def update(self, row, expense):
+        self.changed(self.client.request('update', id=self.ids[row], expense=wire(expense))['changes'])
+    
+    def delete(self, row):
+        self.changed(self.client.request('delete', id=self.ids[row])['changes'])
+    
+    def changed(self, changes):
+        """Note the server's change count after one of our own changes."""
+        if changes != self.changes + 1:
+            self.stale = True
+        self.changes = changes
+    
+    def follow(self, max_bytes=WATCH_MAX_BYTES):
+        if self.stale:
+            return None
+        reply = self.client.request('rows', start=self.seen)
+        if reply['changes'] != self.changes or reply['deleted'] or self.seen + len(reply['rows']) < reply['length']:
+            return None
+        expenses = []
+        for offset, fields in enumerate(reply['rows']):
+            row = self.seen + offset
+            if row in self.own:
+                self.own.discard(row)
+                continue
+            expenses.append(expense_from_record(fields))
+            self.ids.append(row)
+        self.seen += len(reply['rows'])
+        return expenses
+    
+    def close(self):
+        self.client.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the expense ledger to several clients.")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--backend', choices=('csv', 'partitioned', 'sqlite'),
+                        default=STORAGE_BACKEND if STORAGE_BACKEND != 'server' else 'csv')
+    parser.add_argument('--path', help="ledger file (or partition directory) to serve instead of the configured one")
+    parser.add_argument('--import-dir', default=SERVER_IMPORT_DIR,
+                        help="directory clients may import statements from (default: no imports)")
+    args = parser.parse_args(argv)
+    
+    if args.path:
+        if args.backend == 'partitioned':
+            from .partitions import PartitionedStorage
+            storage = PartitionedStorage(args.path)
+        else:
+            storage = CSVStorage(args.path) if args.backend == 'csv' else SQLiteStorage(args.path)
+    else:
+        storage = open_storage(args.backend)
+    # The server is long-lived, so a partitioned ledger is loaded whole
+    storage.include(None)
+    ledger = ExpenseLedger(storage)
+    ledger.load()
+    try:
+        asyncio.run(LedgerServer(ledger, args.import_dir).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ledger.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Sort orders over the ledger rows, kept up to date as rows change."""
+from array import array
+from bisect import bisect_left
+from itertools import compress
+
+from .config import SORT_INSERT_ROWS
+
+SORT_COLUMNS = ('date', 'description', 'category', 'cents')
+
+def sort_keys(keys):
+    """Validate a sort order and return it as a tuple of ``(column, descending)`` pairs.
+
+    ``keys`` lists the primary key first; later keys break its ties and
+    the row number breaks any that are left. A column may only appear
+    once.
+    """
+    keys = tuple((column, bool(descending)) for column, descending in keys)
+    columns = [column for column, _ in keys]
+    for column in columns:
+        if column not in SORT_COLUMNS:
+            raise ValueError(f"can't sort by {column!r}")
+    if len(set(columns)) != len(columns):
+        raise ValueError("each column can only be sorted on once")
+    return keys
+
+class Descending:
+    """Wraps a value so that it orders in reverse."""
+    __slots__ = ('value',)
+    
+    def __init__(self, value):
+        self.value = value
+    
+    def __eq__(self, other):
+        return self.value == other.value
+    
+    def __lt__(self, other):
+        return other.value < self.value
+
+class SortIndex:
+    """Row numbers of a ColumnarRows sorted by one or more columns.
+
+    ``order`` is a permutation of the live rows. It is built with one
+    stable sort per key, last key first, over integer key columns:
+    dates and amounts sort on their own arrays and strings on their
+    case-insensitive rank in the string pool. After that it is kept up
+    to date in place: appended rows are bisected in when ``sync`` next
+    runs, unless more than SORT_INSERT_ROWS arrived at once and a
+    rebuild is cheaper, and edited or deleted rows are taken out with
+    ``remove`` before they change and put back with ``add``. Reading
+    the order backwards gives the opposite direction on every key, so
+    one index serves a column in both directions.
+    """
+    def __init__(self, rows, keys):
+        self.rows = rows
+        self.keys = keys
+        self.order = array('I')
+        self.indexed = 0
+        self.built = False
+    
+    def key(self, row):
+        """Return the comparison key of ``row`` under this sort order."""
+        rows = self.rows
+        key = []
+        for column, descending in self.keys:
+            if column == 'date':
+                value = rows.dates[row]
+            elif column == 'cents':
+                value = rows.cents[row]
+            elif column == 'category':
+                value = rows.categories[rows.category_codes[row]].casefold()
+            else:
+                value = rows.descriptions[rows.description_codes[row]].casefold()
+            if descending:
+                value = -value if isinstance(value, int) else Descending(value)
+            key.append(value)
+        key.append(row)
+        return key
+    
+    def column(self, name):
+        """Return a sequence of integer sort keys by row number for one column."""
+        rows = self.rows
+        if name == 'date':
+            return rows.dates
+        if name == 'cents':
+            return rows.cents
+        pool, codes = ((rows.categories, rows.category_codes) if name == 'category'
+                       else (rows.descriptions, rows.description_codes))
+        folded = [text.casefold() for text in pool.strings]
+        rank = {text: number for number, text in enumerate(sorted(set(folded)))}
+        ranks = [rank[text] for text in folded]
+        return list(map(ranks.__getitem__, codes))
+    
+    def build(self):
+        rows = self.rows
+        length = len(rows)
+        order = list(range(length)) if rows.live is None else list(rows.live[:bisect_left(rows.live, length)])
+        for column, descending in reversed(self.keys):
+            order.sort(key=self.column(column).__getitem__, reverse=descending)
+        self.order = array('I', order)
+        self.indexed = length
+        self.built = True
+    
+    def sync(self):
+        """Bring the order up to date with the rows appended since the last call."""
+        rows = self.rows
+        if not self.built or len(rows) - self.indexed > SORT_INSERT_ROWS:
+            self.build()
+            return
+        deleted, order = rows.deleted, self.order
+        for row in range(self.indexed, len(rows)):
+            if row not in deleted:
+                order.insert(self.position(row), row)
+        self.indexed = len(rows)
+    
+    def position(self, row):
+        """Return where ``row`` belongs in ``order``, by binary search on its key."""
+        target = self.key(row)
+        key, order = self.key, self.order
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if key(order[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def add(self, row):
+        """Insert an indexed row, e.g. after it was edited."""
+        if row < self.indexed:
+            self.order.insert(self.position(row), row)
+    
+    def remove(self, row):
+        """Take an indexed row out of the order, e.g. before it is edited or deleted."""
+        if row >= self.indexed:
+            return
+        position = self.position(row)
+        if position < len(self.order) and self.order[position] == row:
+            del self.order[position]
+    
+    def sorted(self, indices=None, reverse=False):
+        """Return the row numbers in this order, or just those in ``indices``.
+
+        ``reverse`` flips the direction of every key.
+        """
+        self.sync()
+        order = self.order
+        if indices is not None:
+            if len(indices) < len(order) // 16:
+                return sorted(indices, key=self.key, reverse=reverse)
+            flags = bytearray(len(self.rows))
+            for row in indices:
+                flags[row] = 1
+            order = array('I', compress(order, map(flags.__getitem__, order)))
+        return order[::-1] if reverse else order[:]
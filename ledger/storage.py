@@ -0,0 +1,1075 @@
+"""Persistence backends for the ledger."""
+import csv
+import hashlib
+import io
+import json
+import locale
+import mmap
+import os
+import shutil
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+from .aggregates import ExpenseAggregates
+from .config import (
+    CHANGES_SUFFIX, COMPACT_CHANGES, DATABASE_FILE, EXPENSE_FIELDS, EXPENSE_FILE, PARTITION_DIR,
+    PROGRESS_EVERY_ROWS, SERVER_HOST, SERVER_PORT, SNAPSHOT_SUFFIX, SNAPSHOT_TAIL_BYTES, SQLITE_PAGE_SIZE,
+    STORAGE_BACKEND, TORN_TAIL_SECONDS, WATCH_MAX_BYTES, WRITE_FLUSH_ROWS, WRITE_FSYNC
+)
+from .instrumentation import metrics
+from .model import ColumnarRows, Expense, date_ordinal, expense_from_record, format_cents
+from .search import ExpenseQuery, FilteredRows
+from .sorting import sort_keys
+
+class ExpenseStorage:
+    """Interface for persisting the expense ledger.
+
+    ``load`` returns the ledger's rows as a sequence of Expense tuples
+    together with their ExpenseAggregates. Queries that a backend can
+    answer itself (totals, date ranges) go through here so they don't
+    need a scan in Python. ``skipped`` counts the records the last load
+    found unreadable and left out, and ``unmigrated`` those a migration
+    from the CSV ledger left out when the storage was opened.
+    """
+    skipped = 0
+    unmigrated = 0
+    
+    def load(self, progress=None):
+        """Return ``(rows, aggregates)`` for the whole ledger.
+
+        ``progress`` is called now and then with ``(done, total)`` and
+        may raise TaskCancelled to abort the load.
+        """
+        raise NotImplementedError
+    
+    def append(self, expense):
+        """Persist one Expense."""
+        raise NotImplementedError
+    
+    def append_many(self, expenses):
+        """Persist a batch of Expenses in one write."""
+        raise NotImplementedError
+    
+    def update(self, row, expense):
+        """Persist an edit of the expense with row ID ``row``."""
+        raise NotImplementedError
+    
+    def delete(self, row):
+        """Persist the deletion of the expense with row ID ``row``."""
+        raise NotImplementedError
+    
+    def start_compaction(self):
+        """Return a job for ``compact`` if logged changes are due to be folded in, else None."""
+        return None
+    
+    def compact(self, job, progress=None):
+        """Do the slow part of a compaction job; safe to run on a worker."""
+        raise NotImplementedError
+    
+    def finish_compaction(self, job):
+        """Install a compacted job on the UI thread; return whether it was used."""
+        return False
+    
+    def aggregates(self):
+        """Return ExpenseAggregates for the whole ledger."""
+        raise NotImplementedError
+    
+    def expenses_between(self, start, end):
+        """Yield expenses dated from ``start`` to ``end`` inclusive (ISO strings)."""
+        raise NotImplementedError
+    
+    def loaded_since(self):
+        """Return the first date ``load`` covers, or None if it loads the whole ledger."""
+        return None
+    
+    def include(self, start):
+        """Make the next ``load`` cover dates from ``start`` on (None: everything).
+
+        Returns whether that load will read more than the last one did.
+        """
+        return False
+    
+    def follow(self, max_bytes=WATCH_MAX_BYTES):
+        """Return Expenses other processes appended since the last load or follow.
+
+        Returns None when the ledger was truncated, replaced or rewritten,
+        or more than ``max_bytes`` were appended, so it has to be loaded
+        again. Backends that can't be shared return an empty list.
+        """
+        return []
+    
+    def checkpoint(self, rows, aggregates):
+        """Record the loaded state so the next load can start from it."""
+    
+    def flush(self):
+        """Write out any buffered expenses according to the durability policy."""
+    
+    def close(self):
+        pass
+
+class LedgerSnapshot:
+    """Binary cache of a parsed CSV ledger and its aggregates.
+
+    The file holds a JSON header followed by the raw column arrays of a
+    ColumnarRows and its date index. The header also carries the string
+    pools and aggregates, including the daily rollups, the deleted rows
+    and how many change log entries are already applied. It records the
+    CSV size and mtime the snapshot was taken at and a hash of the CSV's
+    last bytes before that point.
+    A snapshot is used as-is when the CSV is unchanged, as a prefix when
+    the CSV has only grown since, and ignored otherwise.
+    """
+    MAGIC = b'EXPSNAP3'
+    PREFIX = struct.Struct('<8sI')
+    COLUMNS = ('dates', 'cents', 'category_codes', 'description_codes')
+    INDEX_COLUMNS = ('keys', 'order')
+    
+    def __init__(self, path):
+        self.path = path
+    
+    @staticmethod
+    def tail_hash(csv_path, size):
+        """Hash the last SNAPSHOT_TAIL_BYTES of the CSV before ``size``."""
+        start = max(0, size - SNAPSHOT_TAIL_BYTES)
+        with open(csv_path, 'rb') as file:
+            file.seek(start)
+            return hashlib.sha1(file.read(size - start)).hexdigest()
+    
+    def read(self, csv_path):
+        """Return ``(rows, aggregates, offset, changes)`` or None if the snapshot can't be used.
+
+        ``offset`` is the CSV byte offset the snapshot covers; anything
+        after it still has to be parsed. ``changes`` is the number of
+        change log entries already applied to the rows.
+        """
+        try:
+            stat = os.stat(csv_path)
+            with open(self.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, header_size = self.PREFIX.unpack_from(mapped)
+                if magic != self.MAGIC:
+                    return None
+                start = self.PREFIX.size
+                header = json.loads(mapped[start:start + header_size])
+                offset = header['size']
+                if header['byteorder'] != sys.byteorder or stat.st_size < offset:
+                    return None
+                if stat.st_size == offset and stat.st_mtime_ns != header['mtime_ns']:
+                    return None
+                if self.tail_hash(csv_path, offset) != header['tail']:
+                    return None
+                
+                rows = ColumnarRows()
+                columns = [(getattr(rows, name), header['rows']) for name in self.COLUMNS]
+                columns += [(getattr(rows.date_index, name), header['indexed']) for name in self.INDEX_COLUMNS]
+                view = memoryview(mapped)
+                try:
+                    position = start + header_size
+                    for column, length in columns:
+                        end = position + length * column.itemsize
+                        column.frombytes(view[position:end])
+                        position = end
+                finally:
+                    view.release()
+                metrics.count_read(position)
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+        
+        rows.categories.extend(header['categories'])
+        rows.descriptions.extend(header['descriptions'])
+        rows.raw_dates = {int(index): text for index, text in header['raw_dates'].items()}
+        if header['deleted']:
+            rows.deleted = set(header['deleted'])
+            rows.live = array('I', (row for row in range(header['rows']) if row not in rows.deleted))
+        return rows, ExpenseAggregates.from_summary(header), offset, header['changes']
+    
+    def write(self, csv_path, offset, rows, aggregates, changes=0):
+        """Save ``rows`` and ``aggregates`` as covering the CSV up to ``offset``.
+
+        ``changes`` is the number of change log entries applied to them.
+        """
+        rows.date_index.merge()
+        header = json.dumps({
+            'size': offset,
+            'mtime_ns': os.stat(csv_path).st_mtime_ns,
+            'tail': self.tail_hash(csv_path, offset),
+            'byteorder': sys.byteorder,
+            'rows': len(rows),
+            'indexed': len(rows.date_index),
+            'categories': rows.categories.strings,
+            'descriptions': rows.descriptions.strings,
+            'raw_dates': rows.raw_dates,
+            'deleted': sorted(rows.deleted),
+            'changes': changes,
+            **aggregates.summary(),
+        }).encode('utf-8')
+        
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(self.PREFIX.pack(self.MAGIC, len(header)))
+            file.write(header)
+            for name in self.COLUMNS:
+                getattr(rows, name).tofile(file)
+            for name in self.INDEX_COLUMNS:
+                getattr(rows.date_index, name).tofile(file)
+            metrics.count_written(file.tell())
+        os.replace(temp_path, self.path)
+
+class LedgerWriter:
+    """Group-commit appender for the CSV ledger.
+
+    The file handle stays open between writes. Records are encoded into
+    an in-memory buffer and written with a single system call once
+    ``flush_rows`` are pending, or when the owner calls ``flush`` (the
+    app does so within WRITE_FLUSH_MS of an add and on exit).
+    ``fsync`` picks the durability level:
+
+    - ``'never'``: leave flushed data to the OS page cache (fastest; a
+      power loss can drop recent rows),
+    - ``'flush'``: fsync after every group write (a crash loses at most
+      the rows still buffered),
+    - ``'always'``: write and fsync every record immediately (slowest,
+      nothing is ever buffered).
+
+    Other processes may append to the same file. ``end`` is the offset
+    up to which the file's contents are known to the owner; when a group
+    write lands further on than that, the bytes in between were written
+    by someone else and their range is queued in ``foreign``.
+    """
+    def __init__(self, path, flush_rows=WRITE_FLUSH_ROWS, fsync=WRITE_FSYNC):
+        if fsync not in ('never', 'flush', 'always'):
+            raise ValueError(f"unknown fsync policy: {fsync!r}")
+        self.path = path
+        self.flush_rows = flush_rows
+        self.fsync = fsync
+        self.encoding = locale.getpreferredencoding(False)
+        self.file = open(path, mode='ab', buffering=0)
+        stat = os.fstat(self.file.fileno())
+        self.inode = stat.st_ino
+        self.end = stat.st_size
+        self.foreign = []
+        self.text = io.StringIO()
+        self.csv = csv.writer(self.text)
+        self.chunks = []
+        self.pending = 0
+    
+    def write(self, records):
+        """Buffer CSV records, writing them out once enough are pending."""
+        start = self.text.tell()
+        count = 0
+        for record in records:
+            self.csv.writerow(record)
+            count += 1
+        data = self.text.getvalue()[start:].encode(self.encoding)
+        self.text.seek(0)
+        self.text.truncate()
+        
+        self.chunks.append(data)
+        self.pending += count
+        if self.fsync == 'always' or self.pending >= self.flush_rows:
+            self.flush()
+    
+    def flush(self):
+        """Write all buffered records in one go and apply the fsync policy."""
+        if not self.chunks:
+            return
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.pending = 0
+        metrics.count_written(len(data))
+        view = memoryview(data)
+        while view:
+            written = self.file.write(view)
+            view = view[written:]
+            # In append mode the write lands at the end of the file and
+            # leaves the position after it.
+            position = self.file.tell()
+            if position - written > self.end:
+                self.foreign.append((self.end, position - written))
+            self.end = position
+        if self.fsync != 'never':
+            os.fsync(self.file.fileno())
+    
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def records_end(file, size):
+    """Return the offset after the last newline of a binary file of ``size`` bytes.
+
+    Every complete record ends with a newline, so anything after it is a
+    record still being written, or torn by a crash.
+    """
+    position = size
+    while position > 0:
+        step = min(SNAPSHOT_TAIL_BYTES, position)
+        file.seek(position - step)
+        newline = file.read(step).rfind(b'\n')
+        if newline != -1:
+            return position - step + newline + 1
+        position -= step
+    return 0
+
+def repair_torn_tail(path, quiet=TORN_TAIL_SECONDS):
+    """Deal with a partial last record left by a crash mid-write.
+
+    Everything after the last newline is either a record another program
+    is still writing or a torn write. A file changed in the last
+    ``quiet`` seconds is left alone, so ``follow`` can pick the record up
+    once it is complete. An older tail that parses is a record that only
+    lacks its newline, which is added; one that doesn't is moved to
+    ``<path>.torn`` for manual recovery and the CSV is truncated. Returns
+    the number of bytes cut.
+    """
+    with open(path, 'r+b') as file:
+        stat = os.fstat(file.fileno())
+        end = records_end(file, stat.st_size)
+        if end == stat.st_size or time.time() - stat.st_mtime < quiet:
+            return 0
+        file.seek(end)
+        torn = file.read()
+        try:
+            expense_from_record(next(csv.reader([torn.decode(locale.getpreferredencoding(False))])))
+        except (IndexError, ValueError, StopIteration):
+            pass
+        else:
+            file.write(b'\r\n')
+            return 0
+        with open(path + '.torn', 'ab') as torn_file:
+            torn_file.write(torn + b'\n')
+        file.truncate(end)
+        return stat.st_size - end
+
+class ChangeLog:
+    """Append-only log of edits and deletions to the CSV ledger.
+
+    Records are ``edit,<record>,<date>,<description>,<category>,<amount>``
+    or ``delete,<record>``, where ``record`` numbers the CSV's records
+    from 0, and ``records`` holds them in memory. The first line,
+    ``base,<inode>``, ties the log to one version of the CSV: compaction
+    installs the rewritten CSV before resetting the log, so a log left
+    behind by an interrupted compaction names the old file and is
+    discarded. The file is only created by the first change.
+    """
+    FIELDS = {'edit': 6, 'delete': 2}
+    
+    def __init__(self, path, fsync=WRITE_FSYNC):
+        self.path = path
+        self.fsync = fsync
+        self.inode = None
+        self.records = []
+    
+    def open(self, inode):
+        """Read the log for the CSV with ``inode`` and return its records.
+
+        A stale log is started afresh, and a torn last record left by a
+        crash is dropped.
+        """
+        self.inode = inode
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            self.records = []
+            return self.records
+        metrics.count_read(len(data))
+        records = list(csv.reader(io.StringIO(data.decode('utf-8', errors='replace'), newline='')))
+        if not records or records[0] != ['base', str(inode)]:
+            self.reset(inode, [])
+            return self.records
+        
+        if not data.endswith(b'\n'):
+            records.pop()
+        valid = [record for record in records[1:]
+                 if self.FIELDS.get(record[0] if record else None) == len(record) and record[1].isdigit()]
+        if len(valid) + 1 == len(records) and data.endswith(b'\n'):
+            self.records = valid
+        else:
+            self.reset(inode, valid)
+        return self.records
+    
+    def append(self, record):
+        """Write one record through to the log file."""
+        if not os.path.exists(self.path):
+            self.reset(self.inode, [])
+        with open(self.path, 'a', newline='', encoding='utf-8') as file:
+            start = file.tell()
+            csv.writer(file).writerow(record)
+            metrics.count_written(file.tell() - start)
+            if self.fsync != 'never':
+                file.flush()
+                os.fsync(file.fileno())
+        self.records.append(record)
+    
+    def reset(self, inode, records):
+        """Atomically replace the log with ``records`` for the CSV with ``inode``."""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['base', inode])
+            writer.writerows(records)
+            if self.fsync != 'never':
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        self.inode = inode
+        self.records = list(records)
+
+# Stands in, deleted, for a CSV record that doesn't parse, so row IDs
+# keep matching record numbers
+UNREADABLE = Expense('', '', '', 0)
+
+def apply_changes(records, rows, aggregates):
+    """Replay change log records onto freshly loaded rows and their aggregates."""
+    for record in records:
+        row = int(record[1])
+        if row >= len(rows) or row in rows.deleted:
+            continue
+        old = rows[row]
+        aggregates.remove(old.category, old.cents, rows.dates[row])
+        if record[0] == 'delete':
+            rows.delete(row)
+        else:
+            expense = expense_from_record(record[2:])
+            aggregates.add(expense.category, expense.cents, rows.replace(row, expense))
+
+def read_lines(file, end, encoding):
+    """Yield the decoded lines of a binary file up to byte offset ``end``."""
+    position = file.tell()
+    for line in file:
+        if position >= end:
+            break
+        position += len(line)
+        yield line.decode(encoding)
+
+class Compaction:
+    """State of one CSV compaction, from ``start_compaction`` to ``finish_compaction``.
+
+    ``end`` and ``changes`` are the CSV offset and the number of change
+    log entries the rewrite covers; rows appended and changes logged
+    after that are carried over when it is installed.
+    """
+    def __init__(self, end, records):
+        self.end = end
+        self.records = records
+        self.changes = len(records)
+        self.size = 0
+        self.removed = []
+
+class CSVStorage(ExpenseStorage):
+    """Ledger stored as an append-only CSV file.
+
+    Loading goes through a LedgerSnapshot kept next to the file, so only
+    records appended since the last checkpoint have to be parsed.
+    Appends go through a LedgerWriter; a torn last record left by a crash
+    is repaired when the storage is opened. Records other processes
+    append are picked up by ``follow``.
+
+    The CSV itself is never rewritten in place: edits and deletions go to
+    a ChangeLog that is replayed on load, and once it is long enough a
+    compaction rewrites the CSV with the changes applied on the worker
+    and swaps it in by renaming. Row IDs stay the same for as long as the
+    ledger is loaded; ``dropped`` holds the IDs of rows compacted away
+    since, so IDs can be mapped to the CSV's record numbers.
+    """
+    def __init__(self, path=EXPENSE_FILE, flush_rows=WRITE_FLUSH_ROWS, fsync=WRITE_FSYNC):
+        self.path = path
+        self.snapshot = LedgerSnapshot(path + SNAPSHOT_SUFFIX)
+        self.changes = ChangeLog(path + CHANGES_SUFFIX, fsync)
+        self.offset = 0
+        self.snapshot_state = None
+        self.seen = None
+        self.mark = None
+        self.dropped = array('I')
+        self.compaction = None
+        self.loaded = False
+        if not os.path.exists(path):
+            with open(path, mode='w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(EXPENSE_FIELDS)
+        self.repaired = repair_torn_tail(path)
+        self.writer = LedgerWriter(path, flush_rows, fsync)
+        self.changes.open(self.writer.inode)
+    
+    def iter_rows(self):
+        """Yield the ledger's expenses with the change log applied, streaming the CSV.
+
+        Records that don't parse are left out and counted in ``skipped``,
+        as ``parse_from`` does.
+        """
+        self.skipped = 0
+        self.writer.flush()
+        changes = {int(record[1]): record for record in self.changes.records}
+        with open(self.path, mode='r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for number, record in enumerate(filter(None, reader)):
+                change = changes.get(number)
+                if change is not None:
+                    if change[0] == 'delete':
+                        continue
+                    record = change[2:]
+                try:
+                    expense = expense_from_record(record)
+                except (IndexError, ValueError):
+                    self.skipped += 1
+                    continue
+                yield expense
+    
+    def parse_from(self, offset, rows, aggregates, progress=None):
+        """Parse records from byte ``offset`` into ``rows``; return the end offset.
+
+        Only complete records are parsed: one another program is still
+        writing is left for ``follow``, like ``read_records`` leaves it. A
+        record that doesn't parse is left in the file but added as an
+        UNREADABLE row that is deleted straight away, and counted in
+        ``skipped``.
+        """
+        with open(self.path, 'rb') as file:
+            end = max(records_end(file, os.fstat(file.fileno()).st_size), offset)
+            file.seek(offset)
+            reader = csv.reader(read_lines(file, end, self.writer.encoding))
+            if not offset:
+                next(reader, None)
+            for number, record in enumerate(reader, 1):
+                if record:
+                    try:
+                        expense = expense_from_record(record)
+                    except (IndexError, ValueError):
+                        row = len(rows)
+                        rows.append(UNREADABLE)
+                        rows.delete(row)
+                        self.skipped += 1
+                        continue
+                    aggregates.add(expense.category, expense.cents, rows.append(expense))
+                if progress and not number % PROGRESS_EVERY_ROWS:
+                    progress(file.tell(), end)
+        metrics.count_read(end - offset)
+        return end
+    
+    def load(self, progress=None):
+        self.loaded = False
+        self.skipped = 0
+        self.writer.flush()
+        if os.stat(self.path).st_ino != self.writer.inode:
+            # Replaced by another program; append to the new file from now on.
+            self.writer.close()
+            self.writer = LedgerWriter(self.path, self.writer.flush_rows, self.writer.fsync)
+        records = self.changes.open(self.writer.inode)
+        cached = self.snapshot.read(self.path)
+        if cached and cached[3] > len(records):
+            cached = None
+        if cached:
+            rows, aggregates, offset, applied = cached
+        else:
+            rows, aggregates, offset, applied = ColumnarRows(), ExpenseAggregates(), 0, 0
+        end = self.parse_from(offset, rows, aggregates, progress)
+        apply_changes(records[applied:], rows, aggregates)
+        self.offset = self.writer.end = end
+        self.writer.foreign = []
+        self.seen = None
+        self.mark = (end, self.snapshot.tail_hash(self.path, end))
+        self.dropped = array('I')
+        self.compaction = None
+        self.snapshot_state = (offset, applied) if cached else None
+        self.loaded = True
+        self.checkpoint(rows, aggregates)
+        return rows, aggregates
+    
+    def checkpoint(self, rows, aggregates):
+        self.writer.flush()
+        if not self.loaded or self.writer.foreign or self.dropped:
+            # The rows don't cover the CSV: the last load didn't finish,
+            # rows other processes appended aren't in memory yet, or the
+            # loaded rows no longer line up with the compacted CSV.
+            return
+        self.offset = self.writer.end
+        state = (self.offset, len(self.changes.records))
+        if state == self.snapshot_state:
+            return
+        try:
+            self.snapshot.write(self.path, self.offset, rows, aggregates, state[1])
+        except OSError:
+            return
+        self.snapshot_state = state
+    
+    def append(self, expense):
+        self.append_many((expense,))
+    
+    def append_many(self, expenses):
+        self.writer.write((e.date, e.description, e.category, format_cents(e.cents)) for e in expenses)
+    
+    def update(self, row, expense):
+        self.changes.append(['edit', str(self.record(row)), expense.date, expense.description,
+                             expense.category, format_cents(expense.cents)])
+    
+    def delete(self, row):
+        self.changes.append(['delete', str(self.record(row))])
+    
+    def record(self, row):
+        """Return the CSV record number of the row with ID ``row``."""
+        return row - bisect_left(self.dropped, row)
+    
+    def follow(self, max_bytes=WATCH_MAX_BYTES):
+        writer = self.writer
+        writer.flush()
+        stat = os.stat(self.path)
+        seen = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if seen == self.seen and not writer.foreign:
+            return []
+        if stat.st_ino != writer.inode or stat.st_size < writer.end or writer.foreign:
+            # Records another program slipped in between our own writes
+            # would get row IDs out of file order, so reload instead.
+            return None
+        if self.mark and self.snapshot.tail_hash(self.path, self.mark[0]) != self.mark[1]:
+            return None
+        
+        if stat.st_size - writer.end > max_bytes:
+            return None
+        expenses = []
+        consumed = self.read_records(writer.end, stat.st_size, expenses)
+        if consumed is None:
+            # A full load skips and counts unreadable records, as at startup
+            return None
+        writer.end = consumed
+        self.seen = seen
+        self.mark = (consumed, self.snapshot.tail_hash(self.path, consumed))
+        return expenses
+    
+    def read_records(self, start, end, expenses):
+        """Parse the complete records between byte offsets into ``expenses``.
+
+        Returns the offset after the last complete record; a record still
+        being written is left for the next call. Returns None if a record
+        doesn't parse.
+        """
+        with open(self.path, 'rb') as file:
+            file.seek(start)
+            data = file.read(end - start)
+        metrics.count_read(len(data))
+        data = data[:data.rfind(b'\n') + 1]
+        reader = csv.reader(io.StringIO(data.decode(self.writer.encoding, errors='replace'), newline=''))
+        if not start:
+            next(reader, None)
+        for record in reader:
+            if not record:
+                continue
+            try:
+                expenses.append(expense_from_record(record))
+            except (IndexError, ValueError):
+                return None
+        return start + len(data)
+    
+    def start_compaction(self):
+        if len(self.changes.records) < COMPACT_CHANGES:
+            return None
+        self.writer.flush()
+        if self.writer.foreign:
+            return None
+        self.compaction = Compaction(self.writer.end, list(self.changes.records))
+        return self.compaction
+    
+    def compact(self, job, progress=None):
+        """Write the CSV up to ``job.end``, with the job's changes applied, to a temporary file.
+
+        The rows written are parsed as they go into a snapshot for the new
+        file, so the next load doesn't have to parse all of it again.
+        """
+        changes = {int(record[1]): record for record in job.records}
+        temp_path = self.path + '.compact'
+        rows, aggregates = ColumnarRows(), ExpenseAggregates()
+        encoding = self.writer.encoding
+        with open(self.path, 'rb') as source, open(temp_path, 'w', newline='', encoding=encoding) as target:
+            reader = csv.reader(read_lines(source, job.end, encoding))
+            writer = csv.writer(target)
+            writer.writerow(next(reader, None) or EXPENSE_FIELDS)
+            for number, record in enumerate(filter(None, reader)):
+                change = changes.get(number)
+                if change is not None:
+                    if change[0] == 'delete':
+                        job.removed.append(number)
+                        continue
+                    record = change[2:]
+                writer.writerow(record)
+                try:
+                    expense = expense_from_record(record)
+                except (IndexError, ValueError):
+                    # Kept as it is, like parse_from keeps it
+                    row = len(rows)
+                    rows.append(UNREADABLE)
+                    rows.delete(row)
+                    continue
+                aggregates.add(expense.category, expense.cents, rows.append(expense))
+                if progress and not number % PROGRESS_EVERY_ROWS:
+                    progress(source.tell(), job.end)
+            target.flush()
+            if self.writer.fsync != 'never':
+                os.fsync(target.fileno())
+            job.size = target.tell()
+        LedgerSnapshot(temp_path + SNAPSHOT_SUFFIX).write(temp_path, job.size, rows, aggregates)
+        return job
+    
+    def finish_compaction(self, job):
+        """Swap the compacted CSV in for the live one.
+
+        Records appended since the job started, by us or by other
+        programs, are copied over first, and changes logged meanwhile are
+        renumbered into a fresh log. The loaded rows keep their IDs. A job
+        is dropped if the ledger was reloaded or the file replaced or cut
+        short in the meantime.
+        """
+        if job is not self.compaction:
+            return False
+        self.compaction = None
+        temp_path = self.path + '.compact'
+        writer = self.writer
+        writer.flush()
+        stat = os.stat(self.path)
+        if stat.st_ino != writer.inode or stat.st_size < writer.end or writer.foreign:
+            return False
+        
+        with open(self.path, 'rb') as source, open(temp_path, 'ab') as target:
+            source.seek(job.end)
+            shutil.copyfileobj(source, target)
+            if writer.fsync != 'never':
+                target.flush()
+                os.fsync(target.fileno())
+        os.replace(temp_path, self.path)
+        try:
+            os.replace(temp_path + SNAPSHOT_SUFFIX, self.snapshot.path)
+        except OSError:
+            pass
+        
+        removed = job.removed
+        remaining = [[record[0], str(int(record[1]) - bisect_left(removed, int(record[1])))] + record[2:]
+                     for record in self.changes.records[job.changes:]]
+        end = writer.end - (job.end - job.size)
+        writer.close()
+        self.writer = LedgerWriter(self.path, writer.flush_rows, writer.fsync)
+        self.writer.end = end
+        self.changes.reset(self.writer.inode, remaining)
+        
+        # Record numbers of the removed rows, turned back into row IDs
+        dropped, skipped, ids = self.dropped, 0, []
+        for number in removed:
+            while skipped < len(dropped) and dropped[skipped] <= number + skipped:
+                skipped += 1
+            ids.append(number + skipped)
+        self.dropped = array('I', sorted(dropped + array('I', ids)))
+        self.offset = end
+        self.snapshot_state = (job.size, 0)
+        self.seen = None
+        self.mark = (end, self.snapshot.tail_hash(self.path, end))
+        return True
+    
+    def flush(self):
+        self.writer.flush()
+    
+    def close(self):
+        self.writer.close()
+    
+    def aggregates(self):
+        aggregates = ExpenseAggregates()
+        for expense in self.iter_rows():
+            aggregates.add(expense.category, expense.cents, date_ordinal(expense.date))
+        return aggregates
+    
+    def expenses_between(self, start, end):
+        for expense in self.iter_rows():
+            if start <= expense.date <= end:
+                yield expense
+
+class SQLiteStorage(ExpenseStorage):
+    """Ledger stored in an indexed SQLite database.
+
+    The database runs in WAL mode and every statement is a constant,
+    parameterized SQL string, so sqlite3's statement cache prepares each
+    one only once. Amounts are stored as integer cents. Totals, category
+    breakdowns and date ranges are computed by the database; rows for
+    the table are paged in on demand. Edits update rows in place and
+    deletions are recorded in a ``tombstones`` table instead of removing
+    the row, so ids stay contiguous and double as stable row IDs.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            description TEXT NOT NULL,
+            category TEXT NOT NULL,
+            cents INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS expenses_date ON expenses (date);
+        CREATE INDEX IF NOT EXISTS expenses_category ON expenses (category);
+        CREATE TABLE IF NOT EXISTS tombstones (id INTEGER PRIMARY KEY);
+    """
+    # WRITE_FSYNC mapped onto SQLite's own durability levels
+    SYNCHRONOUS = {'never': 'OFF', 'flush': 'NORMAL', 'always': 'FULL'}
+    INSERT = "INSERT INTO expenses (date, description, category, cents) VALUES (?, ?, ?, ?)"
+    UPDATE = "UPDATE expenses SET date = ?, description = ?, category = ?, cents = ? WHERE id = ?"
+    
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        import sqlite3  # only needed for this backend
+        
+        # Loads run on the background worker; sqlite serializes access itself.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={self.SYNCHRONOUS[WRITE_FSYNC]}")
+        self.connection.executescript(self.SCHEMA)
+    
+    def load(self, progress=None):
+        return SQLiteRows(self.connection), self.aggregates()
+    
+    def append(self, expense):
+        with self.connection:
+            self.connection.execute(self.INSERT, expense)
+    
+    def append_many(self, expenses):
+        with self.connection:
+            self.connection.executemany(self.INSERT, expenses)
+    
+    def update(self, row, expense):
+        with self.connection:
+            self.connection.execute(self.UPDATE, (*expense, row + 1))
+    
+    def delete(self, row):
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO tombstones (id) VALUES (?)", (row + 1,))
+    
+    def aggregates(self):
+        aggregates = ExpenseAggregates()
+        for category, total, count in self.connection.execute(
+                "SELECT category, SUM(cents), COUNT(*) FROM expenses "
+                "WHERE id NOT IN (SELECT id FROM tombstones) GROUP BY category"):
+            aggregates.category_totals[category] = total
+            aggregates.category_counts[category] = count
+            aggregates.total += total
+            aggregates.count += count
+        for when, category, total, count in self.connection.execute(
+                "SELECT date, category, SUM(cents), COUNT(*) FROM expenses "
+                "WHERE id NOT IN (SELECT id FROM tombstones) GROUP BY date, category"):
+            day = date_ordinal(when)
+            if day:
+                aggregates.rollups.add(category, total, day, count)
+        return aggregates
+    
+    def expenses_between(self, start, end):
+        cursor = self.connection.execute(
+            "SELECT date, description, category, cents FROM expenses "
+            "WHERE date BETWEEN ? AND ? AND id NOT IN (SELECT id FROM tombstones) ORDER BY date, id",
+            (start, end))
+        return map(Expense._make, cursor)
+    
+    def close(self):
+        self.connection.close()
+
+# SQLiteRows.fetch reads rows by id in batches of this many, padded with
+# id 0 (never used) so the statement stays the same
+FETCH_BATCH = 500
+FETCH_SQL = ("SELECT id, date, description, category, cents FROM expenses WHERE id IN ("
+             + ", ".join("?" * FETCH_BATCH) + ") AND id NOT IN (SELECT id FROM tombstones)")
+
+class SQLiteRows:
+    """Lazy, paged sequence over the expenses table.
+
+    Rows are never removed, so ids are contiguous and row ``i`` has id
+    ``i + 1``; a page is a primary key range scan. Only the most
+    recently used pages are kept in memory. Deleted rows are tracked in
+    ``deleted`` and ``live`` like ColumnarRows tracks them.
+    """
+    def __init__(self, connection, page_size=SQLITE_PAGE_SIZE, max_pages=4):
+        self.connection = connection
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.pages = {}
+        self.length = connection.execute("SELECT COALESCE(MAX(id), 0) FROM expenses").fetchone()[0]
+        self.deleted = {row - 1 for row, in connection.execute("SELECT id FROM tombstones")}
+        self.live = None
+        if self.deleted:
+            self.live = array('I', (row for row in range(self.length) if row not in self.deleted))
+    
+    def __len__(self):
+        return self.length
+    
+    def __iter__(self):
+        cursor = self.connection.execute(
+            "SELECT date, description, category, cents FROM expenses "
+            "WHERE id NOT IN (SELECT id FROM tombstones) ORDER BY id")
+        return map(Expense._make, cursor)
+    
+    def head(self, length):
+        """Iterate the live expenses among the first ``length`` rows.
+
+        Like iterating, this reads with a cursor of its own rather than
+        the page cache, so a worker can use it while the UI pages rows.
+        """
+        cursor = self.connection.execute(
+            "SELECT date, description, category, cents FROM expenses "
+            "WHERE id <= ? AND id NOT IN (SELECT id FROM tombstones) ORDER BY id", (length,))
+        return map(Expense._make, cursor)
+    
+    def fetch(self, indices):
+        """Yield the live expenses of rows ``indices``, in that order.
+
+        Like ``head``, this reads with cursors of its own, for workers
+        going through a view such as search results.
+        """
+        indices = iter(indices)
+        while True:
+            batch = [index + 1 for index in islice(indices, FETCH_BATCH)]
+            if not batch:
+                return
+            found = {row[0]: Expense._make(row[1:]) for row in self.connection.execute(
+                FETCH_SQL, batch + [0] * (FETCH_BATCH - len(batch)))}
+            for number in batch:
+                expense = found.get(number)
+                if expense is not None:
+                    yield expense
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        number, offset = divmod(index, self.page_size)
+        page = self.pages.pop(number, None)
+        if page is None:
+            first = number * self.page_size + 1
+            page = list(map(Expense._make, self.connection.execute(
+                "SELECT date, description, category, cents FROM expenses "
+                "WHERE id BETWEEN ? AND ? ORDER BY id", (first, first + self.page_size - 1))))
+            if len(self.pages) >= self.max_pages:
+                del self.pages[next(iter(self.pages))]
+        self.pages[number] = page
+        return page[offset]
+    
+    def append(self, expense):
+        """Account for a row the storage just inserted."""
+        self.pages.pop(self.length // self.page_size, None)
+        if self.live is not None:
+            self.live.append(self.length)
+        self.length += 1
+    
+    def replace(self, row, expense):
+        """Account for a row the storage just updated; return its date ordinal."""
+        self.pages.pop(row // self.page_size, None)
+        return date_ordinal(expense.date)
+    
+    def delete(self, row):
+        """Account for a row the storage just deleted."""
+        if self.live is None:
+            self.live = array('I', range(self.length))
+        del self.live[bisect_left(self.live, row)]
+        self.deleted.add(row)
+    
+    def visible(self):
+        """Return the rows that aren't deleted, as a sequence of Expenses."""
+        return self if self.live is None else FilteredRows(self, self.live)
+    
+    # Sort columns as ORDER BY terms; strings compare case-insensitively
+    ORDER_BY = {'date': "date", 'description': "description COLLATE NOCASE",
+                'category': "category COLLATE NOCASE", 'cents': "cents"}
+    
+    def search(self, query):
+        """Return a FilteredRows view of the rows matching an ExpenseQuery, in ledger order.
+
+        Like ``sort_by`` the view keeps each result's row ID, so edits
+        and deletions made from the results reach the right expense.
+        """
+        where, params = self.where(query)
+        cursor = self.connection.execute("SELECT id - 1 FROM expenses" + where + " ORDER BY id", params)
+        return FilteredRows(self, array('I', (row for row, in cursor)))
+    
+    def sort_by(self, keys, query=None):
+        """Return a FilteredRows view of the live rows, or those matching ``query``, sorted by ``keys``.
+
+        The database does the sorting, on its indexes where it has them.
+        """
+        keys = sort_keys(keys)
+        terms = [f"{self.ORDER_BY[column]} {'DESC' if descending else 'ASC'}" for column, descending in keys]
+        terms.append("id DESC" if keys[0][1] else "id")
+        where, params = self.where(query or ExpenseQuery())
+        cursor = self.connection.execute(
+            "SELECT id - 1 FROM expenses" + where + " ORDER BY " + ", ".join(terms), params)
+        return FilteredRows(self, array('I', (row for row, in cursor)))
+    
+    def where(self, query):
+        """Return a WHERE clause and its parameters selecting the live rows matching an ExpenseQuery."""
+        clauses, params = [], []
+        text = query.text.strip()
+        if text:
+            pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            clauses.append("(description LIKE ? ESCAPE '\\' OR category LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        if query.start is not None:
+            clauses.append("date >= ?")
+            params.append(query.start.isoformat())
+        if query.end is not None:
+            clauses.append("date <= ?")
+            params.append(query.end.isoformat())
+        if query.min_cents is not None:
+            clauses.append("cents >= ?")
+            params.append(query.min_cents)
+        if query.max_cents is not None:
+            clauses.append("cents <= ?")
+            params.append(query.max_cents)
+        clauses.append("id NOT IN (SELECT id FROM tombstones)")
+        return " WHERE " + " AND ".join(clauses), params
+
+def migrate_csv_to_sqlite(csv_path=EXPENSE_FILE, db_path=DATABASE_FILE):
+    """Copy the CSV ledger into a new SQLite database.
+
+    Runs once: nothing is done if the database already exists, and None
+    returned. Otherwise returns the number of records left out because
+    they don't parse. The database is built under a temporary name and
+    only renamed into place once every record is in, so a failed
+    migration is retried on the next start instead of leaving an empty
+    database behind. The CSV file is left in place.
+    """
+    if os.path.exists(db_path) or not os.path.exists(csv_path):
+        return None
+    temp_path = db_path + '.migrating'
+    remove_database(temp_path)
+    source = CSVStorage(csv_path)
+    try:
+        storage = SQLiteStorage(temp_path)
+        try:
+            storage.append_many(source.iter_rows())
+        finally:
+            storage.close()
+        os.replace(temp_path, db_path)
+    except BaseException:
+        remove_database(temp_path)
+        raise
+    finally:
+        source.close()
+    return source.skipped
+
+def remove_database(path):
+    """Delete a SQLite database and its write-ahead log files, if there are any."""
+    for name in (path, path + '-wal', path + '-shm'):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+def open_storage(backend=STORAGE_BACKEND):
+    """Open the configured storage backend."""
+    if backend == 'sqlite':
+        unmigrated = migrate_csv_to_sqlite()
+        storage = SQLiteStorage(DATABASE_FILE)
+        storage.unmigrated = unmigrated or 0
+        return storage
+    if backend == 'partitioned':
+        from .partitions import PartitionedStorage, split_ledger
+        unmigrated = split_ledger(EXPENSE_FILE, PARTITION_DIR)
+        storage = PartitionedStorage(PARTITION_DIR)
+        storage.unmigrated = unmigrated or 0
+        return storage
+    if backend == 'server':
+        from .server import ServerStorage
+        return ServerStorage(SERVER_HOST, SERVER_PORT)
+    return CSVStorage(EXPENSE_FILE)
@@ -0,0 +1,35 @@
+"""Validation rules shared by the expense form, imports, filters and the server."""
+import datetime
+
+from .model import MAX_CENTS, Expense, date_ordinal, format_cents, parse_cents
+
+def parse_date(text):
+    """Return a ``YYYY-MM-DD`` string as a date; raise ValueError for anything else.
+
+    The same strict form ``validate_expense`` stores, so filters and
+    queries accept exactly the dates expenses can have.
+    """
+    ordinal = date_ordinal(text)
+    if not ordinal:
+        raise ValueError(f"invalid date: {text!r}")
+    return datetime.date.fromordinal(ordinal)
+
+def validate_expense(date, description, category, amount):
+    """Validate form or import fields and return an Expense.
+
+    Raises ValueError with a message for the user when a field is
+    missing, the date isn't a real YYYY-MM-DD date or the amount isn't
+    a positive number of at most MAX_CENTS cents.
+    """
+    if not all([date, description, category, amount]):
+        raise ValueError("All fields are required!")
+    # Strict YYYY-MM-DD, so the stored string is already the normalized date
+    if not date_ordinal(date):
+        raise ValueError("Date must be a valid date in YYYY-MM-DD format!")
+    try:
+        cents = parse_cents(amount)
+    except ValueError:
+        cents = 0
+    if cents <= 0:
+        raise ValueError(f"Amount must be a positive number up to {format_cents(MAX_CENTS)}!")
+    return Expense(date, description, category, cents)
@@ -0,0 +1,122 @@
+"""Background execution of ledger work for an event-loop driven UI."""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import WORKER_MAX_PENDING, WORKER_POLL_MS, WORKER_THREADS
+
+class TaskCancelled(Exception):
+    """Raised inside a background task once it has been cancelled."""
+
+class BackgroundTask:
+    """Handle for a function running on a BackgroundWorker.
+
+    The function receives ``progress=task.report`` and should call it
+    regularly; reporting raises TaskCancelled once the task is cancelled.
+    Tasks with an ``on_publish`` callback also receive
+    ``publish=task.publish`` to hand partial results to the UI thread.
+    """
+    def __init__(self, results, name, on_done, on_error, on_progress, on_cancel, on_publish):
+        self.results = results
+        self.name = name
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_cancel = on_cancel
+        self.on_publish = on_publish
+        self.pending = threading.Semaphore(WORKER_MAX_PENDING)
+        self._cancelled = threading.Event()
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    def cancel(self):
+        """Ask the task to stop at its next progress report."""
+        self._cancelled.set()
+    
+    def report(self, done, total=None):
+        """Report progress from the worker thread."""
+        if self._cancelled.is_set():
+            raise TaskCancelled(self.name)
+        self.results.put((self, 'progress', (done, total)))
+    
+    def publish(self, value):
+        """Hand a partial result to ``on_publish`` on the UI thread.
+
+        Blocks while WORKER_MAX_PENDING results are still undelivered so a
+        fast producer can't queue up unbounded memory.
+        """
+        while not self.pending.acquire(timeout=0.1):
+            if self._cancelled.is_set():
+                raise TaskCancelled(self.name)
+        self.results.put((self, 'publish', value))
+
+class BackgroundWorker:
+    """Runs slow ledger work off the Tk event thread.
+
+    Functions run on a small thread pool. Their results, errors and
+    progress reports are put on a queue which the Tk mainloop drains
+    with ``root.after``, so every callback runs on the UI thread.
+    """
+    def __init__(self, root, max_workers=WORKER_THREADS):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ledger-worker")
+        self.results = queue.Queue()
+        self.tasks = set()
+        self.root.after(WORKER_POLL_MS, self.drain)
+    
+    def submit(self, fn, *args, name="", on_done=None, on_error=None, on_progress=None, on_cancel=None,
+               on_publish=None):
+        """Run ``fn(*args, progress=...)`` in the background and return its task."""
+        task = BackgroundTask(self.results, name, on_done, on_error, on_progress, on_cancel, on_publish)
+        self.tasks.add(task)
+        self.executor.submit(self.run, task, fn, args)
+        return task
+    
+    def run(self, task, fn, args):
+        kwargs = {'progress': task.report}
+        if task.on_publish:
+            kwargs['publish'] = task.publish
+        try:
+            result = fn(*args, **kwargs)
+        except TaskCancelled:
+            self.results.put((task, 'cancelled', None))
+        except Exception as error:
+            self.results.put((task, 'error', error))
+        else:
+            self.results.put((task, 'done', result))
+    
+    def drain(self):
+        """Deliver queued results to their callbacks on the UI thread."""
+        while True:
+            try:
+                task, kind, value = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                if task.on_progress and not task.cancelled:
+                    task.on_progress(task, *value)
+                continue
+            if kind == 'publish':
+                task.pending.release()
+                if not task.cancelled:
+                    task.on_publish(task, value)
+                continue
+            
+            self.tasks.discard(task)
+            if kind == 'cancelled':
+                if task.on_cancel:
+                    task.on_cancel(task)
+            elif kind == 'error':
+                if task.on_error:
+                    task.on_error(task, value)
+            elif task.on_done:
+                task.on_done(task, value)
+        self.root.after(WORKER_POLL_MS, self.drain)
+    
+    def shutdown(self):
+        """Cancel outstanding tasks and wait for running ones to stop."""
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,103 @@
+"""Regression tests for the ledger model and validation."""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from ledger import CSVStorage, Expense, ExpenseLedger, format_cents, parse_cents, parse_date, validate_expense
+from ledger.model import MAX_CENTS, ColumnarRows
+
+class ParseCentsTest(unittest.TestCase):
+    def test_plain_amounts(self):
+        for text, cents in [('12', 1200), ('12.5', 1250), ('12.50', 1250), ('12.', 1200), ('0', 0),
+                            (' 7.05 ', 705), ('.5', 50), ('-3.20', -320), ('+5', 500), ('1e2', 10000)]:
+            self.assertEqual(parse_cents(text), cents, text)
+    
+    def test_rounds_half_up_to_the_cent(self):
+        for text, cents in [('0.005', 1), ('0.004', 0), ('12.345', 1235), ('12.3449', 1234),
+                            ('-0.005', -1), ('-12.345', -1235), ('2.675', 268)]:
+            self.assertEqual(parse_cents(text), cents, text)
+    
+    def test_rejects_non_numbers(self):
+        for text in ('', 'abc', '1,000', '12.5.0', 'nan', 'inf', '-inf', '$5'):
+            with self.assertRaises(ValueError, msg=text):
+                parse_cents(text)
+    
+    def test_format_round_trips(self):
+        for cents in (0, 1, 5, 99, 100, 1250, -5, -1250, MAX_CENTS, -MAX_CENTS):
+            self.assertEqual(parse_cents(format_cents(cents)), cents)
+        self.assertEqual(format_cents(-5), '-0.05')
+        self.assertEqual(format_cents(1250), '12.50')
+
+class ColumnarRowsTest(unittest.TestCase):
+    def test_rows_round_trip_through_the_columns(self):
+        rows = ColumnarRows()
+        expenses = [Expense('2024-01-02', 'Lunch', 'Food', 1250), Expense('someday', 'Gift', 'Fun', -300),
+                    Expense('2024-01-01', 'Lunch', 'Food', MAX_CENTS)]
+        for expense in expenses:
+            rows.append(expense)
+        self.assertEqual(list(rows), expenses)
+        self.assertEqual(rows[-1], expenses[-1])
+        self.assertEqual(rows.dates[1], 0)
+        self.assertEqual(len(rows.descriptions.strings), 2)
+        with self.assertRaises(OverflowError):
+            rows.append(Expense('2024-01-03', 'Yacht', 'Fun', 10 ** 20))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(len(rows.dates), 3)
+    
+    def test_deleted_rows_keep_their_ids(self):
+        rows = ColumnarRows()
+        for day in range(1, 5):
+            rows.append(Expense(f'2024-01-0{day}', f'Item {day}', 'Food', day * 100))
+        rows.delete(1)
+        rows.replace(2, Expense('2024-01-09', 'Swapped', 'Fun', 50))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual([expense.description for expense in rows.visible()], ['Item 1', 'Swapped', 'Item 4'])
+        self.assertEqual(list(rows.live), [0, 2, 3])
+        rows.append(Expense('2024-01-05', 'Item 5', 'Food', 500))
+        self.assertEqual(list(rows.live), [0, 2, 3, 4])
+
+class AmountRangeTest(unittest.TestCase):
+    def test_parse_cents_rejects_amounts_out_of_range(self):
+        self.assertEqual(parse_cents('9999999999999999.99'), MAX_CENTS)
+        self.assertEqual(parse_cents('-9999999999999999.99'), -MAX_CENTS)
+        for text in ('99999999999999999999', '10000000000000000', '1e30'):
+            with self.assertRaises(ValueError):
+                parse_cents(text)
+        with self.assertRaises(ValueError):
+            validate_expense('2024-01-01', 'Yacht', 'Fun', '99999999999999999999')
+    
+    def test_ledger_refuses_oversized_amount_before_storing_it(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'expenses.csv')
+            ledger = ExpenseLedger(CSVStorage(path))
+            ledger.load()
+            ledger.append(Expense('2024-01-01', 'Lunch', 'Food', 1250))
+            with self.assertRaises(ValueError):
+                ledger.append(Expense('2024-01-02', 'Yacht', 'Fun', 10 ** 20))
+            with self.assertRaises(ValueError):
+                ledger.extend([Expense('2024-01-02', 'Tea', 'Food', 300), Expense('2024-01-02', 'Yacht', 'Fun', 10 ** 20)])
+            self.assertEqual(len(ledger), 1)
+            ledger.close()
+            
+            ledger = ExpenseLedger(CSVStorage(path))
+            ledger.load()
+            self.assertEqual(list(ledger), [Expense('2024-01-01', 'Lunch', 'Food', 1250)])
+            ledger.close()
+        finally:
+            shutil.rmtree(directory)
+
+class DateValidationTest(unittest.TestCase):
+    def test_only_plain_iso_dates_are_accepted(self):
+        self.assertEqual(validate_expense('2024-01-31', 'Lunch', 'Food', '12.50').date, '2024-01-31')
+        for text in ('20240131', '2024-W05-3', '2024-1-31', '2024-01-31T00:00', '2024-02-30'):
+            with self.assertRaises(ValueError):
+                validate_expense(text, 'Lunch', 'Food', '12.50')
+            with self.assertRaises(ValueError):
+                parse_date(text)
+        self.assertEqual(parse_date('2024-01-31'), date(2024, 1, 31))
+
+if __name__ == '__main__':
+    unittest.main()
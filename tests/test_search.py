@@ -0,0 +1,97 @@
+"""Regression tests for the search index."""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from ledger import ColumnarRows, Expense, ExpenseLedger, ExpenseQuery, SQLiteStorage
+
+WORDS = ['Coffee', 'Bus ticket', 'Groceries', 'Cinema', 'Rent', 'Coffee beans', 'Taxi', 'Book']
+CATEGORIES = ['Food', 'Transport', 'Entertainment', 'Utilities']
+
+def matches(expense, query):
+    """Reference check of one expense against a query, by brute force."""
+    text = query.text.strip().lower()
+    if text and text not in expense.description.lower() and text not in expense.category.lower():
+        return False
+    when = date.fromisoformat(expense.date)
+    if query.start is not None and when < query.start or query.end is not None and when > query.end:
+        return False
+    if query.min_cents is not None and expense.cents < query.min_cents:
+        return False
+    return query.max_cents is None or expense.cents <= query.max_cents
+
+def random_expense(generator):
+    return Expense(date(2024, generator.randint(1, 12), generator.randint(1, 28)).isoformat(),
+                   generator.choice(WORDS), generator.choice(CATEGORIES), generator.randint(1, 10000))
+
+class SearchIndexTest(unittest.TestCase):
+    QUERIES = [
+        ExpenseQuery(),
+        ExpenseQuery('coffee'),
+        ExpenseQuery('CO'),
+        ExpenseQuery('port'),
+        ExpenseQuery('nothing like it'),
+        ExpenseQuery(start=date(2024, 3, 1), end=date(2024, 3, 31)),
+        ExpenseQuery('e', start=date(2024, 6, 1)),
+        ExpenseQuery('food', end=date(2024, 2, 15)),
+        ExpenseQuery('bus', start=date(2024, 1, 1), end=date(2024, 12, 31)),
+        ExpenseQuery(min_cents=5000),
+        ExpenseQuery('ta', min_cents=100, max_cents=2000),
+    ]
+    
+    def check(self, rows):
+        expenses = list(rows)
+        for query in self.QUERIES:
+            expected = [row for row, expense in enumerate(expenses)
+                        if row not in rows.deleted and matches(expense, query)]
+            self.assertEqual(list(rows.search_index.search(query)), expected, query)
+    
+    def test_results_match_a_full_scan(self):
+        generator = random.Random(7)
+        rows = ColumnarRows()
+        for _ in range(2000):
+            rows.append(random_expense(generator))
+        self.check(rows)
+    
+    def test_index_follows_appends_edits_and_deletions(self):
+        generator = random.Random(11)
+        rows = ColumnarRows()
+        for _ in range(500):
+            rows.append(random_expense(generator))
+        self.check(rows)
+        for _ in range(300):
+            rows.append(random_expense(generator))
+        for row in generator.sample(range(800), 50):
+            rows.replace(row, random_expense(generator))
+        for row in generator.sample(range(800), 40):
+            if row not in rows.deleted:
+                rows.delete(row)
+        rows.append(Expense('2024-05-05', 'Brand new words', 'Hobbies', 4200))
+        self.check(rows)
+        self.assertEqual(list(rows.search_index.search(ExpenseQuery('hobbies'))), [len(rows) - 1])
+    
+    def test_sqlite_search_finds_the_same_rows(self):
+        generator = random.Random(5)
+        rows = ColumnarRows()
+        directory = tempfile.mkdtemp()
+        try:
+            ledger = ExpenseLedger(SQLiteStorage(os.path.join(directory, 'expenses.db')))
+            ledger.load()
+            expenses = [random_expense(generator) for _ in range(1000)]
+            ledger.extend(expenses)
+            for expense in expenses:
+                rows.append(expense)
+            for row in (3, 500, 999):
+                ledger.delete(row)
+                rows.delete(row)
+            for query in self.QUERIES:
+                self.assertEqual(list(ledger.search(query).indices), list(rows.search_index.search(query)), query)
+            ledger.close()
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
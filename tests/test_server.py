@@ -0,0 +1,96 @@
+"""Regression tests for the ledger server."""
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from ledger import CSVStorage, ExpenseLedger, LedgerServer
+
+class LedgerServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ledger = ExpenseLedger(CSVStorage(os.path.join(self.directory, 'expenses.csv')))
+        self.ledger.load()
+        self.server = LedgerServer(self.ledger)
+    
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.directory)
+    
+    def run_server(self, test):
+        async def main():
+            listener = await self.server.start('127.0.0.1', 0)
+            try:
+                await test()
+            finally:
+                self.server.writer_task.cancel()
+                listener.close()
+                await listener.wait_closed()
+        asyncio.run(main())
+    
+    def test_failed_write_leaves_writer_running(self):
+        async def test():
+            def overflow():
+                raise OverflowError("too large")
+            # Not assertRaises: it clears the traceback's frames, the writer task's among them
+            try:
+                await asyncio.wait_for(self.server.submit(overflow), 5)
+            except OverflowError:
+                pass
+            else:
+                self.fail("the failed write wasn't reported")
+            self.assertFalse(self.server.writer_task.done())
+            reply = await asyncio.wait_for(self.server.add({'expenses': [['2024-01-01', 'Lunch', 'Food', '12.50']]}), 5)
+            self.assertEqual(reply, {'ids': [0]})
+        self.run_server(test)
+    
+    def test_query_rejects_bad_offsets_and_limits(self):
+        async def test():
+            await self.server.add({'expenses': [['2024-01-0%d' % day, 'Lunch', 'Food', '12.50'] for day in (1, 2, 3)]})
+            reply = await self.server.query({'offset': 1, 'limit': 1})
+            self.assertEqual(reply, {'total': 3, 'rows': [['2024-01-02', 'Lunch', 'Food', '12.50']]})
+            for fields in ({'offset': -1}, {'limit': -1}, {'offset': '1'}, {'offset': 1.5}, {'limit': True}):
+                with self.assertRaises(ValueError):
+                    await self.server.query(fields)
+            with self.assertRaises(ValueError):
+                await self.server.rows({'start': -2})
+            # Dates in the same strict form the app stores and filters by
+            reply = await self.server.query({'start': '2024-01-02', 'end': '2024-01-02'})
+            self.assertEqual(reply['total'], 1)
+            for day in ('20240102', '2024-W01-2', '2024-1-2'):
+                with self.assertRaises(ValueError):
+                    await self.server.query({'start': day})
+                with self.assertRaises(ValueError):
+                    await self.server.summary({'end': day})
+        self.run_server(test)
+    
+    def test_imports_only_read_the_import_directory(self):
+        statements = os.path.join(self.directory, 'statements')
+        os.makedirs(statements)
+        for path in (os.path.join(statements, 'march.csv'), os.path.join(self.directory, 'secret.csv')):
+            with open(path, mode='w', newline='') as file:
+                file.write('Date,Text,Amount\n2024-03-01,Lunch,12.50\n')
+        mapping = {'date': 'Date', 'description': 'Text', 'amount': 'Amount', 'default_category': 'Food'}
+        
+        async def test():
+            for path in ('../secret.csv', os.path.join(self.directory, 'secret.csv'), 'march.csv/../../secret.csv'):
+                with self.assertRaises(ValueError):
+                    await self.server.import_statement({'path': path, 'mapping': mapping})
+            reply = await asyncio.wait_for(self.server.import_statement({'path': 'march.csv', 'mapping': mapping}), 5)
+            self.assertEqual(reply, {'imported': 1, 'rejected': 0})
+            self.server.import_dir = None
+            with self.assertRaises(ValueError):
+                await self.server.import_statement({'path': 'march.csv', 'mapping': mapping})
+        
+        self.server.import_dir = statements
+        cwd = os.getcwd()
+        os.chdir(self.directory)  # the rejects file is written here
+        try:
+            self.run_server(test)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(len(self.ledger), 1)
+
+if __name__ == '__main__':
+    unittest.main()
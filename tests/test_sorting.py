@@ -0,0 +1,96 @@
+"""Regression tests for sorted views of the ledger."""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from itertools import permutations, product
+
+from ledger import ColumnarRows, Expense, ExpenseLedger, ExpenseQuery, SQLiteStorage
+from ledger.sorting import SORT_COLUMNS
+
+DESCRIPTIONS = ['coffee', 'Coffee', 'bus', 'Apples', 'apples', 'Zoo', 'rent']
+CATEGORIES = ['Food', 'food', 'Transport', 'Fun']
+
+def random_expense(generator):
+    # Few distinct values, so the later keys and the row number break ties
+    return Expense(date(2024, 1, generator.randint(1, 5)).isoformat(), generator.choice(DESCRIPTIONS),
+                   generator.choice(CATEGORIES), generator.choice([100, 250, 250, 990]))
+
+def expected_order(rows, keys, indices):
+    """Reference sort: every key in turn, then the row number in the first key's direction."""
+    def value(row, column):
+        expense = rows[row]
+        if column == 'cents':
+            return expense.cents
+        if column == 'date':
+            return expense.date
+        return getattr(expense, column).casefold()
+    
+    order = sorted(indices, reverse=keys[0][1])
+    for column, descending in reversed(keys):
+        order.sort(key=lambda row: value(row, column), reverse=descending)
+    return order
+
+def all_keys():
+    """Every order over one or two columns in every direction, and a few over three."""
+    for size in (1, 2):
+        for columns in permutations(SORT_COLUMNS, size):
+            for directions in product((False, True), repeat=size):
+                yield tuple(zip(columns, directions))
+    yield (('category', False), ('date', True), ('cents', False))
+    yield (('cents', True), ('description', True), ('date', False))
+
+class SortIndexTest(unittest.TestCase):
+    def check(self, rows, query=None):
+        indices = (rows.search_index.search(query) if query is not None
+                   else [row for row in range(len(rows)) if row not in rows.deleted])
+        for keys in all_keys():
+            self.assertEqual(list(rows.sort_by(keys, query).indices), expected_order(rows, keys, indices), keys)
+    
+    def test_every_order_matches_a_full_sort(self):
+        generator = random.Random(3)
+        rows = ColumnarRows()
+        for _ in range(300):
+            rows.append(random_expense(generator))
+        self.check(rows)
+        self.check(rows, ExpenseQuery('o'))
+    
+    def test_orders_follow_appends_edits_and_deletions(self):
+        generator = random.Random(9)
+        rows = ColumnarRows()
+        for _ in range(200):
+            rows.append(random_expense(generator))
+        self.check(rows)
+        # Kept up to date in place from here on
+        for _ in range(50):
+            rows.append(random_expense(generator))
+        for row in generator.sample(range(250), 30):
+            rows.replace(row, random_expense(generator))
+        for row in generator.sample(range(250), 20):
+            rows.delete(row)
+        self.check(rows)
+        self.check(rows, ExpenseQuery('apples'))
+    
+    def test_sqlite_sorts_the_same_way(self):
+        generator = random.Random(4)
+        directory = tempfile.mkdtemp()
+        try:
+            ledger = ExpenseLedger(SQLiteStorage(os.path.join(directory, 'expenses.db')))
+            ledger.load()
+            rows = ColumnarRows()
+            expenses = [random_expense(generator) for _ in range(200)]
+            ledger.extend(expenses)
+            for expense in expenses:
+                rows.append(expense)
+            ledger.delete(7)
+            rows.delete(7)
+            for keys in all_keys():
+                self.assertEqual(list(ledger.sort_by(keys).indices), list(rows.sort_by(keys).indices), keys)
+            ledger.close()
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,437 @@
+"""Regression tests for the ledger storage backends."""
+import csv
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from ledger import (
+    CSVStorage, Expense, ExpenseLedger, ExpenseQuery, PartitionedStorage, SQLiteStorage, split_ledger
+)
+from ledger.categories import CategoryModel
+from ledger.storage import LedgerSnapshot, LedgerWriter, migrate_csv_to_sqlite, repair_torn_tail
+from ledger.config import EXPENSE_FIELDS, SNAPSHOT_SUFFIX
+
+class CSVStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'expenses.csv')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def write_csv(self, records):
+        with open(self.path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(EXPENSE_FIELDS)
+            writer.writerows(records)
+    
+    def load(self):
+        ledger = ExpenseLedger(CSVStorage(self.path))
+        ledger.load()
+        return ledger
+    
+    def test_close_before_load_keeps_rows(self):
+        self.write_csv([('2024-01-%02d' % day, f'Item {day}', 'Food', '1.00') for day in range(1, 21)])
+        # Closed before the first load finished: nothing may be checkpointed
+        ExpenseLedger(CSVStorage(self.path)).close()
+        ledger = self.load()
+        self.assertEqual(len(ledger), 20)
+        ledger.close()
+        
+        # Same once a snapshot exists and the CSV has grown since
+        with open(self.path, mode='a', newline='') as file:
+            csv.writer(file).writerow(('2024-02-01', 'Late', 'Food', '2.50'))
+        ExpenseLedger(CSVStorage(self.path)).close()
+        ledger = self.load()
+        self.assertEqual(len(ledger), 21)
+        self.assertEqual(ledger.total, 2250)
+        ledger.close()
+    
+    def test_unreadable_records_are_skipped_on_load_and_follow(self):
+        self.write_csv([('2024-01-01', 'Lunch', 'Food', '12.50'), ('2024-01-02', 'Broken', 'Food', 'twelve'),
+                        ('2024-01-03', 'Dinner', 'Food', '20.00')])
+        storage = CSVStorage(self.path)
+        ledger = ExpenseLedger(storage)
+        ledger.load()
+        self.assertEqual(storage.skipped, 1)
+        self.assertEqual([expense.description for expense in ledger], ['Lunch', 'Dinner'])
+        # Row IDs still match record numbers
+        ledger.delete(2)
+        ledger.close()
+        
+        # Another program appends a bad record: follow leaves it to a full load
+        with open(self.path, mode='a', newline='') as file:
+            csv.writer(file).writerows([('2024-01-04', 'Bad', 'Food', 'x'), ('2024-01-05', 'Tea', 'Food', '3.00')])
+        storage = CSVStorage(self.path)
+        ledger = ExpenseLedger(storage)
+        ledger.load()
+        self.assertEqual([expense.description for expense in ledger], ['Lunch', 'Tea'])
+        self.assertEqual(storage.skipped, 1)
+        with open(self.path, mode='a', newline='') as file:
+            csv.writer(file).writerow(('2024-01-06', 'Worse', 'Food', ''))
+        self.assertIsNone(ledger.follow())
+        ledger.load()
+        self.assertEqual(storage.skipped, 1)
+        self.assertEqual(len(ledger), 2)
+        ledger.close()
+    
+    def test_record_being_written_is_left_for_follow(self):
+        self.write_csv([('2024-01-01', 'Coffee', 'Food', '3.00')])
+        storage = CSVStorage(self.path)
+        # Another program is halfway through appending a record
+        with open(self.path, mode='ab') as file:
+            file.write(b'2024-01-02,Lunch,Food,12')
+        ledger = ExpenseLedger(storage)
+        ledger.load()
+        self.assertEqual([expense.cents for expense in ledger], [300])
+        with open(self.path, mode='ab') as file:
+            file.write(b'.50\r\n')
+        self.assertEqual(ledger.follow(), [Expense('2024-01-02', 'Lunch', 'Food', 1250)])
+        ledger.close()
+        
+        # The snapshot written before the record was complete doesn't hide it
+        ledger = self.load()
+        self.assertEqual([expense.cents for expense in ledger], [300, 1250])
+        self.assertEqual(ledger.storage.skipped, 0)
+        ledger.close()
+    
+    def append_tail(self, data, age):
+        with open(self.path, mode='ab') as file:
+            file.write(data)
+        when = time.time() - age
+        os.utime(self.path, (when, when))
+    
+    def test_only_stale_unreadable_tails_are_cut(self):
+        self.write_csv([('2024-01-01', 'Coffee', 'Food', '3.00')])
+        # Still being written by another program: left for follow
+        self.append_tail(b'2024-01-02,Lunch,Fo', 0)
+        self.assertEqual(repair_torn_tail(self.path), 0)
+        with open(self.path, mode='ab') as file:
+            file.write(b'od,12.50\r\n')
+        
+        # A complete record that only lacks its newline gets one
+        self.append_tail(b'2024-01-03,Tea,Food,2.00', 60)
+        self.assertEqual(repair_torn_tail(self.path), 0)
+        ledger = self.load()
+        self.assertEqual([expense.cents for expense in ledger], [300, 1250, 200])
+        ledger.append(Expense('2024-01-04', 'Cake', 'Food', 450))
+        ledger.close()
+        
+        # A torn record nobody is writing any more is moved aside
+        self.append_tail(b'2024-01-05,Din', 60)
+        ledger = self.load()
+        self.assertEqual(ledger.storage.repaired, len(b'2024-01-05,Din'))
+        self.assertEqual([expense.cents for expense in ledger], [300, 1250, 200, 450])
+        ledger.close()
+        with open(self.path + '.torn', 'rb') as file:
+            self.assertEqual(file.read(), b'2024-01-05,Din\n')
+
+class CompactionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'expenses.csv')
+        with open(self.path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(EXPENSE_FIELDS)
+            writer.writerows((f'2024-01-{day + 1:02d}', f'Item {day}', 'Food', f'{day + 1}.00') for day in range(10))
+        patcher = mock.patch('ledger.storage.COMPACT_CHANGES', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def compact(self, storage, meanwhile=None):
+        job = storage.start_compaction()
+        self.assertIsNotNone(job)
+        storage.compact(job)
+        if meanwhile:
+            meanwhile()
+        self.assertTrue(storage.finish_compaction(job))
+    
+    def test_row_ids_survive_compactions(self):
+        storage = CSVStorage(self.path)
+        ledger = ExpenseLedger(storage)
+        ledger.load()
+        ledger.delete(2)
+        ledger.update(5, Expense('2024-01-06', 'Item 5 edited', 'Food', 650))
+        
+        def meanwhile():
+            # Logged and appended while the compaction ran on the worker
+            ledger.delete(7)
+            ledger.append(Expense('2024-01-11', 'Item 10', 'Food', 1100))
+            ledger.flush()
+        
+        self.compact(storage, meanwhile)
+        self.assertEqual(list(storage.dropped), [2])
+        ledger.delete(3)
+        ledger.update(8, Expense('2024-01-09', 'Item 8 edited', 'Food', 850))
+        self.compact(storage)
+        self.assertEqual(list(storage.dropped), [2, 3, 7])
+        
+        # Rows after the dropped ones still reach their own records
+        self.assertEqual(storage.record(9), 6)
+        ledger.update(9, Expense('2024-01-10', 'Item 9 edited', 'Food', 950))
+        ledger.delete(10)
+        expected = ['Item 0', 'Item 1', 'Item 4', 'Item 5 edited', 'Item 6', 'Item 8 edited', 'Item 9 edited']
+        self.assertEqual([expense.description for expense in ledger], expected)
+        total = ledger.total
+        ledger.close()
+        
+        with open(self.path, newline='') as file:
+            self.assertEqual(len(list(csv.reader(file))), 1 + 8)
+        ledger = ExpenseLedger(CSVStorage(self.path))
+        ledger.load()
+        self.assertEqual([expense.description for expense in ledger], expected)
+        self.assertEqual(ledger.total, total)
+        ledger.close()
+    
+    def test_reload_drops_a_running_compaction(self):
+        storage = CSVStorage(self.path)
+        ledger = ExpenseLedger(storage)
+        ledger.load()
+        ledger.delete(0)
+        ledger.delete(1)
+        job = storage.start_compaction()
+        storage.compact(job)
+        ledger.load()
+        self.assertFalse(storage.finish_compaction(job))
+        self.assertEqual(len(ledger), 8)
+        ledger.close()
+
+class LedgerWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'expenses.csv')
+        open(self.path, 'wb').close()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def records(self):
+        with open(self.path, newline='') as file:
+            return list(csv.reader(file))
+    
+    def test_records_are_written_in_groups(self):
+        with mock.patch('os.fsync') as fsync:
+            writer = LedgerWriter(self.path, flush_rows=3, fsync='flush')
+            writer.write([('2024-01-01', 'A', 'Food', '1.00'), ('2024-01-02', 'B', 'Food', '2.00')])
+            self.assertEqual(self.records(), [])
+            writer.write([('2024-01-03', 'C', 'Food', '3.00')])
+            self.assertEqual(len(self.records()), 3)
+            self.assertEqual(fsync.call_count, 1)
+            
+            writer.write([('2024-01-04', 'D', 'Food', '4.00')])
+            writer.close()
+            self.assertEqual([record[1] for record in self.records()], ['A', 'B', 'C', 'D'])
+            self.assertEqual(fsync.call_count, 2)
+            self.assertEqual(writer.end, os.path.getsize(self.path))
+    
+    def test_fsync_policies(self):
+        for policy, syncs in (('never', 0), ('flush', 1), ('always', 3)):
+            open(self.path, 'wb').close()
+            with mock.patch('os.fsync') as fsync:
+                writer = LedgerWriter(self.path, flush_rows=10, fsync=policy)
+                for day in range(1, 4):
+                    writer.write([(f'2024-01-0{day}', 'A', 'Food', '1.00')])
+                    if policy == 'always':
+                        self.assertEqual(len(self.records()), day)
+                writer.close()
+            self.assertEqual(fsync.call_count, syncs, policy)
+            self.assertEqual(len(self.records()), 3)
+        with self.assertRaises(ValueError):
+            LedgerWriter(self.path, fsync='sometimes')
+    
+    def test_other_programs_appends_are_noticed(self):
+        writer = LedgerWriter(self.path, flush_rows=1, fsync='never')
+        writer.write([('2024-01-01', 'Ours', 'Food', '1.00')])
+        end = writer.end
+        with open(self.path, mode='a', newline='') as file:
+            csv.writer(file).writerow(('2024-01-02', 'Theirs', 'Food', '2.00'))
+        writer.write([('2024-01-03', 'Ours again', 'Food', '3.00')])
+        writer.close()
+        self.assertEqual(writer.foreign, [(end, os.path.getsize(self.path) - len(b'2024-01-03,Ours again,Food,3.00\r\n'))])
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'expenses.csv')
+        self.snapshot = LedgerSnapshot(self.path + SNAPSHOT_SUFFIX)
+        with open(self.path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(EXPENSE_FIELDS)
+            writer.writerows([('2024-01-01', 'Lunch', 'Food', '12.50'), ('2024-01-02', 'Bus', 'Transport', '2.00')])
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def load(self):
+        ledger = ExpenseLedger(CSVStorage(self.path))
+        ledger.load()
+        return ledger
+    
+    def parsed_from(self):
+        """Load the ledger and return it with the offset parsing started at."""
+        with mock.patch.object(CSVStorage, 'parse_from', autospec=True, side_effect=CSVStorage.parse_from) as parse:
+            ledger = self.load()
+        return ledger, parse.call_args[0][1]
+    
+    def test_unchanged_csv_loads_from_the_snapshot(self):
+        self.load().close()
+        rows, aggregates, offset, changes = self.snapshot.read(self.path)
+        self.assertEqual(offset, os.path.getsize(self.path))
+        self.assertEqual(list(rows), [Expense('2024-01-01', 'Lunch', 'Food', 1250),
+                                      Expense('2024-01-02', 'Bus', 'Transport', 200)])
+        self.assertEqual(aggregates.category_totals, {'Food': 1250, 'Transport': 200})
+        
+        ledger, start = self.parsed_from()
+        self.assertEqual(start, offset)
+        self.assertEqual(ledger.total, 1450)
+        ledger.close()
+    
+    def test_grown_csv_reuses_the_snapshot_as_a_prefix(self):
+        self.load().close()
+        size = os.path.getsize(self.path)
+        with open(self.path, mode='a', newline='') as file:
+            csv.writer(file).writerow(('2024-01-03', 'Tea', 'Food', '3.00'))
+        self.assertEqual(self.snapshot.read(self.path)[2], size)
+        ledger, start = self.parsed_from()
+        self.assertEqual(start, size)
+        self.assertEqual([expense.description for expense in ledger], ['Lunch', 'Bus', 'Tea'])
+        ledger.close()
+        self.assertEqual(self.snapshot.read(self.path)[2], os.path.getsize(self.path))
+    
+    def test_rewritten_csv_invalidates_the_snapshot(self):
+        self.load().close()
+        # Same size, different contents
+        with open(self.path, 'r+b') as file:
+            data = file.read()
+            file.seek(0)
+            file.write(data.replace(b'Lunch', b'Lunxh'))
+        self.assertIsNone(self.snapshot.read(self.path))
+        ledger, start = self.parsed_from()
+        self.assertEqual(start, 0)
+        self.assertEqual(ledger.rows[0].description, 'Lunxh')
+        ledger.close()
+        
+        # Edited to be shorter than the snapshot covers
+        with open(self.path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(EXPENSE_FIELDS)
+            writer.writerow(('2024-01-05', 'Cake', 'Food', '4.00'))
+        self.assertIsNone(self.snapshot.read(self.path))
+        ledger = self.load()
+        self.assertEqual(list(ledger), [Expense('2024-01-05', 'Cake', 'Food', 400)])
+        ledger.close()
+    
+    def test_damaged_snapshot_is_ignored(self):
+        self.load().close()
+        with open(self.snapshot.path, 'r+b') as file:
+            file.write(b'NOTSNAP!')
+        self.assertIsNone(self.snapshot.read(self.path))
+        with open(self.snapshot.path, 'wb') as file:
+            file.write(b'EXPSNAP3')
+        self.assertIsNone(self.snapshot.read(self.path))
+        ledger = self.load()
+        self.assertEqual(ledger.total, 1450)
+        ledger.close()
+        self.assertIsNotNone(self.snapshot.read(self.path))
+    
+    def test_changes_already_applied_are_not_replayed(self):
+        ledger = self.load()
+        ledger.update(0, Expense('2024-01-01', 'Lunch', 'Food', 1500))
+        ledger.delete(1)
+        ledger.close()
+        self.assertEqual(self.snapshot.read(self.path)[3], 2)
+        ledger = self.load()
+        self.assertEqual(list(ledger), [Expense('2024-01-01', 'Lunch', 'Food', 1500)])
+        self.assertEqual(ledger.total, 1500)
+        ledger.close()
+
+class SQLiteStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'expenses.db')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_search_results_keep_row_ids(self):
+        ledger = ExpenseLedger(SQLiteStorage(self.path))
+        ledger.load()
+        for number in range(10):
+            ledger.append(Expense('2024-01-01', 'Coffee' if number in (6, 8) else 'Other', 'Food', 100 + number))
+        results = ledger.search(ExpenseQuery('coffee'))
+        self.assertEqual([results.source_index(index) for index in range(len(results))], [6, 8])
+        ledger.delete(results.source_index(0))
+        self.assertEqual([expense.cents for expense in ledger.search(ExpenseQuery('coffee'))], [108])
+        ledger.close()
+    
+    def test_category_model_learns_live_rows(self):
+        ledger = ExpenseLedger(SQLiteStorage(self.path))
+        ledger.load()
+        for description in ('Coffee', 'Coffee beans', 'Bus ticket'):
+            ledger.append(Expense('2024-01-01', description, 'Transport' if 'Bus' in description else 'Food', 100))
+        ledger.delete(1)
+        model, length = CategoryModel.from_rows(ledger.rows)
+        self.assertEqual(length, 3)
+        self.assertEqual(model.counts['coffee'], {'Food': 1})
+        self.assertNotIn('beans', model.counts)
+        ledger.append(Expense('2024-01-02', 'Coffee', 'Food', 100))
+        model, length = CategoryModel.from_rows(ledger.rows)
+        self.assertEqual((length, model.counts['coffee']), (4, {'Food': 2}))
+        ledger.close()
+    
+    def test_failed_migration_leaves_no_database(self):
+        csv_path = os.path.join(self.directory, 'expenses.csv')
+        records = [('2024-01-01', 'Lunch', 'Food', '12.50'), ('2024-01-02', 'Broken', 'Food', 'twelve'),
+                   ('2024-01-03', 'Tea', 'Food', '2.00')]
+        with open(csv_path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(EXPENSE_FIELDS)
+            writer.writerows(records)
+        with mock.patch.object(SQLiteStorage, 'append_many', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                migrate_csv_to_sqlite(csv_path, self.path)
+        self.assertEqual([name for name in os.listdir(self.directory) if '.db' in name], [])
+        
+        # Unreadable records are left out and counted, not fatal
+        self.assertEqual(migrate_csv_to_sqlite(csv_path, self.path), 1)
+        self.assertIsNone(migrate_csv_to_sqlite(csv_path, self.path))
+        ledger = ExpenseLedger(SQLiteStorage(self.path))
+        ledger.load()
+        self.assertEqual(list(ledger), [Expense('2024-01-01', 'Lunch', 'Food', 1250),
+                                        Expense('2024-01-03', 'Tea', 'Food', 200)])
+        ledger.close()
+
+class PartitionedStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'expenses.csv')
+        self.partitions = os.path.join(self.directory, 'expenses')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_split_skips_unreadable_records(self):
+        with open(self.path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(EXPENSE_FIELDS)
+            writer.writerows([('2024-01-01', 'Lunch', 'Food', '12.50'), ('2024-01-02', 'Broken', 'Food', 'twelve'),
+                              ('2024-02-03', 'Tea', 'Food', '2.00')])
+        self.assertEqual(split_ledger(self.path, self.partitions, workers=1), 1)
+        self.assertIsNone(split_ledger(self.path, self.partitions, workers=1))
+        storage = PartitionedStorage(self.partitions)
+        ledger = ExpenseLedger(storage)
+        ledger.load()
+        storage.include(None)
+        ledger.load()
+        self.assertEqual(sorted(expense.description for expense in ledger), ['Lunch', 'Tea'])
+        self.assertEqual(ledger.total, 1450)
+        ledger.close()
+
+if __name__ == '__main__':
+    unittest.main()